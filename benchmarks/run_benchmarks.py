@@ -0,0 +1,407 @@
+#!/usr/bin/env python
+###################################
+# Script :
+# 1) Runs benchmarks of the hot paths
+# of the validation pipeline on the
+# bundled examples and synthetic entries
+# 2) Compares results with a baseline
+#
+###################################
+'''
+Benchmarks of the hot paths of the validation pipeline.
+
+Every benchmark runs on the bundled example entries and on synthetic
+scale-ups given as BEADS:MODELS:CROSSLINKS. Results are written as JSON
+and can be compared with a saved baseline:
+
+    python benchmarks/run_benchmarks.py --output baseline.json
+    python benchmarks/run_benchmarks.py --output new.json --baseline baseline.json
+
+Benchmarks whose dependencies are missing, or that do not apply to an
+entry (e.g. excluded volume for atomic models), are reported as skipped.
+'''
+import argparse
+import datetime
+import json
+import logging
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(Path(ROOT, 'ihm_validation')))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+import synthetic  # noqa: E402
+import archive  # noqa: E402
+from mmcif_io import ParsedSystem  # noqa: E402
+
+
+class Skip(Exception):
+    '''Benchmark does not apply or its dependencies are missing'''
+
+
+#########################
+# Benchmarks
+#########################
+# Every benchmark takes an entry dict and a work directory, does
+# untimed setup and returns the function to time
+
+def bench_parse(entry, workdir):
+    return lambda: ParsedSystem(entry['path'])
+
+
+def bench_excluded_volume(entry, workdir):
+    import excludedvolume
+    ev = excludedvolume.GetExcludedVolume(entry['path'], cache=workdir,
+                                          parsed=entry['parsed'])
+    if ev.check_sphere() < 1:
+        raise Skip('no spheres')
+    model_dict = ev.get_all_spheres()
+    return lambda: ev.run_exc_vol_parallel(model_dict, jobs=entry['jobs'])
+
+
+def get_cx(entry):
+    try:
+        import cx
+    except ImportError as e:
+        raise Skip(str(e))
+    cxv = cx.CxValidation(entry['path'], parsed=entry['parsed'])
+    if not hasattr(cxv, 'measured_restraints'):
+        raise Skip('no crosslinks')
+    return cxv
+
+
+def bench_cx_measure(entry, workdir):
+    cxv = get_cx(entry)
+    return cxv.get_measured_restraints
+
+
+def bench_cx_satisfaction(entry, workdir):
+    cxv = get_cx(entry)
+
+    def run():
+        cxv.get_stats_per_model_group()
+        cxv.get_per_model_satifaction_rates()
+    return run
+
+
+def get_quality_data(entry) -> dict:
+    '''exv-like input of the quality at a glance plot'''
+    n = len([m for sg in entry['parsed'].system.state_groups
+             for s in sg for g in s for m in g])
+    rng = np.random.default_rng(0)
+    return {'Models': list(range(1, n + 1)),
+            'Excluded Volume Satisfaction (%)': list(
+                np.round(rng.uniform(95, 100, n), 2)),
+            'Number of violations': list(rng.integers(0, 100, n))}
+
+
+def bench_figure_export(entry, workdir):
+    try:
+        import get_plots
+    except ImportError as e:
+        raise Skip(str(e))
+    exv = get_quality_data(entry)
+    plots = get_plots.Plots(entry['path'], workdir, driver=None,
+                            parsed=entry['parsed'])
+    return lambda: plots.plot_quality_at_glance({}, exv, {}, {}, None)
+
+
+def get_template_dict(entry, workdir) -> dict:
+    '''template dictionary of the report stages that
+    do not need external tools other than molprobity'''
+    try:
+        from report import WriteReport
+    except ImportError as e:
+        raise Skip(str(e))
+    report = WriteReport(entry['path'], db=workdir, driver=None,
+                         cache=workdir)
+    template_dict = {'date': 'benchmark', 'html_mode': 'local'}
+    template_dict = report.run_entry_composition(template_dict)
+    try:
+        template_dict, _, _ = report.run_model_quality(
+            template_dict, csvDirName=workdir, htmlDirName=workdir)
+    except (OSError, subprocess.CalledProcessError) as e:
+        # molprobity is not installed
+        raise Skip(f'model quality: {e}')
+    template_dict, _, _ = report.run_sas_validation(template_dict)
+    template_dict, _, _ = report.run_cx_validation(template_dict)
+    return report.run_supplementary_table(template_dict)
+
+
+def bench_template_render(entry, workdir):
+    try:
+        import rendering
+    except ImportError as e:
+        raise Skip(str(e))
+    template_dict = get_template_dict(entry, workdir)
+    names = [n for n in sorted(os.listdir(Path(ROOT, 'templates')))
+             if n.endswith('.html') and n != 'layout.html'
+             and n != 'macro.html']
+    cache_dir = str(Path(workdir, 'templates'))
+
+    def run():
+        for name, text in rendering.iter_pages(template_dict, names,
+                                               cache_dir=cache_dir):
+            pass
+    return run
+
+
+def bench_archive_write(entry, workdir):
+    # Output-like tree: static resources and some pages
+    base = Path(workdir, 'archive')
+    shutil.rmtree(base, ignore_errors=True)
+    html = Path(base, 'entry', 'htmls')
+    shutil.copytree(Path(ROOT, 'static'), Path(html, 'static'))
+    for name in os.listdir(Path(ROOT, 'templates')):
+        shutil.copy(Path(ROOT, 'templates', name), html)
+    shutil.copy(entry['path'], html)
+
+    def run():
+        with archive.ArchiveWriter(str(Path(workdir, 'entry_html'))) as sink:
+            sink.add_tree('entry', Path(base, 'entry'))
+    return run
+
+
+def bench_sas_intensities(entry, workdir):
+    try:
+        import sas
+    except ImportError as e:
+        raise Skip(str(e))
+    code = 'SASDBENCH'
+    blocks = synthetic.make_sascif(code, points=entry['points'], fits=0)
+    sasv = sas.SasValidation.__new__(sas.SasValidation)
+    sasv.sasbdb_ids = [code]
+    sasv.sascif_dicts = {code: blocks}
+
+    def run():
+        sasv.intensities = sasv.get_intensities()
+        sasv.intensities = sasv.modify_intensity()
+    return run
+
+
+def bench_sas_pvalues(entry, workdir):
+    try:
+        import sas
+    except ImportError as e:
+        raise Skip(str(e))
+    code = 'SASDBENCH'
+    blocks = synthetic.make_sascif(code, points=entry['points'], fits=5)
+    sasv = sas.SasValidation.__new__(sas.SasValidation)
+    sasv.sasbdb_ids = [code]
+    sasv.sascif_dicts = {code: blocks}
+    sasv.pvalue_backend = 'cormap'
+    return sasv.get_pvals
+
+
+# Benchmarks of mmCIF entries
+ENTRY_BENCHMARKS = {
+    'parse': bench_parse,
+    'excluded_volume': bench_excluded_volume,
+    'cx_measure': bench_cx_measure,
+    'cx_satisfaction': bench_cx_satisfaction,
+    'figure_export': bench_figure_export,
+    'template_render': bench_template_render,
+    'archive_write': bench_archive_write,
+}
+
+# Benchmarks of SAS profiles with a given number of points
+SAS_BENCHMARKS = {
+    'sas_intensities': bench_sas_intensities,
+    'sas_pvalues': bench_sas_pvalues,
+}
+
+
+#########################
+# Runner
+#########################
+
+def time_function(func, repeat: int) -> dict:
+    '''run func repeat times after one warm-up run'''
+    func()
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return {'times_s': [round(t, 6) for t in times],
+            'min_s': round(min(times), 6),
+            'median_s': round(statistics.median(times), 6)}
+
+
+def run_benchmark(name: str, bench, entry: dict, workdir: str,
+                  repeat: int) -> dict:
+    try:
+        func = bench(entry, workdir)
+        result = time_function(func, repeat)
+    except Skip as e:
+        logging.info(f'Skipping {name}[{entry["name"]}]: {e}')
+        return {'skipped': str(e)}
+    logging.info(f'{name}[{entry["name"]}]: {result["median_s"]:.4f} s')
+    return result
+
+
+def parse_scale(value: str) -> dict:
+    try:
+        beads, models, crosslinks = (int(x) for x in value.split(':'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            f'Scale should be BEADS:MODELS:CROSSLINKS, not {value}')
+    return {'beads': beads, 'models': models, 'crosslinks': crosslinks}
+
+
+def get_entries(args, workdir: str) -> list:
+    entries = [{'name': Path(fn).stem, 'path': str(fn)} for fn in args.entries]
+    for scale in args.scale:
+        name = 'synthetic-{beads}-{models}-{crosslinks}'.format(**scale)
+        fn = synthetic.write_entry(Path(workdir, f'{name}.cif'),
+                                   seed=args.seed, **scale)
+        entries.append({'name': name, 'path': fn, 'synthetic': scale})
+    return entries
+
+
+def get_metadata(args) -> dict:
+    try:
+        commit = subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], cwd=ROOT,
+            stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'date': datetime.datetime.now().isoformat(timespec='seconds'),
+        'commit': commit,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'numpy': np.__version__,
+        'repeat': args.repeat,
+        'jobs': args.jobs,
+        'seed': args.seed,
+    }
+
+
+def print_results(results: dict) -> None:
+    '''print median and minimum times of all benchmarks'''
+    print(f'{"benchmark":<56} {"median":>10} {"min":>10}')
+    for name, result in results.items():
+        if 'median_s' in result:
+            print(f'{name:<56} {result["median_s"]:>10.4f} {result["min_s"]:>10.4f}')
+        else:
+            print(f'{name:<56} skipped: {result["skipped"]}')
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    '''print median times relative to the baseline,
+    returns names of benchmarks slower than 1 + tolerance'''
+    regressions = []
+    print(f'{"benchmark":<56} {"baseline":>10} {"current":>10} {"ratio":>7}')
+    for name, result in results.items():
+        old = baseline.get(name, {})
+        if 'median_s' not in result or 'median_s' not in old:
+            continue
+        ratio = result['median_s'] / old['median_s'] if old['median_s'] else float('inf')
+        flag = ''
+        if ratio > 1 + tolerance:
+            flag = ' slower'
+            regressions.append(name)
+        elif ratio < 1 - tolerance:
+            flag = ' faster'
+        print(f'{name:<56} {old["median_s"]:>10.4f} '
+              f'{result["median_s"]:>10.4f} {ratio:>7.2f}{flag}')
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--entries', nargs='*',
+                        default=sorted(str(x) for x in Path(ROOT, 'example').glob('*.cif')),
+                        help="mmCIF entries. Default is the bundled examples")
+    parser.add_argument('--scale', nargs='*', type=parse_scale,
+                        default=[parse_scale('1000:5:200'),
+                                 parse_scale('5000:10:1000')],
+                        help="Synthetic entries as BEADS:MODELS:CROSSLINKS")
+    parser.add_argument('--sas-points', nargs='*', type=int,
+                        default=[500, 5000],
+                        help="Number of points of synthetic SAS profiles")
+    parser.add_argument('--only', nargs='*', default=None,
+                        help="Run only these benchmarks")
+    parser.add_argument('--repeat', type=int, default=3,
+                        help="Number of timed runs of every benchmark")
+    parser.add_argument('--jobs', type=int, default=1,
+                        help="Number of worker processes for parallel stages")
+    parser.add_argument('--seed', type=int, default=0,
+                        help="Seed of synthetic entries")
+    parser.add_argument('--workdir', type=str, default=None,
+                        help="Directory for synthetic entries and outputs. "
+                        "Default is a temporary directory")
+    parser.add_argument('--output', type=str, default=None,
+                        help="Write results to this JSON file")
+    parser.add_argument('--baseline', type=str, default=None,
+                        help="Compare results with this JSON file")
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help="Relative slowdown reported as a regression")
+    parser.add_argument('--fail-on-regression', action='store_true',
+                        help="Exit with 1 if any benchmark is slower than the baseline")
+    parser.add_argument('-v', '--verbose', action='store_true',
+                        help="Log every benchmark as it finishes")
+    args = parser.parse_args(argv)
+
+    level = logging.INFO if args.verbose else logging.WARNING
+    logging.basicConfig(level=level)
+    logging.getLogger().setLevel(level)
+
+    tmpdir = None
+    if args.workdir is None:
+        tmpdir = tempfile.TemporaryDirectory()
+        workdir = tmpdir.name
+    else:
+        workdir = args.workdir
+        Path(workdir).mkdir(parents=True, exist_ok=True)
+
+    results = {}
+    try:
+        for entry in get_entries(args, workdir):
+            entry['parsed'] = ParsedSystem(entry['path'])
+            entry['jobs'] = args.jobs
+            for name, bench in ENTRY_BENCHMARKS.items():
+                if args.only is None or name in args.only:
+                    results[f'{name}[{entry["name"]}]'] = run_benchmark(
+                        name, bench, entry, workdir, args.repeat)
+
+        for points in args.sas_points:
+            entry = {'name': f'synthetic-{points}', 'points': points}
+            for name, bench in SAS_BENCHMARKS.items():
+                if args.only is None or name in args.only:
+                    results[f'{name}[{entry["name"]}]'] = run_benchmark(
+                        name, bench, entry, workdir, args.repeat)
+    finally:
+        if tmpdir is not None:
+            tmpdir.cleanup()
+
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump({'metadata': get_metadata(args), 'results': results},
+                      f, indent=2)
+
+    if args.baseline is None:
+        print_results(results)
+    else:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions and args.fail_on_regression:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,382 @@
+#!/usr/bin/env python
+###################################
+# Script :
+# 1) Contains generator of synthetic
+# IHM entries for benchmarks and
+# stress tests
+# 2) Contains generator of matching
+# synthetic SASCIF files
+#
+###################################
+'''
+Synthetic IHM entries and SASCIF files of any size.
+
+Entries are written with python-ihm and can be validated like real
+depositions. SAS datasets refer to SASCIF files written to the
+SASBDB subdirectory of --db, the layout read by SasValidation:
+
+    python benchmarks/synthetic.py large.cif --beads 50000 --models 100 \\
+        --crosslinks 5000 --sas 2 --db databases
+
+The same parameters and seed always give the same files.
+'''
+import argparse
+from pathlib import Path
+
+import numpy as np
+import ihm
+import ihm.cross_linkers
+import ihm.dataset
+import ihm.dumper
+import ihm.location
+import ihm.model
+import ihm.protocol
+import ihm.representation
+import ihm.restraint
+
+AMINO_ACIDS = 'ACDEFGHIKLMNPQRSTVWY'
+
+# Distance between consecutive beads and bead radius, Angstrom
+BOND_LENGTH = 3.8
+BEAD_RADIUS = 2.5
+
+# Backbone atoms of atomic residues, offsets from the bead, Angstrom
+BACKBONE = (('N', 'N', (-1.2, 0.6, 0.)),
+            ('CA', 'C', (0., 0., 0.)),
+            ('C', 'C', (1.2, 0.6, 0.)),
+            ('O', 'O', (1.5, 1.8, 0.)))
+
+
+def get_sas_code(i: int) -> str:
+    '''SASBDB code of the i-th synthetic SAS dataset'''
+    return f'SASDZ{i + 1:02d}'
+
+
+def make_system(beads: int = 1000, models: int = 5, crosslinks: int = 100,
+                chains: int = None, model_groups: int = 1, states: int = 1,
+                atomic: int = 0, rigid_bodies: int = 0, sas: int = 0,
+                seed: int = 0) -> ihm.System:
+    """
+    Build an IHM system of coarse-grained models, one bead per residue.
+    beads are split between chains of separate entities, models are
+    random walks with per-model noise and crosslinks connect random
+    or sequence-local pairs of residues with a 30 A upper bound.
+
+    Models are split between model_groups, model groups between
+    states. The first atomic residues of every chain have backbone
+    atoms instead of beads. rigid_bodies coarse segments move as
+    a whole between models. sas adds SAS datasets and restraints
+    with codes from get_sas_code.
+    The same parameters and seed always give the same system.
+    """
+    if not 1 <= states <= model_groups <= models:
+        raise ValueError(
+            'Expected 1 <= states <= model_groups <= models, '
+            f'got {states}, {model_groups}, {models}')
+    rng = np.random.default_rng(seed)
+    if chains is None:
+        chains = max(1, min(26, beads // 500))
+    lengths = [len(x) for x in np.array_split(np.arange(beads), chains)]
+
+    system = ihm.System(id=f'SYNTHETIC_{beads}_{models}_{crosslinks}')
+    asyms = []
+    for i, n in enumerate(lengths):
+        seq = ''.join(rng.choice(list(AMINO_ACIDS), size=n))
+        entity = ihm.Entity(seq, description=f'Protein {i + 1}')
+        system.entities.append(entity)
+        asym = ihm.AsymUnit(entity, details=f'Subunit {i + 1}',
+                            id=chr(ord('A') + i))
+        system.asym_units.append(asym)
+        asyms.append(asym)
+
+    assembly = ihm.Assembly(asyms, name='Complete assembly')
+
+    # Atomic N-terminus, then alternating rigid and flexible coarse segments
+    segments = []
+    rigid = []
+    rigid_per_chain = [len(x) for x in np.array_split(np.arange(rigid_bodies),
+                                                      chains)]
+    for asym, n, nrigid in zip(asyms, lengths, rigid_per_chain):
+        natomic = min(atomic, n)
+        if natomic > 0:
+            segments.append(ihm.representation.AtomicSegment(
+                asym(1, natomic), rigid=False))
+        coarse = np.arange(natomic + 1, n + 1)
+        if len(coarse) == 0:
+            # Fully atomic chain
+            if nrigid > 0:
+                raise ValueError(
+                    f'No coarse residues for {nrigid} rigid bodies in chain '
+                    f'{asym.id} of {n} residues with {atomic} atomic residues')
+            continue
+        pieces = max(1, min(2 * nrigid, len(coarse)))
+        for i, piece in enumerate(np.array_split(coarse, pieces)):
+            is_rigid = i % 2 == 0 and nrigid > 0
+            segments.append(ihm.representation.ResidueSegment(
+                asym(int(piece[0]), int(piece[-1])), rigid=is_rigid,
+                primitive='sphere'))
+            if is_rigid:
+                rigid.append((asym, int(piece[0]), int(piece[-1])))
+    rep = ihm.representation.Representation(segments)
+
+    location = ihm.location.InputFileLocation(
+        'crosslinks.csv', repo=ihm.location.Repository(doi='10.5281/zenodo.0'))
+    xl_dataset = ihm.dataset.CXMSDataset(location)
+    sas_datasets = [ihm.dataset.SASDataset(
+        ihm.location.SASBDBLocation(get_sas_code(i))) for i in range(sas)]
+
+    protocol = ihm.protocol.Protocol(name='Modeling')
+    protocol.steps.append(ihm.protocol.Step(
+        assembly=assembly,
+        dataset_group=ihm.dataset.DatasetGroup([xl_dataset] + sas_datasets),
+        method='Monte Carlo', num_models_begin=0, num_models_end=models))
+
+    # Every chain is a random walk, models differ by noise
+    base = {a: np.cumsum(rng.normal(0, BOND_LENGTH / np.sqrt(3), (n, 3)), axis=0)
+            for a, n in zip(asyms, lengths)}
+    model_list = []
+    for m in range(models):
+        model = ihm.model.Model(assembly=assembly, protocol=protocol,
+                                representation=rep, name=f'Model {m + 1}')
+        coords = {a: xyz + rng.normal(0, 2., xyz.shape)
+                  for a, xyz in base.items()}
+        # Rigid bodies keep their shape and are only shifted
+        for asym, start, end in rigid:
+            coords[asym][start - 1:end] = (base[asym][start - 1:end]
+                                           + rng.normal(0, 2., 3))
+        for asym, xyz in coords.items():
+            for seq_id, (x, y, z) in enumerate(xyz, 1):
+                if seq_id <= atomic:
+                    for atom_id, element, (dx, dy, dz) in BACKBONE:
+                        model.add_atom(ihm.model.Atom(
+                            asym_unit=asym, seq_id=seq_id, atom_id=atom_id,
+                            type_symbol=element, x=x + dx, y=y + dy, z=z + dz))
+                else:
+                    model.add_sphere(ihm.model.Sphere(
+                        asym_unit=asym, seq_id_range=(seq_id, seq_id),
+                        x=x, y=y, z=z, radius=BEAD_RADIUS))
+        model_list.append(model)
+
+    # Split indices, numpy would unpack the list-like groups
+    groups = [ihm.model.ModelGroup([model_list[j] for j in x],
+                                   name=f'Cluster {i + 1}')
+              for i, x in enumerate(np.array_split(np.arange(models),
+                                                   model_groups))]
+    system.state_groups.append(ihm.model.StateGroup(
+        [ihm.model.State([groups[j] for j in x], name=f'State {i + 1}')
+         for i, x in enumerate(np.array_split(np.arange(model_groups),
+                                              states))]))
+
+    if crosslinks > 0:
+        system.orphan_datasets.append(xl_dataset)
+        restraint = ihm.restraint.CrossLinkRestraint(xl_dataset,
+                                                     ihm.cross_linkers.dss)
+        for _ in range(crosslinks):
+            a1, a2 = rng.choice(len(asyms), size=2)
+            r1 = int(rng.integers(1, lengths[a1] + 1))
+            if rng.random() < 0.5:
+                # Residues close in sequence are mostly satisfied
+                a2 = a1
+                r2 = int(np.clip(r1 + rng.integers(-20, 21), 1, lengths[a1]))
+            else:
+                r2 = int(rng.integers(1, lengths[a2] + 1))
+            asym1, asym2 = asyms[a1], asyms[a2]
+            exl = ihm.restraint.ExperimentalCrossLink(
+                asym1.entity.residue(r1), asym2.entity.residue(r2))
+            restraint.experimental_cross_links.append([exl])
+            restraint.cross_links.append(ihm.restraint.ResidueCrossLink(
+                exl, asym1, asym2,
+                distance=ihm.restraint.UpperBoundDistanceRestraint(30.),
+                psi=0.05, sigma1=1., sigma2=1.))
+        system.restraints.append(restraint)
+
+    for dataset in sas_datasets:
+        system.orphan_datasets.append(dataset)
+        restraint = ihm.restraint.SASRestraint(
+            dataset, assembly, segment=False, fitting_method='FoXS',
+            fitting_atom_type='Heavy atoms', multi_state=False)
+        # Restraints are written only with at least one fitted model
+        restraint.fits[model_list[0]] = ihm.restraint.SASRestraintFit(
+            chi_value=round(float(rng.uniform(1., 3.)), 2))
+        system.restraints.append(restraint)
+
+    return system
+
+
+def write_entry(filename, db=None, sas_points: int = 500, sas_fits: int = 1,
+                **kwargs) -> str:
+    """
+    Write a synthetic system (see make_system) to an mmCIF file.
+    SASCIF files of its SAS datasets are written to db/SASBDB
+    """
+    system = make_system(**kwargs)
+    with open(filename, 'w') as fh:
+        ihm.dumper.write(fh, [system])
+    if db is not None:
+        for i in range(kwargs.get('sas', 0)):
+            code = get_sas_code(i)
+            write_sascif(Path(db, 'SASBDB', f'{code}.sascif'), code,
+                         points=sas_points, fits=sas_fits,
+                         seed=kwargs.get('seed', 0) + i)
+    return str(filename)
+
+
+#########################
+# SASCIF
+#########################
+
+def make_sascif(code: str, points: int = 500, fits: int = 1, rg: float = 3.0,
+                seed: int = 0) -> dict:
+    """
+    Build SASCIF data blocks of a SASBDB entry in the layout returned
+    by sasciftools: {block: {category: {item: value or list of values}}}.
+    The profile is a Gaussian chain of radius of gyration rg (nm) with
+    1% noise, fit k deviates from it by 2k%.
+    """
+    rng = np.random.default_rng(seed)
+    i0 = 1000.
+    q = np.linspace(0.2 / rg, 8. / rg, points)
+    x = (q * rg) ** 2
+    intensity = i0 * 2 * (np.exp(-x) + x - 1) / x ** 2
+    error = 0.01 * intensity + 0.001 * i0
+    observed = intensity + rng.normal(0, 1, points) * error
+    ids = [str(i) for i in range(1, points + 1)]
+
+    def fmt(values, digits=6):
+        return [f'{v:.{digits}g}' for v in values]
+
+    # Homogeneous sphere with the same radius of gyration, Angstrom
+    dmax = 2 * rg / np.sqrt(0.6)
+    r = np.linspace(0, dmax * 10, 101)
+    p = r ** 2 * (1 - 1.5 * r / (dmax * 10) + 0.5 * (r / (dmax * 10)) ** 3)
+    p = p / p.max()
+
+    main = {
+        '_sas_scan': {'id': '1', 'unit': '1/nm'},
+        '_sas_scan_intensity': {
+            'id': ids,
+            'scan_id': ['1'] * points,
+            'momentum_transfer': fmt(q),
+            'intensity': fmt(observed),
+            'intensity_su_counting': fmt(error),
+        },
+        '_sas_result': {
+            'Rg_from_Guinier': f'{rg * 1.01:.3f}',
+            'Rg_from_Guinier_error': f'{rg * 0.01:.3f}',
+            'Rg_from_PR': f'{rg:.3f}',
+            'Rg_from_PR_error': f'{rg * 0.005:.3f}',
+            'I0_from_PR': f'{i0:.1f}',
+            'D_max': f'{dmax:.3f}',
+            'Dmax_error': f'{dmax * 0.02:.3f}',
+            'MW_standard': '55.0',
+            'MW_standard_error': '2.5',
+            'experimental_MW': '52.0',
+            'MW_Porod': '50.0',
+            'Porod_volume': '90.0',
+            'estimated_volume': '85.0',
+        },
+        '_sas_sample': {
+            'specimen_concentration': '2.0',
+            'contrast': '2.9',
+            'specific_vol': '0.74',
+        },
+        '_sas_p_of_R_details': {'software_p_of_R': 'GNOM'},
+        '_sas_p_of_R': {
+            'id': [str(i) for i in range(1, len(r) + 1)],
+            'ordinal': [str(i) for i in range(1, len(r) + 1)],
+            'r': fmt(r),
+            'P': fmt(p),
+            'P_error': fmt(0.01 * p + 0.001),
+        },
+        '_sas_p_of_R_extrapolated_intensity': {
+            'id': ids,
+            'momentum_transfer': fmt(q),
+            'intensity_reg': fmt(intensity),
+        },
+    }
+    blocks = {f'{code}_MAIN': main}
+
+    for k in range(1, fits + 1):
+        fit = intensity * (1 + 0.02 * k * np.sin(q * rg))
+        chi_square = np.mean(((observed - fit) / error) ** 2)
+        blocks[f'{code}_FIT{k}'] = {
+            '_sas_model_fitting_details': {
+                'id': str(k),
+                'software': 'CRYSOL',
+                'chi_square': f'{chi_square:.3f}',
+            },
+            '_sas_model_fitting': {
+                'id': ids,
+                'ordinal': ids,
+                'momentum_transfer': fmt(q),
+                'intensity': fmt(observed),
+                'fit': fmt(fit),
+            },
+        }
+    return blocks
+
+
+def write_sascif(filename, code: str, **kwargs) -> str:
+    """Write synthetic SASCIF data blocks (see make_sascif) to a file"""
+    Path(filename).parent.mkdir(parents=True, exist_ok=True)
+    with open(filename, 'w') as fh:
+        for block, categories in make_sascif(code, **kwargs).items():
+            fh.write(f'data_{block}\n#\n')
+            for category, items in categories.items():
+                if isinstance(next(iter(items.values())), list):
+                    fh.write('loop_\n')
+                    for item in items:
+                        fh.write(f'{category}.{item}\n')
+                    for row in zip(*items.values()):
+                        fh.write(' '.join(row) + '\n')
+                else:
+                    width = max(len(x) for x in items) + len(category) + 2
+                    for item, value in items.items():
+                        fh.write(f'{category + "." + item:<{width}} {value}\n')
+                fh.write('#\n')
+    return str(filename)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('output', type=str, help="Output mmCIF file")
+    parser.add_argument('--beads', type=int, default=1000,
+                        help="Number of residues, one bead each")
+    parser.add_argument('--models', type=int, default=5,
+                        help="Number of models")
+    parser.add_argument('--model-groups', type=int, default=1,
+                        help="Number of model groups")
+    parser.add_argument('--states', type=int, default=1,
+                        help="Number of states")
+    parser.add_argument('--crosslinks', type=int, default=100,
+                        help="Number of crosslinks")
+    parser.add_argument('--chains', type=int, default=None,
+                        help="Number of chains. Default is one per 500 beads")
+    parser.add_argument('--atomic', type=int, default=0,
+                        help="Number of atomic residues at the start of every chain")
+    parser.add_argument('--rigid-bodies', type=int, default=0,
+                        help="Number of rigid bodies")
+    parser.add_argument('--sas', type=int, default=0,
+                        help="Number of SAS datasets")
+    parser.add_argument('--sas-points', type=int, default=500,
+                        help="Number of points of every SAS profile")
+    parser.add_argument('--sas-fits', type=int, default=1,
+                        help="Number of fits of every SAS profile")
+    parser.add_argument('--db', type=str, default='.',
+                        help="Directory for SASCIF files, "
+                        "same as --databases-root of the validator")
+    parser.add_argument('--seed', type=int, default=0,
+                        help="Random seed")
+    args = parser.parse_args(argv)
+
+    write_entry(args.output, db=args.db, sas_points=args.sas_points,
+                sas_fits=args.sas_fits, beads=args.beads, models=args.models,
+                model_groups=args.model_groups, states=args.states,
+                crosslinks=args.crosslinks, chains=args.chains,
+                atomic=args.atomic, rigid_bodies=args.rigid_bodies,
+                sas=args.sas, seed=args.seed)
+
+
+if __name__ == '__main__':
+    main()
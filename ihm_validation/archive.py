@@ -0,0 +1,239 @@
+###################################
+# Script :
+# 1) Contains output sinks writing
+# report files to a compressed archive
+# or to a directory
+#
+###################################
+import gzip
+import io
+import logging
+import os
+import queue
+import shutil
+import subprocess
+import tarfile
+import threading
+import time
+from pathlib import Path
+
+# Compressor name: (archive extension, command of external compressor).
+# {jobs} is replaced with the number of compression threads
+COMPRESSORS = {
+    'gzip': ('tar.gz', None),
+    'pigz': ('tar.gz', ['pigz', '-c', '-p', '{jobs}']),
+    'zstd': ('tar.zst', ['zstd', '-c', '-q', '-T{jobs}']),
+    'xz': ('tar.xz', ['xz', '-c', '-T{jobs}']),
+    'none': ('tar', None),
+}
+
+
+def get_compressor(name: str = 'auto') -> str:
+    """
+    Resolve compressor name. 'auto' selects multithreaded pigz if it is
+    installed and the built-in gzip otherwise, both produce .tar.gz
+    """
+    if name == 'auto':
+        return 'pigz' if shutil.which('pigz') is not None else 'gzip'
+    if name not in COMPRESSORS:
+        raise ValueError(f'Unknown compressor {name}. '
+                         f'Use one of: auto, {", ".join(COMPRESSORS)}')
+    command = COMPRESSORS[name][1]
+    if command is not None and shutil.which(command[0]) is None:
+        raise ValueError(f'Compressor {name} is not installed')
+    return name
+
+
+def get_archive_name(base_name: str, compressor: str = 'auto') -> str:
+    """Name of the archive, base_name with the compressor's extension"""
+    return f'{base_name}.{COMPRESSORS[get_compressor(compressor)][0]}'
+
+
+def link_or_copy(src, dst) -> bool:
+    """Hard link src to dst, copy it if linking fails. Returns True if linked"""
+    try:
+        os.link(src, dst)
+        return True
+    except OSError:
+        shutil.copyfile(src, dst)
+        return False
+
+
+class _ThreadedGzip(io.RawIOBase):
+    """
+    Write-only file compressing data with gzip in a background thread.
+    zlib releases the GIL, so compression overlaps with producing data.
+    """
+
+    def __init__(self, fileobj, maxsize: int = 64):
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._error = None
+        self._thread = threading.Thread(
+            target=self._run, args=(gzip.GzipFile(fileobj=fileobj, mode='wb'),),
+            daemon=True)
+        self._thread.start()
+
+    def _run(self, gz):
+        try:
+            while True:
+                data = self._queue.get()
+                if data is None:
+                    break
+                if self._error is None:
+                    gz.write(data)
+            gz.close()
+        except BaseException as e:
+            self._error = e
+            # Keep consuming so that the writer does not block
+            while self._queue.get() is not None:
+                pass
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        if self._error is not None:
+            raise self._error
+        self._queue.put(bytes(data))
+        return len(data)
+
+    def close(self):
+        if not self.closed:
+            self._queue.put(None)
+            self._thread.join()
+            super().close()
+            if self._error is not None:
+                raise self._error
+
+
+class ArchiveWriter(object):
+    """
+    Output sink streaming files into a compressed tar archive.
+
+    Files are compressed while the report is produced and are never
+    written uncompressed. The archive is written to a temporary file
+    and moved to its final name when the writer is closed without errors.
+    """
+
+    def __init__(self, base_name: str, compressor: str = 'auto',
+                 jobs: int = None):
+        """
+        base_name: name of the archive without extension
+        compressor: one of COMPRESSORS or 'auto'
+        jobs: number of compression threads of external compressors
+        """
+        self.compressor = get_compressor(compressor)
+        self.filename = get_archive_name(base_name, self.compressor)
+        command = COMPRESSORS[self.compressor][1]
+        jobs = jobs if jobs is not None else os.cpu_count()
+
+        self._tmp = f'{self.filename}.tmp'
+        self._out = open(self._tmp, 'wb')
+        self._process = None
+        self._stream = None
+        if command is not None:
+            self._process = subprocess.Popen(
+                [c.format(jobs=jobs) for c in command],
+                stdin=subprocess.PIPE, stdout=self._out)
+            fileobj = self._process.stdin
+        elif self.compressor == 'gzip':
+            self._stream = _ThreadedGzip(self._out)
+            fileobj = self._stream
+        else:
+            fileobj = self._out
+        # Large blocks keep the number of writes to the compressor low
+        self._tar = tarfile.open(fileobj=fileobj, mode='w|', bufsize=1 << 20)
+
+    def add_bytes(self, arcname: str, data: bytes) -> None:
+        info = tarfile.TarInfo(arcname)
+        info.size = len(data)
+        info.mtime = int(time.time())
+        info.mode = 0o644
+        self._tar.addfile(info, io.BytesIO(data))
+
+    def add_text(self, arcname: str, text: str) -> None:
+        self.add_bytes(arcname, text.encode('utf-8'))
+
+    def add_file(self, arcname: str, filename) -> None:
+        self._tar.add(str(filename), arcname=arcname, recursive=False)
+
+    def add_tree(self, arcname: str, dirname) -> None:
+        """Add a directory with all its files"""
+        self._tar.add(str(dirname), arcname=arcname)
+
+    def close(self) -> None:
+        """Finish the archive and move it to its final name"""
+        try:
+            self._tar.close()
+            if self._process is not None:
+                self._process.stdin.close()
+                if self._process.wait() != 0:
+                    raise RuntimeError(f'{self.compressor} failed with exit code '
+                                       f'{self._process.returncode}')
+            elif self._stream is not None:
+                self._stream.close()
+        except BaseException:
+            self.abort()
+            raise
+        self._out.close()
+        os.replace(self._tmp, self.filename)
+
+    def abort(self) -> None:
+        """Stop writing and remove the incomplete archive"""
+        if self._process is not None:
+            self._process.kill()
+            self._process.wait()
+        elif self._stream is not None:
+            try:
+                self._stream.close()
+            except Exception:
+                pass
+        self._out.close()
+        try:
+            os.remove(self._tmp)
+        except OSError:
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            logging.error(f'Removing incomplete archive {self.filename}')
+            self.abort()
+
+
+class DirectoryWriter(object):
+    """Output sink writing files to a directory, same interface as ArchiveWriter"""
+
+    def __init__(self, root):
+        self.root = Path(root)
+
+    def _path(self, arcname: str) -> Path:
+        path = Path(self.root, arcname)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        return path
+
+    def add_bytes(self, arcname: str, data: bytes) -> None:
+        with open(self._path(arcname), 'wb') as f:
+            f.write(data)
+
+    def add_text(self, arcname: str, text: str) -> None:
+        self.add_bytes(arcname, text.encode('utf-8'))
+
+    def add_file(self, arcname: str, filename) -> None:
+        """Hard link or copy a file"""
+        link_or_copy(filename, self._path(arcname))
+
+    def add_tree(self, arcname: str, dirname) -> None:
+        dest = Path(self.root, arcname)
+        if dest.resolve() != Path(dirname).resolve():
+            shutil.copytree(dirname, dest, dirs_exist_ok=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
@@ -0,0 +1,109 @@
+###################################
+# Script :
+# 1) Contains shared store of static
+# HTML resources and functions to link
+# resources used by a report
+#
+###################################
+import logging
+import os
+import re
+import shutil
+import tempfile
+from pathlib import Path
+
+from resultcache import file_sha256
+
+# References to local files in HTML and CSS
+HTML_REF = re.compile(r'''(?:src|href)\s*=\s*["']([^"'#?]+)''')
+CSS_REF = re.compile(r'''url\(\s*["']?([^"')#?]+)''')
+
+
+def is_local(ref: str) -> bool:
+    return not (ref.startswith('/') or ref.startswith('data:') or
+                re.match(r'^[a-zA-Z][a-zA-Z0-9+.-]*://', ref) is not None)
+
+
+def find_assets(pages: list, resources) -> list:
+    """
+    Static resources used by HTML pages, given as text, as paths
+    relative to the resources directory. Resources referenced by
+    used CSS files are included.
+    """
+    resources = Path(resources).resolve()
+    prefix = f'{resources.name}/'
+    found = set()
+    queue = []
+
+    for page in pages:
+        for ref in HTML_REF.findall(page):
+            if ref.startswith(prefix):
+                queue.append(ref[len(prefix):])
+
+    while queue:
+        ref = os.path.normpath(queue.pop())
+        if ref in found:
+            continue
+        fn = Path(resources, ref)
+        if ref.startswith('..') or not fn.is_file():
+            logging.debug(f'Skipping missing static resource {ref}')
+            continue
+        found.add(ref)
+
+        if fn.suffix == '.css':
+            with open(fn, encoding='utf-8', errors='replace') as f:
+                for url in CSS_REF.findall(f.read()):
+                    url = url.strip()
+                    if is_local(url):
+                        queue.append(str(Path(ref).parent / url))
+
+    return sorted(found)
+
+
+class AssetStore(object):
+    """
+    Content-addressed store of static HTML resources.
+
+    Every resource is copied once from the resources directory and
+    stored under its SHA-256, a new version of a resource is stored next
+    to the old one. Reports take only the stored files they use:
+    uncompressed reports hard link them (archive.DirectoryWriter falls
+    back to a copy across file systems), archives read them once.
+    """
+
+    def __init__(self, root, resources):
+        """
+        root: cache directory
+        resources: directory with static HTML resources
+        """
+        self.root = Path(root, 'assets')
+        self.resources = Path(resources)
+        # relative path -> (size, mtime, stored path)
+        self._stored = {}
+
+    def get(self, ref: str) -> Path:
+        """Path of the stored copy of a resource, copied on first use"""
+        fn = Path(self.resources, ref)
+        st = fn.stat()
+        stored = self._stored.get(ref)
+        if stored is not None and stored[:2] == (st.st_size, st.st_mtime_ns):
+            return stored[2]
+
+        digest = file_sha256(fn)
+        path = Path(self.root, digest[:2], f'{digest}{fn.suffix}')
+        if not path.is_file():
+            path.parent.mkdir(parents=True, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=path.parent, suffix='.tmp')
+            os.close(fd)
+            try:
+                shutil.copyfile(fn, tmp)
+                os.replace(tmp, path)
+            except BaseException:
+                try:
+                    os.remove(tmp)
+                except OSError:
+                    pass
+                raise
+
+        self._stored[ref] = (st.st_size, st.st_mtime_ns, path)
+        return path
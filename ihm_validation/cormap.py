@@ -0,0 +1,100 @@
+###################################
+# Script :
+# 1) Contains Correlation Map (CorMap)
+# test for comparing SAS curves, as
+# used by ATSAS datcmp
+#
+###################################
+'''
+CorMap test (Franke, Jordan & Svergun, Nat Methods 2015) for pairs of
+curves sampled on the same grid.
+
+For a pair of curves the test statistic C is the longest run of
+consecutive points where one curve is above the other. Under the null
+hypothesis the signs of the differences are independent fair coin
+tosses, and the p-value is the probability of a run of at least C
+points among n tosses (Schilling 1990).
+'''
+from functools import lru_cache
+
+import numpy as np
+
+# Version of the implementation, part of cache keys of the p-values
+VERSION = 1
+
+
+def longest_runs(first, second) -> np.ndarray:
+    '''
+    longest run of points of the same sign of first - second for every
+    pair of curves. Curves are rows of 2D arrays, shorter curves are
+    padded with NaN. Equal points and padding break runs
+    '''
+    first = np.atleast_2d(np.asarray(first, dtype=float))
+    second = np.atleast_2d(np.asarray(second, dtype=float))
+    signs = np.nan_to_num(np.sign(first - second))
+    nrows, ncols = signs.shape
+    if ncols == 0:
+        return np.zeros(nrows, dtype=int)
+
+    # A run starts on every change of sign and at the start of every row
+    starts = np.ones(signs.shape, dtype=bool)
+    starts[:, 1:] = signs[:, 1:] != signs[:, :-1]
+    starts = starts.ravel()
+    run_ids = np.cumsum(starts) - 1
+    lengths = np.bincount(run_ids)
+
+    first_points = np.flatnonzero(starts)
+    lengths[signs.ravel()[first_points] == 0] = 0
+    longest = np.zeros(nrows, dtype=int)
+    np.maximum.at(longest, first_points // ncols, lengths)
+    return longest
+
+
+@lru_cache(maxsize=None)
+def run_pvalue(n: int, c: int) -> float:
+    '''
+    probability of a run of at least c equal outcomes among
+    n fair coin tosses
+    '''
+    if c <= 1:
+        return 1.0 if n > 0 else 0.0
+    if c > n:
+        return 0.0
+
+    # no_run[m]: probability of no such run in the first m tosses.
+    # A run is first completed at toss m if the last c tosses are equal,
+    # differ from the toss before them and there was no run before.
+    # Summing these positive terms keeps small p-values accurate
+    no_run = np.ones(n + 1)
+    first = np.zeros(n + 1)
+    first[c] = 0.5 ** (c - 1)
+    no_run[c] = 1 - first[c]
+    for m in range(c + 1, n + 1):
+        first[m] = no_run[m - c] * 0.5 ** c
+        no_run[m] = no_run[m - 1] - first[m]
+    return float(min(1.0, first.sum()))
+
+
+def get_pvalues(first, second) -> (np.ndarray, np.ndarray):
+    '''
+    CorMap test of pairs of curves, see longest_runs for the input.
+    Returns longest runs C and p-values P(>=C) of all pairs.
+    For one pair the p-value equals datcmp's adjusted P(>C)
+    '''
+    first = np.atleast_2d(np.asarray(first, dtype=float))
+    second = np.atleast_2d(np.asarray(second, dtype=float))
+    runs = longest_runs(first, second)
+    points = np.sum(~(np.isnan(first) | np.isnan(second)), axis=1)
+    pvals = np.array([run_pvalue(int(n), int(c)) for n, c in zip(points, runs)])
+    return runs, pvals
+
+
+def pad_curves(curves: list) -> np.ndarray:
+    '''
+    stack curves of different lengths into a 2D array padded with NaN
+    '''
+    width = max((len(c) for c in curves), default=0)
+    out = np.full((len(curves), width), np.nan)
+    for i, curve in enumerate(curves):
+        out[i, :len(curve)] = curve
+    return out
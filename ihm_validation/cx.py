@@ -6,24 +6,22 @@
 # ganesans@salilab.org
 ###################################
 
-from mmcif_io import GetInputInformation
+from mmcif_io import GetInputInformation, ParsedSystem
+from futures import (measure_distances, tile_restraints,
+                     get_restraint_satisfaction, get_restraint_group_table,
+                     get_restraint_group_types)
 import pandas as pd
 import logging
 import ihm
 import numpy as np
 from pathlib import Path
 from collections import defaultdict
-from bokeh.plotting import save
-from bokeh.layouts import gridplot
-from bokeh.models import Range1d
-from bokeh.models.widgets import Panel, Tabs
-from bokeh.resources import CDN
-import iqplot
 import json
-from bokeh.embed import json_item
 
 pd.options.mode.chained_assignment = None
 NA = 'Not available'
+# Bump when the measured distances may change to invalidate cached results
+MEASUREMENT_VERSION = '1'
 
 
 # asym_id, seq_id, atom_id
@@ -66,8 +64,10 @@ def get_hierarchy_from_model(model):
 
 
 class CxValidation(GetInputInformation):
-    def __init__(self, mmcif_file):
-        super().__init__(mmcif_file)
+    def __init__(self, mmcif_file, parsed: ParsedSystem = None,
+                 result_cache=None):
+        super().__init__(mmcif_file, parsed=parsed)
+        self.result_cache = result_cache
         self.ID = str(self.get_id())
         self.nos = self.get_number_of_models()
         self.dataset = self.get_dataset_comp()
@@ -271,7 +271,10 @@ class CxValidation(GetInputInformation):
             self.raw_restraints.at[index, 'restraint_rtd'] = ertype_
 
     def get_measured_restraints(self):
-        restraints = []
+        models = []
+        # Store as much information as we can
+        model_data = {'model_number': [], 'model_group': [],
+                      'state': [], 'state_group': []}
 
         gistg = 0
         gist = 0
@@ -285,24 +288,19 @@ class CxValidation(GetInputInformation):
                     gimg += 1
                     for im, m in enumerate(mg):
                         gim += 1
-                        m_ = self.models[gim]
-                        for index, row in self.raw_restraints.iterrows():
-                            d = self.measure_restraint(m_, row)
+                        models.append(m)
+                        model_data['model_number'].append(gim)
+                        model_data['model_group'].append(gimg)
+                        model_data['state'].append(gist)
+                        model_data['state_group'].append(gistg)
 
-                            ndata = {
-                                # Store as much information as we can
-                                'distance_euclidean': d,
-                                'model_number': gim,
-                                'model_group': gimg,
-                                'state': gist,
-                                'state_group': gistg,
-                            }
+        if len(models) == 0:
+            return pd.DataFrame()
 
-                            nrow = row.to_dict()
-                            nrow.update(ndata)
-                            restraints.append(nrow)
-
-        restraints = pd.DataFrame(restraints)
+        # All distances for all models at once
+        distances = measure_distances(models, self.raw_restraints)
+        restraints = tile_restraints(self.raw_restraints, distances,
+                                     model_data)
 
         return restraints
 
@@ -383,8 +381,17 @@ class CxValidation(GetInputInformation):
             self.rtdtypes = self.get_rtdtypes()
             self.assign_rtdtypes()
 
-            self.models = self.get_models()
-            measured_restraints = self.get_measured_restraints()
+            key = None
+            measured_restraints = None
+            if self.result_cache is not None:
+                key = self.result_cache.key('cx', self.parsed.digest,
+                                            MEASUREMENT_VERSION)
+                measured_restraints = self.result_cache.get(key)
+
+            if measured_restraints is None:
+                measured_restraints = self.get_measured_restraints()
+                if key is not None:
+                    self.result_cache.put(key, measured_restraints)
 
             if len(measured_restraints) > 0:
 
@@ -476,11 +483,42 @@ class CxValidation(GetInputInformation):
 
         return best
 
+    def get_best_distances(self, data: pd.DataFrame) -> pd.Series:
+        """Best distance per (model_group, restraint_id) across models,
+        see get_best_distance_per_restraint"""
+        keys = [data['model_group'], data['restraint_id']]
+        d = data['distance_euclidean'].astype(float)
+        threshold = pd.to_numeric(data['distance_limit']).astype(float)
+
+        best_upper = d.groupby(keys).min()
+        best_lower = d.where((d - threshold) >= 0).groupby(keys).min()
+        best_lower = best_lower.fillna(d.groupby(keys).max())
+        # First distance closest to the threshold
+        diff = (d - threshold).abs().fillna(np.inf)
+        idx = diff.groupby(keys).idxmin()
+        best_harmonic = pd.Series(d.loc[idx.to_numpy()].to_numpy(),
+                                  index=idx.index)
+
+        rtype = data['restraint_type'].groupby(keys).first()
+        best = np.select(
+            [rtype == 'upper bound', rtype == 'lower bound',
+             rtype == 'harmonic'],
+            [best_upper.reindex(rtype.index), best_lower.reindex(rtype.index),
+             best_harmonic.reindex(rtype.index)],
+            default=np.nan)
+
+        return pd.Series(best, index=rtype.index)
+
     def get_best_distances_per_model_group(self):
         rtd_groups = {}
 
         rids = list(set(self.measured_restraints['restraint_id']))
 
+        best = self.get_best_distances(self.measured_restraints)
+        first_rows = self.measured_restraints.drop_duplicates(
+            ['model_group', 'restraint_id']).set_index(
+                ['model_group', 'restraint_id'], drop=False)
+
         gistg = 0
         gist = 0
         gimg = 0
@@ -492,15 +530,11 @@ class CxValidation(GetInputInformation):
                     gimg += 1
                     rtd_groups[gimg] = {}
                     for rid in rids:
-                        data_ = self.measured_restraints[
-                            (self.measured_restraints['restraint_id'] == rid) &
-                            (self.measured_restraints['model_group'] == gimg)]
-
-                        if len(data_) == 0:
+                        if (gimg, rid) not in best.index:
                             continue
 
-                        rtdtype = self.get_rtdtype(data_.iloc[0])
-                        d = self.get_best_distance_per_restraint(data_)
+                        rtdtype = self.get_rtdtype(first_rows.loc[(gimg, rid)])
+                        d = best[(gimg, rid)]
 
                         if rtdtype not in rtd_groups[gimg]:
                             rtd_groups[gimg][rtdtype] = []
@@ -518,27 +552,9 @@ class CxValidation(GetInputInformation):
 
     def is_restraint_group_satisfied(self, data):
         # Verify, that there is only one type of restraints in the group
-        satisfied_restraints = np.zeros(len(data), dtype=bool)
+        satisfied_restraints = get_restraint_satisfaction(data)
         conditional_flag_all = list(set(data['group_restraint_all']))[0]
 
-        for i, (index, row) in enumerate(data.iterrows()):
-            rtype = row['restraint_type']
-            ed = row['distance_euclidean']
-            threshold = row['distance_limit']
-
-            if rtype == 'upper bound':
-                cmp = (ed - threshold) <= 0
-            elif rtype == 'lower bound':
-                cmp = (ed - threshold) >= 0
-            # Check with Ben
-            elif rtype == 'harmonic':
-                cmp = np.isclose(
-                    ed, threshold,
-                    rtol=row['psi'] + row['sigma1'] + row['sigma2']
-                )
-
-            satisfied_restraints[i] = cmp
-
         if conditional_flag_all:
             satisfied = satisfied_restraints.all()
         else:
@@ -568,35 +584,17 @@ class CxValidation(GetInputInformation):
         return rg_type
 
     def process_restraint_groups(self, data, mode='entity'):
-        rgs = set(data['group_id'])
-
-        stats = {'All': {'satisfied': 0, 'total': 0}}
-
-        for rgs_ in rgs:
-            good_ = 0
-            rg_chain_type = None
-            rg_entity_type = None
-            data_ = data[data['group_id'] == rgs_]
-            rg_chain_type = self.get_restraint_group_chain_type(data_)
-            rg_entity_type = self.get_restraint_group_entity_type(data_)
+        if len(data) == 0:
+            return {'All': {'satisfied': 0, 'total': 0}}
 
-            assert rg_chain_type is not None
-            assert rg_entity_type is not None
+        return self.process_restraint_group_table(
+            get_restraint_group_table(data))
 
-            rg_type = f'{rg_entity_type}/{rg_chain_type}'
-
-            # Check per model
-            models = list(set(data_['model_number']))
-            for model in models:
-                data__ = data_[data_['model_number'] == model]
-
-                if self.is_restraint_group_satisfied(data__):
-                    good__ = 1
-                else:
-                    good__ = 0
-
-                good_ = good_ or good__
+    def process_restraint_group_table(self, table):
+        """Satisfaction stats from a get_restraint_group_table table"""
+        stats = {'All': {'satisfied': 0, 'total': 0}}
 
+        for rgs_, rg_type, good_ in get_restraint_group_types(table):
             if rg_type not in stats:
                 stats[rg_type] = {'satisfied': 0, 'total': 0}
 
@@ -608,8 +606,22 @@ class CxValidation(GetInputInformation):
 
         return stats
 
+    def get_stats_per_model(self) -> dict:
+        """
+        Satisfaction stats for every model number, models without
+        restraints have zero counts
+        """
+        table = get_restraint_group_table(self.measured_restraints)
+        stats = defaultdict(
+            lambda: self.process_restraint_groups(self.measured_restraints.iloc[:0]))
+        for gim, table_ in table.groupby('model_number', sort=False):
+            stats[gim] = self.process_restraint_group_table(table_)
+        return stats
+
     def get_stats_per_model_group(self):
         stats = {}
+        model_groups = dict(
+            tuple(self.measured_restraints.groupby('model_group', sort=False)))
 
         gistg = 0
         gist = 0
@@ -629,8 +641,8 @@ class CxValidation(GetInputInformation):
 
                     cx_stats = {}
 
-                    data_ = self.measured_restraints[
-                        self.measured_restraints['model_group'] == gimg]
+                    data_ = model_groups.get(
+                        gimg, self.measured_restraints.iloc[:0])
 
                     stats_ = self.process_restraint_groups(data_)
 
@@ -678,6 +690,7 @@ class CxValidation(GetInputInformation):
 
     def get_per_model_satifaction_rates(self) -> list:
         out = []
+        stats = self.get_stats_per_model()
         gistg = 0
         gist = 0
         gimg = 0
@@ -692,10 +705,7 @@ class CxValidation(GetInputInformation):
 
                     for im, m in enumerate(mg):
                         gim += 1
-                        data_ = self.measured_restraints[
-                            self.measured_restraints['model_number'] == gim]
-
-                        stats_ = self.process_restraint_groups(data_)
+                        stats_ = stats[gim]
 
                         for k, v in stats_.items():
                             pct = None
@@ -716,6 +726,12 @@ class CxValidation(GetInputInformation):
         return(out)
 
     def plot_satisfaction_per_ensemble(self, imgDirname='.'):
+        # The plotting stack is loaded only if plots are requested
+        import iqplot
+        from bokeh.layouts import gridplot
+        from bokeh.models import Range1d
+        from bokeh.models.widgets import Panel, Tabs
+
         def scatter_plot(stats):
             xmin, xmax = -2, 102
 
@@ -735,6 +751,7 @@ class CxValidation(GetInputInformation):
 
             return p
 
+        stats = self.get_stats_per_model()
         gistg = 0
         gist = 0
         gimg = 0
@@ -751,10 +768,7 @@ class CxValidation(GetInputInformation):
 
                     for im, m in enumerate(mg):
                         gim += 1
-                        data_ = self.measured_restraints[
-                            self.measured_restraints['model_number'] == gim]
-
-                        stats_ = self.process_restraint_groups(data_)
+                        stats_ = stats[gim]
 
                         for k, v in stats_.items():
                             pct = None
@@ -800,6 +814,9 @@ class CxValidation(GetInputInformation):
 
     def plot_distograms_per_model_group(self, imgDirname='.'):
         """plot all restraints in the dataset"""
+        import iqplot
+        from bokeh.layouts import gridplot
+        from bokeh.models.widgets import Panel, Tabs
 
         data = self.get_best_distances_per_model_group()
         tabs_ = []
@@ -861,6 +878,9 @@ class CxValidation(GetInputInformation):
         return self.save_plots(tabs, title, imgDirname)
 
     def save_plots(self, plot, title, imgDirname='.'):
+        from bokeh.embed import json_item
+        from bokeh.plotting import save
+        from bokeh.resources import CDN
         imgpath = Path(
             imgDirname,
             f'{self.ID}_{title}.html')
@@ -7,22 +7,86 @@
 # ganesans@salilab.org
 ###################################
 from pathlib import Path
-from mmcif_io import GetInputInformation
+from mmcif_io import GetInputInformation, ParsedSystem
 import ihm
 import multiprocessing as mp
 import pandas as pd
 import numpy as np
+from scipy.spatial import cKDTree
 import math
 import os
-import csv
+
+# Bump when the excluded volume results may change to invalidate cached results
+ENGINE_VERSION = 'kdtree-1'
+
+
+def count_overlaps(xyzr: np.ndarray) -> int:
+    """
+    Count pairs of overlapping spheres.
+    xyzr is a float64 (N, 4) array of X, Y, Z and radius.
+    A pair is a violation if the distance between the centers
+    is smaller than the sum of the radii.
+    Candidate pairs are selected with a KD-tree using twice
+    the largest radius as a cutoff, so the cost is ~O(N log N)
+    instead of testing all N*(N-1)/2 pairs.
+    """
+    xyzr = np.asarray(xyzr, dtype=np.float64)
+    if xyzr.shape[0] < 2:
+        return 0
+
+    coords = xyzr[:, :3]
+    radii = xyzr[:, 3]
+    cutoff = 2. * radii.max()
+    if cutoff <= 0:
+        return 0
+
+    tree = cKDTree(coords)
+    pairs = tree.query_pairs(r=cutoff, output_type='ndarray')
+    if len(pairs) == 0:
+        return 0
+
+    i, j = pairs[:, 0], pairs[:, 1]
+    # Same arithmetic as in get_violation_dict to get identical counts
+    delta = coords[j] - coords[i]
+    dist = np.sqrt(np.square(delta).sum(axis=1))
+    overlap = (dist - (radii[j] + radii[i])) < 0
+
+    return int(np.count_nonzero(overlap))
+
+
+def get_exc_vol_from_xyzr(xyzr: np.ndarray) -> (float, int):
+    """
+    get satisfaction and number of violations from
+    a (N, 4) array of X, Y, Z, R
+    """
+    n = xyzr.shape[0]
+    violations = count_overlaps(xyzr)
+    if n < 2:
+        return (100.0, violations)
+    number_of_combinations = math.comb(n, 2)
+    satisfaction = round(
+        (1 - violations / number_of_combinations) * 100, 2)
+    return (satisfaction, violations)
+
+
+def _exc_vol_worker(item: tuple) -> tuple:
+    """ score one (model_id, xyzr) item in a worker process """
+    model_id, xyzr = item
+    satisfaction, violations = get_exc_vol_from_xyzr(xyzr)
+    return (model_id, satisfaction, violations)
 
 
 class GetExcludedVolume(GetInputInformation):
-    def __init__(self, mmcif_file, cache):
-        super().__init__(mmcif_file)
+    def __init__(self, mmcif_file, cache, parsed: ParsedSystem = None,
+                 jobs: int = None, pool=None):
+        super().__init__(mmcif_file, parsed=parsed)
         self.ID = Path(self.mmcif_file).stem
         self.nos = self.get_number_of_models()
         self.cache = cache
+        # Number of worker processes, default is the number of CPUs
+        self.jobs = jobs if jobs is not None else os.cpu_count()
+        # Optional long-lived multiprocessing pool shared between entries
+        self.pool = pool
 
     def get_all_spheres(self, filetemp=None):
         """get information on all spheres for each model"""
@@ -41,8 +105,7 @@ class GetExcludedVolume(GetInputInformation):
 
     def get_nCr(self, n, r):
         """get all combinations"""
-        f = math.factorial
-        return (f(n)/(f(r)*f(n-r)))
+        return float(math.comb(n, r))
 
     def get_violation_percentage(self, models_spheres_df: pd.DataFrame, viols: dict) -> float:
         """get information on all spheres for each model"""
@@ -68,6 +131,29 @@ class GetExcludedVolume(GetInputInformation):
         model_spheres_df.index += 1
         return model_spheres_df.T
 
+    @staticmethod
+    def get_xyzr_array(spheres: list) -> np.ndarray:
+        """ get (N, 4) float64 array of X, Y, Z, R from sphere objects"""
+        xyzr = np.empty((len(spheres), 4), dtype=np.float64)
+        for i, s in enumerate(spheres):
+            xyzr[i] = (s.x, s.y, s.z, s.radius)
+        return xyzr
+
+    def get_exc_vol_given_xyzr(self, xyzr: np.ndarray) -> (float, int):
+        """
+        get satisfaction and number of violations from
+        a (N, 4) array of X, Y, Z, R
+        """
+        return get_exc_vol_from_xyzr(xyzr)
+
+    def iter_xyzr(self, model_dict: dict):
+        """
+        lazily convert models to compact (model_id, xyzr) items,
+        so that only the models in flight are held as arrays
+        """
+        for model_id, spheres in model_dict.items():
+            yield (model_id, self.get_xyzr_array(spheres))
+
     def get_xyzr_complete(self, model_ID, spheres: list) -> pd.DataFrame:
         """ get X,Y,Z,R, chain and model ID from sphere objects"""
 
@@ -103,11 +189,11 @@ class GetExcludedVolume(GetInputInformation):
             'Models': [], 'Excluded Volume Satisfaction (%)': [], 'Number of violations': []}
         for indx, model in model_dict.items():
             excluded_volume['Models'].append(indx)
-            df = self.get_xyzr(model)
+            satisfaction, violations = self.get_exc_vol_given_xyzr(
+                self.get_xyzr_array(model))
             excluded_volume['Excluded Volume Satisfaction (%)'].append(
-                round(self.get_violation_percentage(df, self.get_violation_dict(df)), 2))
-            excluded_volume['Number of violations'].append(
-                sum(self.get_violation_dict(df).values()))
+                satisfaction)
+            excluded_volume['Number of violations'].append(violations)
         # open(os.path.join(os.getcwd(), self.resultpath, self.ID+'exv.txt'), 'w+')
         return excluded_volume
 
@@ -118,46 +204,54 @@ class GetExcludedVolume(GetInputInformation):
         excluded_volume = {'Models': [], 'Excluded Volume Satisfaction (%)': []}
         for indx, model in model_dict.items():
             excluded_volume['Models'].append(indx)
-            df = self.get_xyzr(model)
-            satisfaction = self.get_violation_percentage(
-                df, self.get_violation_dict(df))
+            satisfaction, _ = self.get_exc_vol_given_xyzr(
+                self.get_xyzr_array(model))
             excluded_volume['Excluded Volume Satisfaction (%)'].append(
-                round(satisfaction, 2))
+                satisfaction)
         return excluded_volume
 
     def get_exc_vol_given_sphere_parallel(self, sphere_list: list) -> (float, int):
         """
         get violations from cart coords
         """
-        df = self.get_xyzr(sphere_list)
-        violation_dict = self.get_violation_dict(df)
-        satisfaction = round(
-            self.get_violation_percentage(df, violation_dict), 2)
-        violations = sum(violation_dict.values())
-        return (satisfaction, violations)
-
-    def run_exc_vol_parallel(self, model_dict: dict) -> dict:
-        """ get exc vol info in parallel """
-        # list_of_sphere_list=list(model_dict.values())
-        filename = str(Path(self.cache, self.ID + '_exv.txt'))
-        if os.path.exists(filename):
-            return self.process_exv(filename)
-        if len(model_dict.keys()) <= 25:  # this is an arbitrary cutoff
-            pool = mp.Pool(processes=len(model_dict.keys()))
-            complete_list = pool.map(
-                self.get_exc_vol_given_sphere_parallel, list(model_dict.values()))
-            excluded_volume = {'Models': list(model_dict.keys()),
-                               'Excluded Volume Satisfaction (%)': [i[0] for i in complete_list],
-                               'Number of violations': [i[1] for i in complete_list]}
-
-            with open(filename, "w+") as file:
-                write_file = csv.writer(file)
-                for key, val in excluded_volume.items():
-                    write_file.writerow([key, val])
+        return self.get_exc_vol_given_xyzr(self.get_xyzr_array(sphere_list))
+
+    def run_exc_vol_parallel(self, model_dict: dict, jobs: int = None) -> dict:
+        """
+        get exc vol info in parallel using a bounded pool of workers.
+        models are streamed to the workers as (N, 4) coordinate arrays
+        and results are merged as they arrive
+        """
+        if jobs is None:
+            jobs = self.jobs
+        jobs = max(1, min(jobs, len(model_dict)))
+
+        excluded_volume = {'Models': [],
+                           'Excluded Volume Satisfaction (%)': [],
+                           'Number of violations': []}
+
+        items = self.iter_xyzr(model_dict)
+        if jobs == 1:
+            results = map(_exc_vol_worker, items)
+            self.merge_exc_vol(excluded_volume, results)
+        elif self.pool is not None:
+            results = self.pool.imap(_exc_vol_worker, items)
+            self.merge_exc_vol(excluded_volume, results)
         else:
-            excluded_volume = {'Models': ['All '+str(len(model_dict.keys()))],
-                               'Excluded Volume Satisfaction (%)': ['0.0'],
-                               'Number of violations': ['0.0']}
+            with mp.Pool(processes=jobs) as pool:
+                results = pool.imap(_exc_vol_worker, items)
+                self.merge_exc_vol(excluded_volume, results)
+
+        return excluded_volume
+
+    @staticmethod
+    def merge_exc_vol(excluded_volume: dict, results) -> dict:
+        """ merge (model_id, satisfaction, violations) results into the table """
+        for model_id, satisfaction, violations in results:
+            excluded_volume['Models'].append(model_id)
+            excluded_volume['Excluded Volume Satisfaction (%)'].append(
+                satisfaction)
+            excluded_volume['Number of violations'].append(violations)
         return excluded_volume
 
     def process_exv(self, filename: str) -> dict:
@@ -8,6 +8,8 @@ from typing import Union
 from collections import defaultdict
 
 import ihm
+import ihm.model
+import ihm.restraint
 import numpy as np
 import pandas as pd
 
@@ -276,23 +278,10 @@ class CXMSValidator(Validator):
         return ertypes
 
     def _measure_restraints(self, models: list) -> pd.DataFrame:
-        restraints = []
-        for m in models:
-            m_ = get_hierarchy_from_model(m)
-            for index, row in self.raw_restraints.iterrows():
-                d = self._measure_restraint(m_, row)
-
-                ndata = {
-                    # Store as much information as we can
-                    'distance_euclidean': d,
-                    'model_number': int(m._id),
-                }
-
-                nrow = row.to_dict()
-                nrow.update(ndata)
-                restraints.append(nrow)
-
-        restraints = pd.DataFrame(restraints)
+        restraints = tile_restraints(
+            self.raw_restraints,
+            measure_distances(models, self.raw_restraints),
+            {'model_number': [int(m._id) for m in models]})
 
 
         if len(restraints) > 0:
@@ -371,35 +360,13 @@ class CXMSValidator(Validator):
         return out
 
     def _process_restraint_groups(self, data: pd.DataFrame, mode='entity') -> dict:
-        rgs = set(data['group_id'])
-
         stats = {'All': {'Satisfied': 0, 'Count': 0}}
 
-        for rgs_ in rgs:
-            good_ = 0
-            rg_chain_type = None
-            rg_entity_type = None
-            data_ = data[data['group_id'] == rgs_]
-            rg_chain_type = self._get_restraint_group_chain_type(data_)
-            rg_entity_type = self._get_restraint_group_entity_type(data_)
-
-            assert rg_chain_type is not None
-            assert rg_entity_type is not None
-
-            rg_type = f'{rg_entity_type}/{rg_chain_type}'
-
-            # Check per model
-            models = list(set(data_['model_number']))
-            for model in models:
-                data__ = data_[data_['model_number'] == model]
-
-                if self._is_restraint_group_satisfied(data__):
-                    good__ = 1
-                else:
-                    good__ = 0
-
-                good_ = good_ or good__
+        if len(data) == 0:
+            return stats
 
+        table = get_restraint_group_table(data)
+        for rgs_, rg_type, good_ in get_restraint_group_types(table):
             if rg_type not in stats:
                 stats[rg_type] = {'Satisfied': 0, 'Count': 0}
 
@@ -413,27 +380,9 @@ class CXMSValidator(Validator):
 
     def _is_restraint_group_satisfied(self, data: pd.DataFrame) -> bool:
         # Verify, that there is only one type of restraints in the group
-        satisfied_restraints = np.zeros(len(data), dtype=bool)
+        satisfied_restraints = get_restraint_satisfaction(data)
         conditional_flag_all = list(set(data['group_restraint_all']))[0]
 
-        for i, (index, row) in enumerate(data.iterrows()):
-            rtype = row['restraint_type']
-            ed = row['distance_euclidean']
-            threshold = row['distance_limit']
-
-            if rtype == 'upper bound':
-                cmp = (ed - threshold) <= 0
-            elif rtype == 'lower bound':
-                cmp = (ed - threshold) >= 0
-            # Check with Ben
-            elif rtype == 'harmonic':
-                cmp = np.isclose(
-                    ed, threshold,
-                    rtol=row['psi'] + row['sigma1'] + row['sigma2']
-                )
-
-            satisfied_restraints[i] = cmp
-
         if conditional_flag_all:
             satisfied = satisfied_restraints.all()
         else:
@@ -511,6 +460,172 @@ def get_hierarchy_from_model(model):
 
     return root
 
+# asym_id, seq_id, atom_id
+def get_particle_coordinates(model, keys=None) -> dict:
+    """Get coordinates of atoms and by-residue spheres indexed by
+    (asym_id, seq_id, atom_id). Particles are selected with the same
+    rules as in get_hierarchy_from_model. If keys are given, only these
+    particles are returned."""
+    particles = {}
+
+    for a in model.get_atoms():
+        key = (a.asym_unit.id, a.seq_id, a.atom_id)
+        if keys is None or key in keys:
+            particles[key] = a
+
+    # Residues without atoms are represented by the CA placeholder
+    placeholders = set()
+    for r in model.representation:
+        if r.granularity == 'by-residue':
+            for i in range(r.asym_unit.seq_id_range[0],
+                           r.asym_unit.seq_id_range[1] + 1):
+                key = (r.asym_unit.asym.id, i, 'CA')
+                if keys is None or key in keys:
+                    particles[key] = None
+                    placeholders.add(key)
+
+    for s in model.get_spheres():
+        # Consider only by-residue spheres
+        seq_ids = list(set(s.seq_id_range))
+        if len(seq_ids) != 1:
+            continue
+
+        key = (s.asym_unit.id, seq_ids[0], 'CA')
+        if key in placeholders:
+            particles[key] = s
+            placeholders.remove(key)
+
+    supported_particles = (ihm.model.Atom, ihm.model.Sphere)
+    return {k: (p.x, p.y, p.z) for k, p in particles.items()
+            if type(p) in supported_particles}
+
+
+def measure_distances(models: list, restraints: pd.DataFrame) -> np.ndarray:
+    """Measure euclidean distances for all restraints in all models.
+    Returns (N models, N restraints) array, NaN for missing particles"""
+    ends1 = list(zip(restraints['chain1'], restraints['resnum1'],
+                     restraints['name1']))
+    ends2 = list(zip(restraints['chain2'], restraints['resnum2'],
+                     restraints['name2']))
+
+    # Resolve restraints into pairs of particle indices once
+    keys = {k: i for i, k in enumerate(dict.fromkeys(ends1 + ends2))}
+    i1 = np.array([keys[k] for k in ends1], dtype=int)
+    i2 = np.array([keys[k] for k in ends2], dtype=int)
+
+    xyz = np.full((len(models), len(keys), 3), np.nan)
+    for im, m in enumerate(models):
+        for k, c in get_particle_coordinates(m, keys).items():
+            xyz[im, keys[k]] = c
+
+    missing = np.isnan(xyz[:, :, 0]).all(axis=0)
+    for k, i in keys.items():
+        if missing[i]:
+            logging.debug(f'Atom {k[0]} {k[1]} {k[2]} is empty')
+
+    return np.linalg.norm(xyz[:, i2] - xyz[:, i1], axis=-1)
+
+
+def tile_restraints(restraints: pd.DataFrame, distances: np.ndarray,
+                    model_data: dict) -> pd.DataFrame:
+    """Repeat restraints for every model and add measured distances.
+    model_data maps column names to one value per model"""
+    nm, nr = distances.shape
+    out = restraints.iloc[np.tile(np.arange(nr), nm)].reset_index(drop=True)
+    for k, v in model_data.items():
+        out[k] = np.repeat(np.asarray(v), nr)
+    out['distance_euclidean'] = distances.ravel()
+    return out.infer_objects()
+
+
+def get_restraint_satisfaction(data: pd.DataFrame) -> np.ndarray:
+    """Satisfaction of every measured restraint as a boolean array"""
+    rtype = data['restraint_type'].to_numpy()
+    ed = data['distance_euclidean'].to_numpy(dtype=float)
+    threshold = pd.to_numeric(data['distance_limit']).to_numpy(dtype=float)
+
+    satisfied = np.zeros(len(data), dtype=bool)
+
+    upper = rtype == 'upper bound'
+    satisfied[upper] = (ed[upper] - threshold[upper]) <= 0
+
+    lower = rtype == 'lower bound'
+    satisfied[lower] = (ed[lower] - threshold[lower]) >= 0
+
+    # Check with Ben
+    harmonic = rtype == 'harmonic'
+    if harmonic.any():
+        h = data[harmonic]
+        rtol = (pd.to_numeric(h['psi']) + pd.to_numeric(h['sigma1']) +
+                pd.to_numeric(h['sigma2'])).to_numpy(dtype=float)
+        satisfied[harmonic] = np.isclose(ed[harmonic], threshold[harmonic],
+                                         rtol=rtol)
+
+    return satisfied
+
+
+def get_restraint_group_table(data: pd.DataFrame) -> pd.DataFrame:
+    """Satisfaction of every restraint group in every model.
+    A group is satisfied if all (conditional flag ALL) or any of its
+    restraints are satisfied."""
+    data = data.assign(
+        satisfied_=get_restraint_satisfaction(data),
+        conditional_all_=data['group_restraint_all'].eq(True),
+    )
+
+    table = data.groupby(['model_number', 'group_id'], sort=False).agg(
+        all_satisfied=('satisfied_', 'all'),
+        any_satisfied=('satisfied_', 'any'),
+        conditional_all=('conditional_all_', 'first'),
+        intra_chain_all=('intra_chain', 'all'),
+        intra_chain_any=('intra_chain', 'any'),
+        intra_entity_all=('intra_entity', 'all'),
+        intra_entity_any=('intra_entity', 'any'),
+    )
+    table['satisfied'] = np.where(table['conditional_all'],
+                                  table['all_satisfied'],
+                                  table['any_satisfied'])
+
+    return table.reset_index()
+
+
+def get_restraint_group_types(table: pd.DataFrame) -> list:
+    """Summarize restraint groups from get_restraint_group_table over
+    all models. A group is satisfied if it is satisfied in any model.
+    Returns (group_id, group type, satisfied) in the order of
+    set(group_id)."""
+    groups = table.groupby('group_id', sort=False).agg(
+        satisfied=('satisfied', 'any'),
+        intra_chain_all=('intra_chain_all', 'all'),
+        intra_chain_any=('intra_chain_any', 'any'),
+        intra_entity_all=('intra_entity_all', 'all'),
+        intra_entity_any=('intra_entity_any', 'any'),
+    )
+
+    out = []
+    for gid in set(table['group_id']):
+        g = groups.loc[gid]
+
+        if g['intra_chain_all']:
+            rg_chain_type = 'Intramolecular'
+        elif not g['intra_chain_any']:
+            rg_chain_type = 'Intermolecular'
+        else:
+            rg_chain_type = 'Ambiguous'
+
+        if g['intra_entity_all']:
+            rg_entity_type = 'Self-links'
+        elif not g['intra_entity_any']:
+            rg_entity_type = 'Heteromeric links'
+        else:
+            rg_entity_type = 'Ambiguous entity'
+
+        out.append((gid, f'{rg_entity_type}/{rg_chain_type}',
+                    int(bool(g['satisfied']))))
+
+    return out
+
+
 def is_model_mixed(model: ihm.model.Model) -> bool:
     """Check if model is atomic"""
     result = False
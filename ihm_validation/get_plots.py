@@ -9,10 +9,11 @@
 ###################################
 import os
 import utility
-from mmcif_io import GetInputInformation
+from mmcif_io import GetInputInformation, ParsedSystem
 import bokeh
 import numpy as np
-from bokeh.io import output_file, curdoc, export_svg, show
+from bokeh.io import output_file, curdoc, show
+from static_export import export_svg
 from bokeh.models import (ColumnDataSource, Legend, LegendItem, FactorRange,
                           Div, BasicTickFormatter)
 from bokeh.palettes import viridis, Reds256, linear_palette
@@ -28,8 +29,9 @@ silence(EMPTY_LAYOUT, True)
 
 
 class Plots(GetInputInformation):
-    def __init__(self, mmcif, imageDirName, driver):
-        super().__init__(mmcif)
+    def __init__(self, mmcif, imageDirName, driver,
+                 parsed: ParsedSystem = None):
+        super().__init__(mmcif, parsed=parsed)
         self.ID = str(GetInputInformation.get_id(self))
         self.dirname = os.path.dirname(os.path.abspath(__file__))
         self.imageDirName = imageDirName
@@ -11,16 +11,20 @@ import shutil
 import datetime
 import json
 import argparse
-from multiprocessing import Manager
-import pdfkit
-import jinja2
+import glob
+import multiprocessing as mp
 import pytz
 import sys
 import logging
 from pathlib import Path
 import utility
 from report import WriteReport
-from distutils.util import strtobool
+import rendering
+from assets import AssetStore, find_assets
+import archive
+import static_export
+import profiling
+from resultcache import ResultCache
 
 # from validation.WKhtmlToPdf import  wkhtmltopdf
 # import utility
@@ -36,6 +40,10 @@ parser.add_argument('-p', type=str, default='No',
                     help="Physical principles used in modeling yes/no?")
 parser.add_argument('-f', default='PDBDEV_00000001.cif',
                     help="Input mmcif file")
+parser.add_argument('--batch', type=str, nargs='+', default=None,
+                    help="Validate many entries in one run. Accepts directories, "
+                    "glob patterns and manifest files with one mmCIF file "
+                    "(and an optional output prefix) per line")
 parser.add_argument('--databases-root', type=str, default='.', required=False,
                     help="Path to a local copy of SASBDB and EMDB databases")
 parser.add_argument('--cache-root', type=str,
@@ -44,10 +52,29 @@ parser.add_argument('--cache-root', type=str,
                     help="Path to a local copy of SASBDB and EMDB databases")
 parser.add_argument('--nocache', action='store_true', default=False,
                     help="Ignore cached assesment results")
+parser.add_argument('--cache-max-size', type=float, default=None,
+                    help="Maximum size of the result cache in MB")
+parser.add_argument('--cache-max-age', type=float, default=None,
+                    help="Maximum age of result cache entries in days")
+parser.add_argument('--jobs', type=int, default=None,
+                    help="Number of worker processes. Default is the number of CPUs")
+parser.add_argument('--tool-timeout', type=float, default=None,
+                    help="Timeout in seconds for every external validation tool")
+parser.add_argument('--profile-summary', action='store_true', default=False,
+                    help="Log a one-line summary of the profile.json "
+                    "written to every output directory")
+parser.add_argument('--shard-molprobity', action='store_true', default=False,
+                    help="Run molprobity on every model separately using "
+                    "--jobs threads. Gives exact per-model results for ensembles")
 parser.add_argument('--output-root', type=str, default=str(Path(Path(__file__).parent.resolve(), 'Validation')),
                     help="Path to a directory where the output will be written")
 parser.add_argument('--output-prefix', type=str, default=None,
                     help="Prefix of the output directory. Default is a stem of the mmCIF file")
+parser.add_argument('--renderer', type=str, default='browser',
+                    choices=['browser', 'matplotlib'],
+                    help="Backend for static SVG figures. 'browser' exports bokeh "
+                    "figures via headless Firefox, 'matplotlib' draws them "
+                    "without a browser")
 parser.add_argument('--html-mode', type=str, default='local',
                     choices=['local', 'pdb-dev'],
                     help="HTML mode affects paths to various statis resources")
@@ -56,7 +83,12 @@ parser.add_argument('--html-resources',
                     default=str(Path(Path(__file__).parent.parent.resolve(), 'static')),
                     help="Path to static HTML resources")
 parser.add_argument('--keep-html', action='store_true', default=False,
-                    help="Keep uncompressed HTML output")
+                    help="Keep uncompressed HTML output instead of writing "
+                    "a compressed archive")
+parser.add_argument('--compressor', type=str, default='auto',
+                    choices=['auto'] + list(archive.COMPRESSORS),
+                    help="Compressor of the HTML archive. 'auto' uses "
+                    "multithreaded pigz if installed, otherwise gzip")
 parser.add_argument('--force', action='store_true', default=False,
                     help="Overwright output files")
 parser.add_argument(
@@ -82,26 +114,18 @@ parser.add_argument('-dv', type=list, default=[
 parser.add_argument('-res', type=list, default=['Rigid bodies: 1 residue per bead.',
                                                 'Flexible regions: N/A'], help="Add information on model quality (molprobity or excluded volume)")
 
-parser.add_argument('--enable-sas', default=True, type=lambda x: bool(strtobool(x)),
+parser.add_argument('--enable-sas', default=True, type=utility.str_to_bool,
                         help="Run SAS validation")
-parser.add_argument('--enable-cx', default=False, type=lambda x: bool(strtobool(x)),
+parser.add_argument('--sas-pvalue', type=str, default='cormap',
+                    choices=['cormap', 'datcmp'],
+                    help="Compute CorMap p-values of SAS fits in process "
+                    "('cormap') or with ATSAS datcmp ('datcmp')")
+parser.add_argument('--enable-cx', default=False, type=utility.str_to_bool,
                         help="Run crosslinking-MS validation")
 
-args = parser.parse_args()
-if args.p.upper() == 'YES':
-    physics = [
-        'Sequence connectivity',
-        'Excluded volume'
-    ]
-else:
-    physics = ['Information about physical principles was not provided']
-
-logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING)
-
 #############################################################################################################################
 # Input for Jinja
 ####################################################################################
-config = pdfkit.configuration()
 options = {
     'page-size': 'Letter',
     'margin-top': '0.5in',
@@ -143,50 +167,61 @@ template_flask = [
     "validation_help.html",
 ]
 
-# Get the UTC time from ruser
-d = pytz.utc.localize(datetime.datetime.utcnow())
-# Set UCSF's timezone
-timezone = pytz.timezone("America/Los_Angeles")
-d_format = d.astimezone(timezone)
-timestamp = d_format.strftime("%B %d, %Y - %I:%M %p %Z")
-
 
-output_root = args.output_root
+def get_timestamp() -> str:
+    '''
+    time of the run in UCSF's timezone
+    '''
+    # Get the UTC time from ruser
+    d = pytz.utc.localize(datetime.datetime.utcnow())
+    # Set UCSF's timezone
+    timezone = pytz.timezone("America/Los_Angeles")
+    d_format = d.astimezone(timezone)
+    return d_format.strftime("%B %d, %Y - %I:%M %p %Z")
+
+
+def get_physics(p: str) -> list:
+    '''
+    physical principles for the supplementary table from the -p option
+    '''
+    if p.upper() == 'YES':
+        return [
+            'Sequence connectivity',
+            'Excluded volume'
+        ]
+    return ['Information about physical principles was not provided']
+
+
+def get_dirnames(output_root: str, output_prefix: str) -> dict:
+    '''
+    output directories for one entry
+    '''
+    output_path = Path(output_root, output_prefix)
+
+    dirNames = {
+        'root': str(output_path),
+        'root_html': str(Path(output_path, output_prefix)),
+    }
 
-output_prefix = Path(args.f).stem
-if args.output_prefix is not None:
-    output_prefix = args.output_prefix
+    dirNames.update(
+        {
+            'html': str(Path(dirNames['root_html'], 'htmls')),
+        }
+    )
 
-output_path = Path(output_root, output_prefix)
+    dirNames.update(
+        {
+            'images':  str(Path(dirNames['html'], 'images')),
+            'csv':  str(Path(dirNames['html'], 'csv')),
+            'pdf':  str(Path(dirNames['html'], 'pdf')),
+            # 'json': str(Path(output_path, 'json')),
+        }
+    )
 
-dirNames = {
-    'root': str(output_path),
-    'root_html': str(Path(output_path, output_prefix)),
-}
+    return dirNames
 
-dirNames.update(
-    {
-        'html': str(Path(dirNames['root_html'], 'htmls')),
-    }
-)
-
-dirNames.update(
-    {
-        'images':  str(Path(dirNames['html'], 'images')),
-        'csv':  str(Path(dirNames['html'], 'csv')),
-        'pdf':  str(Path(dirNames['html'], 'pdf')),
-        # 'json': str(Path(output_path, 'json')),
-    }
-)
-
-# This is a temporary hack for ../templates
-template_path = Path(Path(__file__).parent.parent.resolve(), 'templates')
-templateLoader = jinja2.FileSystemLoader(searchpath=template_path)
-templateEnv = jinja2.Environment(loader=templateLoader)
 template_pdf = "full_validation_pdf.html"
 template_file_supp = "summary_validation_pdf.html"
-Template_Dict = {}
-Template_Dict['date'] = timestamp
 #############################################################################################################################
 # Jinja scripts
 #############################################################################################################################
@@ -201,39 +236,50 @@ def createdirs(dirNames: dict):
             logging.info(f"Directory {name} created ")
 
 
-def write_html(mmcif_file: str, template_dict: dict, template_list: list, dirName: str):
-    for template_file in template_list:
-        template = templateEnv.get_template(template_file)
-        outputText = template.render(template_dict)
-
-        with open(os.path.join(os.path.join(dirName, template_file)), "w") as fh:
-                fh.write(outputText)
+def write_html(mmcif_file: str, template_dict: dict, template_list: list, sink,
+               dirName: str, cache_dir: str = None, jobs: int = None, pool=None) -> list:
+    '''
+    render HTML pages into dirName of an output sink (see archive.py),
+    returns text of the pages
+    '''
+    pages = []
+    for template_file, text in rendering.iter_pages(
+            template_dict, template_list, cache_dir=cache_dir, jobs=jobs, pool=pool):
+        sink.add_text(str(Path(dirName, template_file)), text)
+        pages.append(text)
+    return pages
 
 
-def write_pdf(mmcif_file: str, template_dict: dict, template_file: str, dirName: str, dirName_Output: str):
-    template = templateEnv.get_template(template_file)
-    outputText = template.render(template_dict)
+def write_pdf(mmcif_file: str, template_dict: dict, template_file: str, dirName: str, dirName_Output: str,
+              cache_dir: str = None):
+    outputText = rendering.render(template_file, template_dict, cache_dir=cache_dir)
     temp_html = os.path.join(dirName, utility.get_output_file_temp_html(mmcif_file))
     output_pdf = os.path.join(dirName_Output, utility.get_output_file_pdf(mmcif_file))
 
     with open(temp_html, "w") as fh:
         fh.write(outputText)
 
-    pdfkit.from_file(temp_html, output_pdf, options=options)
+    # pdfkit is needed only for PDFs, not for --help or failed runs
+    import pdfkit
+    with profiling.timed('pdfkit'):
+        pdfkit.from_file(temp_html, output_pdf, options=options)
     # os.remove(temp_html)
 
     return output_pdf
 
-def write_supplementary_table(mmcif_file: str, template_dict: dict, template_file: str, dirName: str, dirName_supp: str):
-    template = templateEnv.get_template(template_file)
-    outputText = template.render(template_dict)
+def write_supplementary_table(mmcif_file: str, template_dict: dict, template_file: str, dirName: str, dirName_supp: str,
+                              cache_dir: str = None):
+    outputText = rendering.render(template_file, template_dict, cache_dir=cache_dir)
     temp_html = os.path.join(dirName, utility.get_supp_file_html(mmcif_file))
     output_pdf = os.path.join(dirName_supp, utility.get_supp_file_pdf(mmcif_file))
 
     with open(temp_html, "w") as fh:
         fh.write(outputText)
 
-    pdfkit.from_file(temp_html, output_pdf, options=options_supp)
+    # pdfkit is needed only for PDFs, not for --help or failed runs
+    import pdfkit
+    with profiling.timed('pdfkit'):
+        pdfkit.from_file(temp_html, output_pdf, options=options_supp)
     os.remove(temp_html)
 
     return output_pdf
@@ -249,61 +295,99 @@ def write_json(mmcif_file: str, template_dict: dict, dirName: str, dirName_Outpu
         fh.write(j)
 
 
-############################################################################################################################
-# Run script
-#################################################
-
-if __name__ == "__main__":
-    from pyvirtualdisplay import Display
-    from selenium import webdriver
-    # display = Display(visible=0, size=(1024, 768))
-    # display.start()
-    # driver = webdriver.Firefox()
-
-    firefox_options = webdriver.FirefoxOptions()
-    firefox_options.add_argument('--headless')
-    driver = webdriver.Firefox(options=firefox_options)
-
-
-    logging.info("Clean up and create output directories")
-    utility.clean_all()
-
-    if Path(output_path).is_dir():
-        if args.force:
-            logging.info(f'Overwriting output directory {output_path}')
-            shutil.rmtree(output_path)
+def get_batch_entries(sources: list) -> list:
+    '''
+    expand directories, glob patterns and manifest files into a list
+    of (mmcif_file, output_prefix) pairs. A manifest is a text file
+    with one mmCIF file per line, optionally followed by an output prefix.
+    Relative paths in a manifest are relative to the manifest itself.
+    '''
+    entries = []
+    for source in sources:
+        path = Path(source)
+        if path.is_dir():
+            entries.extend((str(fn), fn.stem) for fn in sorted(path.glob('*.cif')))
+        elif path.is_file() and path.suffix != '.cif':
+            with open(path, 'r') as f:
+                for line in f:
+                    line = line.split('#', 1)[0].split()
+                    if not line:
+                        continue
+                    fn = Path(line[0])
+                    if not fn.is_absolute():
+                        fn = Path(path.parent, fn)
+                    prefix = line[1] if len(line) > 1 else fn.stem
+                    entries.append((str(fn), prefix))
+        elif path.is_file():
+            entries.append((str(path), path.stem))
         else:
-            logging.info(f'Output directory {output_path} exists. '
-                         'Use --force to overwright')
-            sys.exit(0)
-
-    if not Path(args.cache_root).is_dir():
-        os.makedirs(args.cache_root)
-        logging.info(f'Created cache dir {args.cache_root}')
-
-    createdirs(dirNames)
-    manager = Manager()  # create only 1 mgr
-    d = manager.dict()  # create only 1 dict
-    report = WriteReport(args.f,
-                         db=args.databases_root,
-                         driver=driver,
-                         cache=args.cache_root,
-                         nocache=args.nocache)
+            matches = sorted(glob.glob(source))
+            if not matches:
+                logging.warning(f'No mmCIF files found for {source}')
+            entries.extend((fn, Path(fn).stem) for fn in matches)
+
+    # Every entry needs its own output directory
+    unique = []
+    prefixes = set()
+    for fn, prefix in entries:
+        if prefix in prefixes:
+            logging.error(f'Skipping {fn}: duplicate output prefix {prefix}')
+            continue
+        prefixes.add(prefix)
+        unique.append((fn, prefix))
+
+    return unique
+
+
+def write_reports(mmcif_file: str, output_prefix: str, dirNames: dict,
+                  args: argparse.Namespace, driver=None, pool=None,
+                  asset_store: AssetStore = None, timestamp: str = None) -> None:
+    '''
+    run all validation stages for one entry and write HTML and PDF reports
+    into existing output directories. args are options of the parser
+    '''
+    if asset_store is None:
+        asset_store = AssetStore(args.cache_root, args.html_resources)
+    if timestamp is None:
+        timestamp = get_timestamp()
+
+    output_path = Path(args.output_root, output_prefix)
+    with profiling.timed("Read mmCIF"):
+        report = WriteReport(mmcif_file,
+                             db=args.databases_root,
+                             driver=driver,
+                             cache=args.cache_root,
+                             nocache=args.nocache,
+                             jobs=args.jobs,
+                             timeout=args.tool_timeout,
+                             pool=pool,
+                             shard_molprobity=args.shard_molprobity,
+                             sas_pvalue=args.sas_pvalue)
+
+    # Compiled templates are kept next to cached results
+    template_cache = str(Path(args.cache_root, 'templates'))
+
+    Template_Dict = {}
+    Template_Dict['date'] = timestamp
 
     logging.info("Entry composition")
-    template_dict = report.run_entry_composition(Template_Dict)
+    with profiling.timed("Entry composition"):
+        template_dict = report.run_entry_composition(Template_Dict)
 
     logging.info("Model quality")
-    template_dict, molprobity_dict, exv_data = report.run_model_quality(
-        template_dict, csvDirName=dirNames['csv'], htmlDirName=dirNames['html'])
+    with profiling.timed("Model quality"):
+        template_dict, molprobity_dict, exv_data = report.run_model_quality(
+            template_dict, csvDirName=dirNames['csv'], htmlDirName=dirNames['html'])
 
     if args.enable_sas:
         logging.info("SAS validation")
-        template_dict, sas_data, sas_fit = report.run_sas_validation(template_dict)
+        with profiling.timed("SAS validation"):
+            template_dict, sas_data, sas_fit = report.run_sas_validation(template_dict)
 
         logging.info("SAS validation plots")
-        report.run_sas_validation_plots(
-            template_dict, imageDirName=dirNames['images'])
+        with profiling.timed("SAS validation plots"):
+            report.run_sas_validation_plots(
+                template_dict, imageDirName=dirNames['images'])
 
     else:
         sas_data = {}
@@ -312,70 +396,215 @@ if __name__ == "__main__":
     # uncomment below to run CX analysis
     if args.enable_cx:
         logging.info("CX validation")
-        template_dict, cx_data, cx_ertypes = report.run_cx_validation(template_dict)
+        with profiling.timed("CX validation"):
+            template_dict, cx_data, cx_ertypes = report.run_cx_validation(template_dict)
         cx_fit = None
 
         logging.info("CX validation plots")
-        report.run_cx_validation_plots(template_dict,
-                                       imageDirName=dirNames['images'])
+        with profiling.timed("CX validation plots"):
+            report.run_cx_validation_plots(template_dict,
+                                           imageDirName=dirNames['images'])
 
     else:
         cx_fit = None
 
     logging.info("Quality at a glance")
-    report.run_quality_glance(
-        molprobity_dict, exv_data, sas_data, sas_fit, cx_fit, imageDirName=dirNames['images'])
+    with profiling.timed("Quality at a glance"):
+        report.run_quality_glance(
+            molprobity_dict, exv_data, sas_data, sas_fit, cx_fit, imageDirName=dirNames['images'])
 
     logging.info("Write PDF")
-    output_pdf = write_pdf(args.f, template_dict, template_pdf,
-              dirNames['pdf'], dirNames['pdf'])
-    shutil.copy(output_pdf, str(output_path))
+    with profiling.timed("Write PDF"):
+        output_pdf = write_pdf(mmcif_file, template_dict, template_pdf,
+                  dirNames['pdf'], dirNames['pdf'], cache_dir=template_cache)
+        shutil.copy(output_pdf, str(output_path))
 
     template_dict['validation_pdf'] = Path(output_pdf).name
 
     logging.info("Supplementary table")
-    template_dict = report.run_supplementary_table(template_dict,
-                                                   location=args.ls,
-                                                   physics=physics,
-                                                   method_details=args.m,
-                                                   sampling_validation=None,
-                                                   validation_input=args.v1,
-                                                   cross_validation=args.v2,
-                                                   Data_quality=args.dv,
-                                                   clustering=None,
-                                                   )
-    output_pdf = write_supplementary_table(
-        args.f, template_dict, template_file_supp, dirNames['pdf'], dirNames['pdf'])
-    shutil.copy(output_pdf, str(output_path))
+    with profiling.timed("Supplementary table"):
+        template_dict = report.run_supplementary_table(template_dict,
+                                                       location=args.ls,
+                                                       physics=get_physics(args.p),
+                                                       method_details=args.m,
+                                                       sampling_validation=None,
+                                                       validation_input=args.v1,
+                                                       cross_validation=args.v2,
+                                                       Data_quality=args.dv,
+                                                       clustering=None,
+                                                       )
+        output_pdf = write_supplementary_table(
+            mmcif_file, template_dict, template_file_supp, dirNames['pdf'], dirNames['pdf'],
+            cache_dir=template_cache)
+        shutil.copy(output_pdf, str(output_path))
 
     template_dict['supplementary_pdf'] = Path(output_pdf).name
 
     # logging.info("Write JSON")
-    # write_json(args.f, template_dict, dirNames['json'], dirNames['json'])
+    # write_json(mmcif_file, template_dict, dirNames['json'], dirNames['json'])
 
     logging.info("Write HTML")
     # set html mode
     template_dict['html_mode'] = args.html_mode
-    write_html(args.f, template_dict, template_flask, dirNames['html'])
-    if args.html_mode == 'local':
-        shutil.copytree(
-            args.html_resources,
-            str(Path(dirNames['html'], Path(args.html_resources).stem))
-        )
-    # Compress html output to one file
-    shutil.make_archive(
-        root_dir=output_path,
-        base_dir=output_prefix,
-        base_name=f'{dirNames["root_html"]}_html',
-        format='gztar')
-
-
-    # Keep uncompressed html output for convience
-    # otherwise delete
-    if args.keep_html:
-        pass
-    else:
+    # Paths in the archive are relative to the output directory
+    html_dir = Path(dirNames['html']).relative_to(output_path)
+    with profiling.timed("Write HTML"):
+        # Keep uncompressed html output for convience,
+        # otherwise stream it into the compressed archive
+        if args.keep_html:
+            sink = archive.DirectoryWriter(output_path)
+        else:
+            sink = archive.ArchiveWriter(f'{dirNames["root_html"]}_html',
+                                         compressor=args.compressor,
+                                         jobs=args.jobs)
+        with sink:
+            # Images, tables and PDFs of the previous stages
+            sink.add_tree(output_prefix, dirNames['root_html'])
+            pages = write_html(mmcif_file, template_dict, template_flask,
+                               sink, html_dir, cache_dir=template_cache,
+                               jobs=args.jobs, pool=pool)
+            if args.html_mode == 'local':
+                # Only resources used by the pages, from the shared store
+                static_dir = Path(html_dir, Path(args.html_resources).name)
+                for ref in find_assets(pages, args.html_resources):
+                    sink.add_file(str(Path(static_dir, ref)), asset_store.get(ref))
+
+    if not args.keep_html:
         shutil.rmtree(dirNames['root_html'])
 
+
+def validate_entry(mmcif_file: str, output_prefix: str,
+                   args: argparse.Namespace, driver=None, pool=None,
+                   asset_store: AssetStore = None, timestamp: str = None) -> bool:
+    '''
+    run validation for one entry and write HTML and PDF reports,
+    returns False if the output already exists. Shared resources
+    are passed on to write_reports
+    '''
+    output_path = Path(args.output_root, output_prefix)
+    dirNames = get_dirnames(args.output_root, output_prefix)
+
+    logging.info("Clean up and create output directories")
+    utility.clean_all()
+
+    if Path(output_path).is_dir():
+        if args.force:
+            logging.info(f'Overwriting output directory {output_path}')
+            shutil.rmtree(output_path)
+        else:
+            logging.info(f'Output directory {output_path} exists. '
+                         'Use --force to overwright')
+            return False
+
+    createdirs(dirNames)
+
+    # Every stage and external tool is timed, see profiling.Profiler
+    profiler = profiling.Profiler(Path(mmcif_file).name)
+    try:
+        with profiler.activate():
+            write_reports(mmcif_file, output_prefix, dirNames, args,
+                          driver=driver, pool=pool,
+                          asset_store=asset_store, timestamp=timestamp)
+    finally:
+        profiler.write(Path(output_path, 'profile.json'))
+        if args.profile_summary:
+            logging.info(profiler.summary())
+
     logging.info("Final cleanup")
     utility.clean_all()
+
+    return True
+
+
+############################################################################################################################
+# Run script
+#################################################
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    if args.batch and args.output_prefix is not None:
+        parser.error('--output-prefix can not be used with --batch')
+    try:
+        archive.get_compressor(args.compressor)
+    except ValueError as e:
+        parser.error(str(e))
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING)
+
+    timestamp = get_timestamp()
+
+    if args.batch:
+        entries = get_batch_entries(args.batch)
+        if not entries:
+            logging.error('No entries to validate')
+            sys.exit(1)
+    else:
+        output_prefix = Path(args.f).stem
+        if args.output_prefix is not None:
+            output_prefix = args.output_prefix
+        entries = [(args.f, output_prefix)]
+
+    if not Path(args.cache_root).is_dir():
+        os.makedirs(args.cache_root)
+        logging.info(f'Created cache dir {args.cache_root}')
+
+    # One worker pool, browser and template environment for all entries.
+    # Workers are forked before any threads (browser, SASBDB downloads)
+    # are started, a fork of a threaded process may deadlock.
+    # With the browser renderer every worker renders SAS figures
+    # with its own browser, started on first use
+    pool = None
+    if args.jobs != 1 and (len(entries) > 1 or args.renderer == 'browser'):
+        pool = mp.Pool(processes=args.jobs,
+                       initializer=static_export.init_render_worker,
+                       initargs=(args.renderer == 'browser',))
+
+    driver = None
+    if args.renderer == 'browser':
+        # from pyvirtualdisplay import Display
+        # display = Display(visible=0, size=(1024, 768))
+        # display.start()
+        driver = static_export.get_webdriver()
+
+    asset_store = AssetStore(args.cache_root, args.html_resources)
+
+    # SASBDB data is fetched in the background while entries are validated
+    mirror = None
+    if args.enable_sas:
+        import sasbdb
+        mirror = sasbdb.get_mirror(args.databases_root)
+        mirror.prefetch_files([mmcif_file for mmcif_file, _ in entries])
+
+    failed = []
+    try:
+        for i, (mmcif_file, output_prefix) in enumerate(entries, 1):
+            if args.batch:
+                logging.warning(f'[{i}/{len(entries)}] Validating {mmcif_file}')
+            try:
+                validate_entry(mmcif_file, output_prefix, args,
+                               driver=driver, pool=pool,
+                               asset_store=asset_store, timestamp=timestamp)
+            except Exception:
+                # A broken entry should not stop the whole batch
+                if not args.batch:
+                    raise
+                logging.exception(f'Validation of {mmcif_file} failed')
+                failed.append(mmcif_file)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+        if driver is not None:
+            driver.quit()
+        if mirror is not None:
+            mirror.close()
+
+        ResultCache(args.cache_root,
+                    max_size=None if args.cache_max_size is None
+                    else int(args.cache_max_size * 1024 ** 2),
+                    max_age=None if args.cache_max_age is None
+                    else args.cache_max_age * 24 * 3600).evict()
+
+    if failed:
+        logging.error(f'Validation failed for {len(failed)} of {len(entries)} entries: '
+                      + ', '.join(failed))
+        sys.exit(1)
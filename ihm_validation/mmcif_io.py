@@ -12,11 +12,13 @@
 
 import ihm
 import ihm.reader
+import functools
 import os
 import re
 from collections import defaultdict
 from itertools import chain
 import utility
+from resultcache import file_sha256
 
 import logging
 from typing import Final
@@ -62,55 +64,214 @@ if IHMV_MODE == IHMVAvailableModes.DEVELOPMENT:
 MAX_NUM_MODELS: Final = __max_num_models  # Set constant for maximum number of models in a file
 
 
+#########################
+# Tokenize _atom_site loop
+#########################
+
+# Columns required by MolProbity: (name, value for a missing column,
+# value for '.'); label_seq_id '.' is replaced by the line number
+ATOM_SITE_DEFAULTS: Final = (
+    ('_atom_site.occupancy', '1', '0.67'),
+    ('_atom_site.B_iso_or_equiv', '1', '0.00'),
+    ('_atom_site.label_seq_id', '1', None),
+)
+
+
+def iter_atom_site_rows(lines, columns: dict, before: list = None,
+                        after: list = None):
+    """
+    Yield (line number, tokens) of the _atom_site rows in one pass.
+
+    columns is filled with {line number: column name} as the loop
+    header is read and is complete before the first row is yielded.
+    Missing occupancy, B-factor and label_seq_id columns are appended
+    and their values are filled in. Tokenized lines up to the first
+    header line and from the end of the loop are appended to before
+    and after, if given.
+    """
+    lines = iter(lines)
+    in_header = False
+    fill = None
+    for i, line in enumerate(lines):
+        tokens = line.split()
+        if fill is None:
+            if tokens and '_atom_site.' in tokens[0]:
+                if not columns and before is not None:
+                    before.append(tokens)
+                columns[i] = tokens[0]
+                in_header = True
+                continue
+            if not in_header:
+                if before is not None:
+                    before.append(tokens)
+                continue
+            fill = _get_atom_site_fill(columns, i)
+
+        if not tokens:
+            continue
+
+        if 'ATOM' in tokens[0] or 'HETATM' in tokens[0]:
+            for idx, missing, dot in fill:
+                if len(tokens) <= idx:
+                    tokens.append(missing)
+                elif tokens[idx] == '.':
+                    tokens[idx] = str(i) if dot is None else dot
+            yield i, tokens
+            continue
+
+        # End of the loop
+        if after is not None:
+            after.append(tokens)
+            after.extend(line.split() for line in lines)
+        return
+
+
+def _get_atom_site_fill(columns: dict, start: int) -> list:
+    """Append missing default columns to the header and return
+    (column index, value for missing, value for '.') tuples"""
+    names = list(columns.values())
+    for name, _, _ in ATOM_SITE_DEFAULTS:
+        if name not in names:
+            columns[start] = name
+            start += 1
+            names.append(name)
+    return [(names.index(name), missing, dot)
+            for name, missing, dot in ATOM_SITE_DEFAULTS]
+
+
 #########################
 # Get information from IHM reader
 #########################
 
-class GetInputInformation(object):
-    def __init__(self, mmcif_file):
+class ParsedSystem(object):
+    """Parsed ihm.System of an mmCIF file.
+    Parse the file once and pass the object to every validator
+    of a report run instead of re-reading the file in each of them"""
+    def __init__(self, mmcif_file, model_class=ihm.model.Model):
         self.mmcif_file = mmcif_file
-        self.encoding = None
-        self.datasets = {}
-        self.entities = {}
-        self.model = ihm.model.Model
+        self.model_class = model_class
+        self._digest = None
+        self._views = {}
         encoding = 'utf8'
         try:
             with open(self.mmcif_file, encoding=encoding) as fh:
-                self.system, = ihm.reader.read(fh, model_class=self.model)
+                self.system, = ihm.reader.read(fh, model_class=model_class)
         except UnicodeDecodeError:
             encoding = 'ascii'
             with open(self.mmcif_file, encoding=encoding, errors='ignore') as fh:
-                self.system, = ihm.reader.read(fh, model_class=self.model)
+                self.system, = ihm.reader.read(fh, model_class=model_class)
 
         self.encoding = encoding
 
+    @property
+    def system(self) -> ihm.System:
+        return self._system
+
+    @system.setter
+    def system(self, system: ihm.System) -> None:
+        self._system = system
+        self.invalidate()
+
+    def invalidate(self) -> None:
+        """Drop cached views, call after modifying the system in place"""
+        self._views = {}
+
+    def get_view(self, key, func):
+        """Return the cached view for key, computing it with func once"""
+        try:
+            return self._views[key]
+        except KeyError:
+            view = self._views[key] = func()
+            return view
+
+    @property
+    def digest(self) -> str:
+        """SHA-256 of the mmCIF file, computed once"""
+        if self._digest is None:
+            self._digest = file_sha256(self.mmcif_file)
+        return self._digest
+
+
+def cached_view(func):
+    """
+    Compute a derived view of the system once per ParsedSystem and
+    share it between all validators of the entry. Views are shared
+    objects and should not be modified by callers.
+    """
+    @functools.wraps(func)
+    def wrapper(self):
+        if self.system is not self.parsed.system:
+            # The system was replaced on this validator only
+            return func(self)
+        return self.parsed.get_view(func.__qualname__, lambda: func(self))
+    return wrapper
+
+
+@functools.lru_cache(maxsize=None)
+def read_references(filename: str) -> (dict, dict):
+    """Links and citations of software from references.csv, read once"""
+    ref_link, ref_cit = {}, {}
+    with open(filename, 'r') as f:
+        allref = [_.strip().split('|') for _ in f.readlines()]
+
+    for line in allref:
+        ref_link[line[0].lower().rstrip()] = line[1].rstrip().lstrip()
+        ref_cit[line[0].lower()] = line[2]
+    return ref_link, ref_cit
+
+
+class GetInputInformation(object):
+    def __init__(self, mmcif_file, parsed: ParsedSystem = None):
+        self.mmcif_file = mmcif_file
+        self.encoding = None
+        self.datasets = {}
+        self.entities = {}
+        self.model = ihm.model.Model
+        if parsed is None:
+            parsed = ParsedSystem(self.mmcif_file, model_class=self.model)
+        elif Path(parsed.mmcif_file).resolve() != Path(mmcif_file).resolve():
+            raise ValueError(
+                f'Parsed system belongs to {parsed.mmcif_file}, '
+                f'not to {mmcif_file}')
+
+        self.parsed = parsed
+        self.system = parsed.system
+        self.encoding = parsed.encoding
+
     def get_databases(self):
         """ get all datasets from the mmcif file"""
         dbs = self.system.orphan_datasets
         return dbs
 
+    @cached_view
     def get_id(self):
         """ get id from model name, eg: PDBDEV_00XX will be PDBDEV00XX"""
-        # if self.system.id == 'model':
-        #    id = self.get_id_from_entry()
-        # else:
-        #    id = self.system.id.split('_')[0] + self.system.id.split('_')[1]
+        # ihm.System has id 'model' if _entry.id was not read
+        if self.system.id != 'model':
+            return self.format_entry_id(self.system.id)
         return self.get_id_from_entry()
 
+    @staticmethod
+    def format_entry_id(entry_id: str) -> str:
+        """ drop the underscore of the entry id, PDBDEV_00XX to PDBDEV00XX"""
+        parts = entry_id.strip().split('_')
+        if len(parts) > 1:
+            return parts[0] + parts[1]
+        return parts[0]
+
     def get_id_from_entry(self) -> str:
-        """ get id name from entry for cif files
-            deprecated """
-        sf = open(self.mmcif_file, 'r', encoding='latin1')
-        for ind, ln in enumerate(sf.readlines()):
-            line = ln.strip().split(' ')
-            if '_entry.id' in line[0]:
-                entry_init = line[-1]
-                try:
-                    entry = entry_init.split('_')[0] + \
-                        entry_init.split('_')[1]
-                except:
-                    entry = entry_init.strip()
-        return entry
+        """ get id name from _entry.id in the header of the cif file,
+            stops at the first match or at the coordinates """
+        with open(self.mmcif_file, 'r', encoding='latin1') as sf:
+            for ln in sf:
+                line = ln.split()
+                if not line:
+                    continue
+                if line[0] == '_entry.id' and len(line) > 1:
+                    return self.format_entry_id(line[1].strip('\'"'))
+                if line[0].startswith('_atom_site.'):
+                    break
+        raise ValueError(f'_entry.id is missing from {self.mmcif_file}')
 
     def get_primary_citation_info(self) -> tuple:
         '''get title and authors for the primary citation'''
@@ -155,6 +316,7 @@ class GetInputInformation(object):
             mol_name = strc
         return mol_name
 
+    @cached_view
     def check_sphere(self) -> int:
         """check resolution of structure,
         returns 0 if its atomic and 1 if the model is multires"""
@@ -165,6 +327,7 @@ class GetInputInformation(object):
         else:
             return 0
 
+    @cached_view
     def get_assembly_ID_of_models(self) -> list:
         """Assembly info i.e. model assemblies in the file """
         assembly_id = [
@@ -172,6 +335,7 @@ class GetInputInformation(object):
             for j in i for a in j for b in a]
         return assembly_id
 
+    @cached_view
     def get_representation_ID_of_models(self) -> list:
         """Number of representations in model """
         representation_id = [
@@ -179,6 +343,7 @@ class GetInputInformation(object):
             for j in i for a in j for b in a]
         return representation_id
 
+    @cached_view
     def get_model_names(self) -> list:
         """ Names of models"""
         model_name1 = [
@@ -193,6 +358,7 @@ class GetInputInformation(object):
             model_name = model_name2
         return model_name
 
+    @cached_view
     def get_model_assem_dict(self) -> dict:
         """Map models to assemblies """
         model_id = [int(b._id) for i in self.system.state_groups
@@ -201,6 +367,7 @@ class GetInputInformation(object):
         model_assembly = dict(zip(model_id, assembly_id))
         return model_assembly
 
+    @cached_view
     def get_model_rep_dict(self) -> dict:
         """Map models to representations
             useful especially for multi-state systems"""
@@ -210,6 +377,7 @@ class GetInputInformation(object):
         model_rep = dict(zip(model_id, rep_id))
         return model_rep
 
+    @cached_view
     def get_number_of_models(self) -> int:
         """ Get total number of models """
         models = [
@@ -225,6 +393,7 @@ class GetInputInformation(object):
             residues = 'None available'
         return residues
 
+    @cached_view
     def get_composition(self) -> dict:
         """Get composition dictionary"""
         entry_comp = {'Model ID': [], 'Subunit number': [], 'Subunit ID': [],
@@ -254,6 +423,7 @@ class GetInputInformation(object):
         """ number of protocols/methods used to create model"""
         return len(self.system.orphan_protocols)
 
+    @cached_view
     def get_sampling(self) -> dict:
         """ sampling composition/details """
         sampling_comp = {'Step number': [], 'Protocol ID': [],
@@ -298,6 +468,7 @@ class GetInputInformation(object):
             #        for x in rep if not x.rigid])
             pass
 
+    @cached_view
     def get_RB_flex_dict(self) -> (dict, dict, int, int):
         """ get RB and flexible segments from model information"""
         RB = self.get_empty_chain_dict()
@@ -375,10 +546,14 @@ class GetInputInformation(object):
 
     def get_software_comp(self) -> dict:
         """get software composition to write out as a table"""
+        self.read_all_references()
+        return self._get_software_comp()
+
+    @cached_view
+    def _get_software_comp(self) -> dict:
         software_comp = {'ID': [], 'Software name': [], 'Software version': [
         ], 'Software classification': [], 'Software location': []}
         lists = self.system.software
-        self.read_all_references()
         if len(lists) > 0:
             for software in lists:
                 software_comp['ID'].append(software._id)
@@ -436,23 +611,15 @@ class GetInputInformation(object):
 
 
     def read_all_references(self) -> None:
-        self.ref_link = dict()
-        self.ref_cit = dict()
-
         template_path = Path(Path(__file__).parent.parent.resolve(), 'templates')
         reference_filename = str(Path(template_path, 'references.csv'))
-
-        with open(reference_filename, 'r') as f:
-            allref = [_.strip().split('|') for _ in f.readlines()]
-
-        for line in allref:
-            self.ref_link[line[0].lower().rstrip()] = line[1].rstrip().lstrip()
-            self.ref_cit[line[0].lower()] = line[2]
+        self.ref_link, self.ref_cit = read_references(reference_filename)
 
     def check_ensembles(self) -> int:
         """check if ensembles exist"""
         return len(self.system.ensembles)
 
+    @cached_view
     def get_ensembles(self):
         """details on ensembles, if it exists"""
         if len(self.system.ensembles) > 0:
@@ -489,6 +656,7 @@ class GetInputInformation(object):
                                                               [restraints['Dataset ID']
                                                                .index(id)])
 
+    @cached_view
     def get_dataset_dict(self):
         """get dataset dictionary """
         dataset_dict = defaultdict()
@@ -509,6 +677,7 @@ class GetInputInformation(object):
         else:
             return len(lists)
 
+    @cached_view
     def get_dataset_comp(self) -> dict:
         """detailed dataset composition"""
         dataset_comp = {'ID': [], 'Dataset type': [],
@@ -551,6 +720,7 @@ class GetInputInformation(object):
                         dataset_dic[str(i._id)] = 'None'
         return dataset_dic
 
+    @cached_view
     def get_restraints(self) -> dict:
         """ get restraints table from cif file"""
         r = self.system.restraints
@@ -617,6 +787,7 @@ class GetInputInformation(object):
                 '''
         return restraints_comp
 
+    @cached_view
     def get_dataset_details(self) -> dict:
         """get information on dataset and databases"""
         dataset_comp = {'ID': [], 'Dataset type': [],
@@ -662,6 +833,7 @@ class GetInputInformation(object):
 
         return dataset_comp
 
+    @cached_view
     def get_atomic_coverage(self) -> str:
         """Measure amount of atomic residues"""
         for _ in self.system.orphan_representations:
@@ -707,53 +879,15 @@ class GetInputInformation(object):
     def mmcif_get_lists(self, filetemp=None) -> (list, dict, dict, list):
         """function to help re-write mmcif file for molprobity
         this function reads the atom_site dictionary terms and returns a list"""
+        before_atom_site, atom_site, after_atom = [], {}, []
         if filetemp is None:
-            file = open(self.mmcif_file, 'r', encoding='latin1')
+            with open(self.mmcif_file, 'r', encoding='latin1') as file:
+                atoms = dict(iter_atom_site_rows(
+                    file, atom_site, before_atom_site, after_atom))
         else:
-            file = filetemp
             filetemp.seek(0)
-        all_lines = []
-        for i, j in enumerate(file.readlines()):
-            all_lines.append(j.strip().split())
-        atom_site = {}
-        atoms = {}
-        before_atom_site = []
-        after_atom = []
-        for i, j in enumerate(all_lines):
-            if len(j) > 0 and '_atom_site.' in j[0]:
-                if len(before_atom_site) == 0:
-                    before_atom_site = all_lines[:i+1]
-                atom_site[i] = j[0]
-            elif ('_atom_site.B_iso_or_equiv' not in list(atom_site.values())) and len(list(atom_site.values())) > 0:
-                atom_site[i] = '_atom_site.B_iso_or_equiv'
-            elif ('_atom_site.occupancy' not in list(atom_site.values())) and len(list(atom_site.values())) > 0:
-                atom_site[i] = '_atom_site.occupancy'
-
-            elif ('_atom_site.label_seq_id' not in list(atom_site.values())) and len(list(atom_site.values())) > 0:
-                atom_site[i] = '_atom_site.label_seq_id'
-
-        total_list = list(atom_site.values())
-        index_biso = total_list.index('_atom_site.B_iso_or_equiv')
-        index_occu = total_list.index('_atom_site.occupancy')
-        index_label_seq = total_list.index('_atom_site.label_seq_id')
-        for i, j in enumerate(all_lines):
-            if len(j) > 0 and ('ATOM' in j[0] or 'HETATM' in j[0]) and (i > list(atom_site.keys())[-1]):
-                if len(j) <= index_occu:
-                    j.extend(['1'])
-                elif j[index_occu] == '.':
-                    j[index_occu] = '0.67'
-                if len(j) <= index_biso:
-                    j.extend(['1'])
-                elif j[index_biso] == '.':
-                    j[index_biso] = '0.00'
-                if len(j) <= index_label_seq:
-                    j.extend(['1'])
-                elif j[index_label_seq] == '.':
-                    j[index_label_seq] = str(i)
-                atoms[i] = j
-            elif len(j) > 0 and (i > list(atom_site.keys())[-1]):
-                if len(after_atom) == 0:
-                    after_atom = all_lines[i:]
+            atoms = dict(iter_atom_site_rows(
+                filetemp, atom_site, before_atom_site, after_atom))
         return before_atom_site, atom_site, atoms, after_atom
 
     def delete_extra_loops(self, some_text=list()) -> list:
@@ -791,6 +925,7 @@ class GetInputInformation(object):
                 return colnum
         return None
 
+    @cached_view
     def get_representation_details(self) -> dict:
         """Extract details about representation (atomic/coarse-grained)"""
         reprs = {'atomic': False, 'coarse-grained': False, 'coarse-grain_levels': []}
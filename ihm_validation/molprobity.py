@@ -7,25 +7,101 @@
 # ganesans@salilab.org
 ###################################
 import logging
-import pickle
 import os
 from pathlib import Path
+import shutil
 import subprocess
 from subprocess import run
-from mmcif_io import GetInputInformation, MAX_NUM_MODELS
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from mmcif_io import GetInputInformation, ParsedSystem, MAX_NUM_MODELS
+import profiling
 import ihm
 import ihm.reader
 import collections
+from collections import defaultdict
+from itertools import chain
 import pandas as pd
 import csv
 import re
 
+# Buffer size for streaming mmCIF rewrite
+IO_BUFFER_SIZE = 1 << 20
+
+
+def iter_without_flr_loops(lines):
+    '''
+    Yield lines of an mmCIF file except for _flr loops.
+    Works in one pass over byte lines and buffers only
+    the header of the current loop.
+    '''
+    header = None
+    in_loop = False
+    skip = False
+    text_field = False
+
+    for line in lines:
+        # Content of multi-line text fields is not interpreted
+        if text_field:
+            if line.startswith(b';'):
+                text_field = False
+            if not skip:
+                yield line
+            continue
+
+        token = line.lstrip()
+        if token.startswith(b'loop_'):
+            if header is not None:
+                # Empty loop
+                if not is_flr_loop(header):
+                    yield from header
+            header = [line]
+            in_loop = True
+            skip = False
+            continue
+
+        if header is not None:
+            if token.startswith(b'_'):
+                header.append(line)
+                continue
+            # First data line, the category of the loop is known now
+            skip = is_flr_loop(header)
+            if not skip:
+                yield from header
+            header = None
+
+        elif in_loop and token.startswith((b'_', b'data_', b'save_')):
+            # Loop is over
+            in_loop = False
+            skip = False
+
+        if line.startswith(b';'):
+            text_field = True
+
+        if not skip:
+            yield line
+
+    if header is not None and not is_flr_loop(header):
+        yield from header
+
+
+def is_flr_loop(header: list) -> bool:
+    return any(h.lstrip().startswith(b'_flr') for h in header[1:])
+
+
+def model_sort_key(model_id: str) -> tuple:
+    """order numeric model ids as numbers, the rest as strings"""
+    try:
+        return (0, int(model_id))
+    except ValueError:
+        return (1, model_id)
+
 
 class GetMolprobityInformation(GetInputInformation):
     _tempfiles = []
 
-    def __init__(self, mmcif_file, cache):
-        super().__init__(mmcif_file)
+    def __init__(self, mmcif_file, cache, parsed: ParsedSystem = None):
+        super().__init__(mmcif_file, parsed=parsed)
         self.verify_molprobity_installation()
         self.version = self.get_version()
         self.ID = Path(mmcif_file).stem
@@ -124,46 +200,18 @@ class GetMolprobityInformation(GetInputInformation):
             return False
 
     def rewrite_mmcif(self, outfn='temp.cif'):
-        '''Workaround to generate molprobity-compliant mmCIF'''
+        '''
+        Workaround to generate molprobity-compliant mmCIF.
+        The file is streamed as bytes, so the encoding is preserved
+        and memory use does not depend on the size of the file.
+        '''
         fn = self.mmcif_file
         if Path(outfn).is_file():
             os.remove(outfn)
-        encoding = 'utf-8'
-        try:
-            with open(fn, 'r', encoding=encoding) as f:
-                raw = f.readlines()
-        except:
-            encoding = 'latin-1'
-            with open(fn, 'r', encoding=encoding) as f:
-                raw = f.readlines()
 
-        loop_lines = []
-        loop = False
-        out = []
-        skip_loop = False
-        for line in raw:
-            loop_break = False
-            if re.match('loop_', line):
-                if loop and not skip_loop:
-                       out.extend(loop_lines)
-
-                loop = True
-                skip_loop = False
-                loop_lines = [line]
-
-            elif loop:
-                loop_lines.append(line)
-
-                if re.match('_flr', line):
-                    skip_loop = True
-            else:
-                out.append(line)
-
-        if loop and not skip_loop:
-                out.extend(loop_lines)
-
-        with open(outfn, 'w', encoding=encoding) as f:
-            f.write(''.join(out))
+        with open(fn, 'rb', buffering=IO_BUFFER_SIZE) as fin, \
+                open(outfn, 'wb', buffering=IO_BUFFER_SIZE) as fout:
+            fout.writelines(iter_without_flr_loops(fin))
 
 
 
@@ -174,39 +222,43 @@ class GetMolprobityInformation(GetInputInformation):
             return True
         return False
 
-    def run_ramalyze(self, d: dict):
+    @profiling.timed('molprobity.ramalyze')
+    def run_ramalyze(self, d: dict, timeout: float = None,
+                     cif: str = None, cwd: str = None):
         """run ramalyze to get outliers """
-        f_name = str(Path(self.cache, self.ID+'_temp_rama.txt'))
+        cif, cwd = cif or self._tempcif, cwd or self.cache
+        f_name = str(Path(cwd, self.ID+'_temp_rama.txt'))
         self._tempfiles.append(f_name)
 
         with open(f_name, 'w+') as f:
-            run(['molprobity.ramalyze', self._tempcif],
+            run(['molprobity.ramalyze', cif],
                 stdout=f,
-                cwd=self.cache)
+                cwd=cwd,
+                timeout=timeout)
 
         with open(f_name, 'r') as f:
             line = [_.strip() for _ in f.readlines()]
 
         d['rama'] = line
-        f_name = str(Path(self.cache, self.ID + '_temp_rama.pickle'))
 
-        with open(f_name, 'wb') as f:
-            pickle.dump(d['rama'], f)
-
-    def run_molprobity(self, d: dict):
+    @profiling.timed('molprobity.molprobity')
+    def run_molprobity(self, d: dict, timeout: float = None,
+                       cif: str = None, cwd: str = None):
         """run molprobity"""
+        cif, cwd = cif or self._tempcif, cwd or self.cache
         f_name = str(Path(
-            self.cache, self.ID + '_temp_mp.txt'))
+            cwd, self.ID + '_temp_mp.txt'))
         self._tempfiles.append(f_name)
 
         with open(f_name, 'w+') as f:
-            run(['molprobity.molprobity', self._tempcif,
+            run(['molprobity.molprobity', cif,
                  "disable_uc_volume_vs_n_atoms_check=True",
                  "coot=False"],
                 stdout=f,
-                cwd=self.cache)
+                cwd=cwd,
+                timeout=timeout)
             try:
-                os.remove(str(Path(self.cache, 'molprobity.out')))
+                os.remove(str(Path(cwd, 'molprobity.out')))
             except OSError:
                 logging.error("Couldn't delete molprobity.out")
 
@@ -214,51 +266,224 @@ class GetMolprobityInformation(GetInputInformation):
             line = [_.strip() for _ in f.readlines()]
 
         d['molprobity'] = line
-        f_name = str(Path(self.cache, self.ID + '_temp_mp.pickle'))
-
-        with open(f_name, 'wb') as f:
-            pickle.dump(d['molprobity'], f)
 
-    def run_clashscore(self, d: dict):
+    @profiling.timed('molprobity.clashscore')
+    def run_clashscore(self, d: dict, timeout: float = None,
+                       cif: str = None, cwd: str = None):
         """run clashscore to get information on steric clashes"""
+        cif, cwd = cif or self._tempcif, cwd or self.cache
         f_name = str(Path(
-            self.cache, self.ID + '_temp_clash.txt'))
+            cwd, self.ID + '_temp_clash.txt'))
         self._tempfiles.append(f_name)
 
         with open(f_name, 'w+') as f:
-            run(['molprobity.clashscore', self._tempcif],
+            run(['molprobity.clashscore', cif],
                 stdout=f,
-                cwd=self.cache)
+                cwd=cwd,
+                timeout=timeout)
 
         with open(f_name, 'r') as f:
             line = [_.strip() for _ in f.readlines()]
 
         d['clash'] = line
 
-        f_name = str(Path(
-            self.cache, self.ID + '_temp_clash.pickle'))
-
-        with open(f_name, 'wb') as f:
-            pickle.dump(d['clash'], f)
-
-    def run_rotalyze(self, d: dict):
+    @profiling.timed('molprobity.rotalyze')
+    def run_rotalyze(self, d: dict, timeout: float = None,
+                     cif: str = None, cwd: str = None):
         """run rotalyZe to get rotameric outliers"""
-        f_name = str(self.ID)+'_temp_rota.txt'
+        cif, cwd = cif or self._tempcif, cwd or self.cache
+        f_name = str(Path(cwd, self.ID + '_temp_rota.txt'))
         self._tempfiles.append(f_name)
 
         with open(f_name, 'w+') as f:
-            run(['molprobity.rotalyze', self._tempcif],
+            run(['molprobity.rotalyze', cif],
                 stdout=f,
-                cwd=self.cache)
+                cwd=cwd,
+                timeout=timeout)
 
         with open(f_name, 'r') as f:
             line = [_.strip() for _ in f.readlines()]
 
         d['rota'] = line
-        f_name = str(Path(self.cache, self.ID+'_temp_rota.pickle'))
 
-        with open(f_name, 'wb') as f:
-            pickle.dump(d['rota'], f)
+    def get_tools(self) -> dict:
+        """molprobity tools keyed by the name of their output in d"""
+        return {
+            'clash': self.run_clashscore,
+            'rama': self.run_ramalyze,
+            'rota': self.run_rotalyze,
+            'molprobity': self.run_molprobity,
+        }
+
+    def run_all(self, d: dict, timeouts=None) -> dict:
+        """
+        run clashscore, ramalyze, rotalyze and molprobity concurrently.
+        The tools are independent subprocesses reading the same temp.cif,
+        so the total wall time is that of the slowest tool.
+        timeouts is either a number of seconds applied to every tool
+        or a dict keyed by the tool names ('clash', 'rama', 'rota',
+        'molprobity'). Returns wall-clock time of every tool in seconds.
+        A tool that times out or fails is logged and its key is
+        left out of d.
+        """
+        tools = self.get_tools()
+
+        if not isinstance(timeouts, dict):
+            timeouts = {name: timeouts for name in tools}
+
+        timings = {}
+
+        def timed_run(name, func):
+            start = time.perf_counter()
+            try:
+                func(d, timeout=timeouts.get(name))
+            finally:
+                timings[name] = time.perf_counter() - start
+
+        with ThreadPoolExecutor(max_workers=len(tools)) as executor:
+            futures = {executor.submit(timed_run, name, func): name
+                       for name, func in tools.items()}
+            for future in as_completed(futures):
+                name = futures[future]
+                try:
+                    future.result()
+                except subprocess.TimeoutExpired:
+                    logging.error(f'Molprobity tool {name} timed out '
+                                  f'after {timeouts.get(name)} s')
+                except OSError as e:
+                    logging.error(f'Molprobity tool {name} failed: {e}')
+                else:
+                    logging.info(f'Molprobity tool {name} finished '
+                                 f'in {timings[name]:.1f} s')
+
+        return timings
+
+    def run_all_sharded(self, d: dict, timeouts=None, jobs: int = None) -> dict:
+        """
+        run all molprobity tools on every model separately.
+        temp.cif is split into one file per model and every
+        (model, tool) pair is a job for a pool of jobs threads,
+        so large ensembles use all cores. d gets the output of
+        every tool as {model id: lines}, which is processed
+        with exact per-model attribution. A tool is left out of d
+        if it failed for any model. Falls back to run_all if the
+        file has no model id column. Returns total time of every
+        tool in seconds.
+        """
+        shards = self.split_models()
+        if not shards:
+            logging.warning('Could not split models, running molprobity '
+                            'on the whole file')
+            return self.run_all(d, timeouts=timeouts)
+
+        tools = self.get_tools()
+
+        if not isinstance(timeouts, dict):
+            timeouts = {name: timeouts for name in tools}
+
+        def timed_run(name, path):
+            out = {}
+            start = time.perf_counter()
+            tools[name](out, timeout=timeouts.get(name),
+                        cif=str(path), cwd=str(path.parent))
+            return out[name], time.perf_counter() - start
+
+        outputs = {name: {} for name in tools}
+        timings = dict.fromkeys(tools, 0.)
+        with ThreadPoolExecutor(max_workers=jobs or os.cpu_count()) as executor:
+            futures = {executor.submit(timed_run, name, path): (name, model_id)
+                       for model_id, path in shards.items() for name in tools}
+            for future in as_completed(futures):
+                name, model_id = futures[future]
+                try:
+                    outputs[name][model_id], elapsed = future.result()
+                except subprocess.TimeoutExpired:
+                    logging.error(f'Molprobity tool {name} timed out '
+                                  f'on model {model_id} '
+                                  f'after {timeouts.get(name)} s')
+                except OSError as e:
+                    logging.error(f'Molprobity tool {name} failed '
+                                  f'on model {model_id}: {e}')
+                else:
+                    timings[name] += elapsed
+
+        for name, output in outputs.items():
+            if len(output) == len(shards):
+                d[name] = {model_id: output[model_id] for model_id in shards}
+
+        logging.info(f'Molprobity finished on {len(shards)} models')
+        return timings
+
+    def read_models(self, lines) -> (list, list, dict, list):
+        """
+        group lines of an mmCIF file by model.
+        Returns lines before the _atom_site rows, the _atom_site header,
+        {model id: atom rows} and lines after the _atom_site loop.
+        Rows are None if there is no model id column.
+        """
+        prefix, header, suffix = [], [], []
+        rows = defaultdict(list)
+        column = None
+        lines = iter(lines)
+        for line in lines:
+            if line.startswith('_atom_site.'):
+                header.append(line)
+            elif header:
+                column = self.get_model_id_column(
+                    {i: h.split()[0] for i, h in enumerate(header)})
+                if column is None or any(len(h.split()) > 1 for h in header):
+                    return prefix, header, None, suffix
+                for line in chain([line], lines):
+                    tokens = line.split()
+                    if not tokens:
+                        continue
+                    if tokens[0] not in ('ATOM', 'HETATM'):
+                        break
+                    rows[tokens[column]].append(line)
+                else:
+                    return prefix, header, rows, suffix
+                suffix.append(line)
+                suffix.extend(lines)
+                return prefix, header, rows, suffix
+            else:
+                prefix.append(line)
+
+        return prefix, header, None, suffix
+
+    def split_models(self) -> dict:
+        """
+        split temp.cif into one file per model.
+        Every file is written to its own directory, as molprobity
+        leaves auxiliary files in the working directory.
+        Returns {model id: path} for the first self.nos models in
+        the order of model ids, empty if the file can not be split.
+        """
+        with open(self._tempcif, 'r', encoding='latin1', newline='',
+                  buffering=IO_BUFFER_SIZE) as f:
+            prefix, header, rows, suffix = self.read_models(f)
+
+        if not rows:
+            return {}
+
+        shards = {}
+        for model_id in sorted(rows, key=model_sort_key)[:self.nos]:
+            shard_dir = Path(self.cache, f'{self.ID}_model_{model_id}')
+            shard_dir.mkdir(parents=True, exist_ok=True)
+            self._tempfiles.append(str(shard_dir))
+            path = Path(shard_dir, f'{self.ID}_model_{model_id}.cif')
+            with open(path, 'w', encoding='latin1', newline='',
+                      buffering=IO_BUFFER_SIZE) as f:
+                f.writelines(chain(prefix, header, rows[model_id], suffix))
+            shards[model_sort_key(model_id)[1]] = path
+
+        return shards
+
+    @staticmethod
+    def merge_models(func, models: dict) -> tuple:
+        """apply func to molprobity output of every model,
+        concatenate lists and sum counts in the results"""
+        results = [func(line) for line in models.values()]
+        return tuple(sum(parts[1:], parts[0]) for parts in zip(*results))
 
     def write_all_lines(self, file_handle) -> list:
         """print all lines from file to list """
@@ -269,6 +494,8 @@ class GetMolprobityInformation(GetInputInformation):
     def process_rama(self, line: list) -> dict:
         """ reading and processing molprobity output from rama outliers.
         Outputs information specific to models """
+        if isinstance(line, dict):
+            return {model_id: lines[1:-3] for model_id, lines in line.items()}
         line_new = line[1:-3]
         count = 1
         models = {_: [] for _ in range(1, self.nos+1)}
@@ -286,6 +513,8 @@ class GetMolprobityInformation(GetInputInformation):
 
     def process_molprobity(self, line: list) -> (list, list):
         """ process molprobity files to extract relevant information """
+        if isinstance(line, dict):
+            return self.merge_models(self.process_molprobity, line)
         bond_index = angle_index = None
         for ind, el in enumerate(line):
             if 'Bond outliers' in el:
@@ -309,6 +538,8 @@ class GetMolprobityInformation(GetInputInformation):
 
     def process_angles(self, line: list) -> (list, int):
         """ process molprobity files to extract relevant information """
+        if isinstance(line, dict):
+            return self.merge_models(self.process_angles, line)
         total_angles = 0
         angle_index_beg = None
         angle_index_end = None
@@ -533,6 +764,8 @@ class GetMolprobityInformation(GetInputInformation):
 
     def process_bonds(self, line: list) -> (list, int):
         """ process molprobity files to extract relevant information """
+        if isinstance(line, dict):
+            return self.merge_models(self.process_bonds, line)
         total_bonds = 0
         bond_index_beg = None
         bond_index_end = None
@@ -549,6 +782,8 @@ class GetMolprobityInformation(GetInputInformation):
             if 'Bond outliers' in el:
                 bond_index_beg = ind+2
                 break
+        if bond_index_beg is None:
+            return [], total_bonds
         bond_index_end1 = find_end_line(
             bond_index_beg, ind_end, match_word='Molprobity')
         bond_index_end2 = find_end_line(
@@ -629,6 +864,14 @@ class GetMolprobityInformation(GetInputInformation):
 
     def process_clash(self, line: list) -> dict:
         """ process clash files to extract relevant information """
+        if isinstance(line, dict):
+            clashes = {}
+            for model_id, lines in line.items():
+                end = self.find_clashscore_records(lines)
+                start = next((i for i, j in enumerate(lines)
+                              if 'Bad Clashes' in j), end)
+                clashes[f'Model {model_id}'] = [lines[start+1:end]]
+            return clashes
         count = [i for i, j in enumerate(line) if 'Bad Clashes' in j]
         if self.nos > 1:
             vals = [j.split(' ')[5]
@@ -664,6 +907,8 @@ class GetMolprobityInformation(GetInputInformation):
 
     def process_rota(self, line: list) -> dict:
         """ process rota files to extract relevant information """
+        if isinstance(line, dict):
+            return {model_id: lines[1:-1] for model_id, lines in line.items()}
         line_new = line[1:-1]
         count = 1
         models = {_: [] for _ in range(1, self.nos+1)}
@@ -717,7 +962,13 @@ class GetMolprobityInformation(GetInputInformation):
             str(Path(self.cache,  self.ID+'_clash_summary.txt')), 'w+') as f_clash:
 
             clashes = self.process_clash(line)
-            if self.nos > 1:
+            if isinstance(line, dict):
+                # Every model was processed separately
+                clashscore_list = [
+                    f'Model {model_id} ' +
+                    lines[self.find_clashscore_records(lines)]
+                    for model_id, lines in line.items()]
+            elif self.nos > 1:
                 # Find the beginning of clashscore records
                 cs_start = self.find_clashscore_records(line)
                 # Extract only X models
@@ -915,6 +1166,12 @@ class GetMolprobityInformation(GetInputInformation):
     def cleanup(self):
         for f_name in self._tempfiles:
             try:
-                os.remove(f_name)
+                if Path(f_name).is_dir():
+                    shutil.rmtree(f_name)
+                else:
+                    os.remove(f_name)
+            except FileNotFoundError:
+                # Files of per-model runs go with their directory
+                pass
             except OSError:
                 logging.error(f"Coldn't delete temp file: {f_name}")
@@ -0,0 +1,182 @@
+###################################
+# Script :
+# 1) Contains per-stage timing and
+# resource profile of a validation run
+#
+###################################
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from itertools import count
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows, CPU time and RSS are not recorded
+    resource = None
+
+# ru_maxrss is in kilobytes on Linux and in bytes on macOS
+RSS_UNIT = 1 if sys.platform == 'darwin' else 1024
+
+# Profiler that records timed blocks, None disables profiling
+_active = None
+
+
+def get_usage() -> dict:
+    """
+    Resource counters of this process and its finished subprocesses.
+    CPU time includes all threads and reaped children, peak RSS is
+    a high-water mark of the process or of its largest child.
+    """
+    usage = {'wall': time.perf_counter(), 'cpu': None, 'rss': None,
+             'written': get_bytes_written()}
+    if resource is not None:
+        own = resource.getrusage(resource.RUSAGE_SELF)
+        children = resource.getrusage(resource.RUSAGE_CHILDREN)
+        usage['cpu'] = (own.ru_utime + own.ru_stime
+                        + children.ru_utime + children.ru_stime)
+        usage['rss'] = max(own.ru_maxrss, children.ru_maxrss) * RSS_UNIT
+    return usage
+
+
+def get_bytes_written():
+    """Bytes written by this process and its reaped children,
+    None if the kernel does not provide I/O accounting"""
+    try:
+        with open('/proc/self/io') as f:
+            for line in f:
+                if line.startswith('wchar:'):
+                    return int(line.split()[1])
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+class Profiler(object):
+    """
+    Wall time, CPU time, peak RSS and bytes written of every stage
+    and external tool call of one entry.
+
+    Counters are process-wide, so blocks running concurrently in
+    threads (e.g. molprobity tools) have exact wall times, but share
+    CPU time and bytes written. Blocks running in worker processes
+    are not recorded.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.records = []
+        self.total = None
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._root = None
+        self._start = None
+        # Records are ordered by the start of their block
+        self._order = count()
+
+    @contextmanager
+    def activate(self):
+        """Make this profiler record timed() blocks and time the whole run"""
+        global _active
+        previous, _active = _active, self
+        self._start = get_usage()
+        try:
+            yield self
+        finally:
+            self.total = self._record(self.name, None, self._start, get_usage())
+            _active = previous
+
+    @contextmanager
+    def stage(self, name: str):
+        """Time a block, nested blocks are recorded with their parent"""
+        stack = self._get_stack()
+        # Blocks in worker threads belong to the stage of the main run
+        parent = stack[-1] if stack else self._root
+        stack.append(name)
+        if parent is None:
+            self._root = name
+        order = next(self._order)
+        start = get_usage()
+        failed = True
+        try:
+            yield
+            failed = False
+        finally:
+            stack.pop()
+            if parent is None:
+                self._root = None
+            record = self._record(name, parent, start, get_usage())
+            if failed:
+                record['failed'] = True
+            with self._lock:
+                self.records.append((order, record))
+
+    def _get_stack(self) -> list:
+        if not hasattr(self._local, 'stack'):
+            self._local.stack = []
+        return self._local.stack
+
+    def _record(self, name: str, parent: str, start: dict, end: dict) -> dict:
+        def delta(key):
+            if start[key] is None or end[key] is None:
+                return None
+            return end[key] - start[key]
+
+        return {
+            'name': name,
+            'parent': parent,
+            'start_s': round(start['wall'] - self._start['wall'], 3),
+            'wall_time_s': round(delta('wall'), 3),
+            'cpu_time_s': None if delta('cpu') is None else round(delta('cpu'), 3),
+            'peak_rss_mb': None if end['rss'] is None
+            else round(end['rss'] / 1024 ** 2, 1),
+            'bytes_written': delta('written'),
+        }
+
+    def to_dict(self) -> dict:
+        return {
+            'entry': self.name,
+            'pid': os.getpid(),
+            'total': self.total,
+            'stages': [r for _, r in sorted(self.records, key=lambda x: x[0])],
+        }
+
+    def write(self, filename) -> None:
+        with open(filename, 'w') as f:
+            json.dump(self.to_dict(), f, indent=2)
+        logging.info(f'Wrote profile to {filename}')
+
+    def summary(self, top: int = 3) -> str:
+        """One line with total time and the slowest top-level stages"""
+        stages = sorted((r for _, r in self.records if r['parent'] is None),
+                        key=lambda x: x['wall_time_s'], reverse=True)
+        slowest = ', '.join(f"{r['name']} {r['wall_time_s']:.1f} s"
+                            for r in stages[:top])
+        line = f'Profile {self.name}: '
+        if self.total is not None:
+            line += f"{self.total['wall_time_s']:.1f} s wall"
+            if self.total['cpu_time_s'] is not None:
+                line += f", {self.total['cpu_time_s']:.1f} s CPU"
+            if self.total['peak_rss_mb'] is not None:
+                line += f", peak RSS {self.total['peak_rss_mb']:.0f} MB"
+            line += '; '
+        return line + f'slowest: {slowest}'
+
+
+@contextmanager
+def timed(name: str):
+    """
+    Time a block or, as a decorator, a function in the active
+    profiler. Does nothing if profiling is not active.
+    """
+    profiler = _active
+    if profiler is None:
+        yield
+        return
+    with profiler.stage(name):
+        yield
+
@@ -0,0 +1,59 @@
+###################################
+# Script :
+# 1) Contains the Jinja environment of
+# report templates and functions to
+# render HTML pages
+#
+###################################
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from pathlib import Path
+import jinja2
+
+TEMPLATE_PATH = Path(Path(__file__).parent.parent.resolve(), 'templates')
+
+
+@lru_cache(maxsize=None)
+def get_environment(cache_dir: str = None) -> jinja2.Environment:
+    """
+    Template environment of this process. Templates are compiled once
+    and kept in memory for all entries, compiled bytecode is also
+    stored in cache_dir and reused by later runs.
+    """
+    bytecode_cache = None
+    if cache_dir is not None:
+        Path(cache_dir).mkdir(parents=True, exist_ok=True)
+        bytecode_cache = jinja2.FileSystemBytecodeCache(str(cache_dir))
+    return jinja2.Environment(
+        loader=jinja2.FileSystemLoader(searchpath=str(TEMPLATE_PATH)),
+        bytecode_cache=bytecode_cache,
+        # Templates do not change during a run, skip checking them
+        auto_reload=False)
+
+
+def render(template_file: str, template_dict: dict, cache_dir: str = None) -> str:
+    template = get_environment(cache_dir).get_template(template_file)
+    return template.render(template_dict)
+
+
+def _render_page(task: tuple) -> tuple:
+    template_file, template_dict, cache_dir = task
+    return template_file, render(template_file, template_dict, cache_dir=cache_dir)
+
+
+def iter_pages(template_dict: dict, template_list: list, cache_dir: str = None,
+               jobs: int = None, pool=None):
+    """
+    Render templates and yield (template_file, text) in the order of
+    template_list as soon as each page is ready. Pages are rendered
+    by worker processes of pool if given, otherwise by threads.
+    """
+    tasks = [(template_file, template_dict, cache_dir)
+             for template_file in template_list]
+    if pool is not None:
+        yield from pool.imap(_render_page, tasks)
+        return
+
+    jobs = len(tasks) if jobs is None else min(jobs, len(tasks))
+    with ThreadPoolExecutor(max_workers=max(jobs, 1)) as executor:
+        yield from executor.map(_render_page, tasks)
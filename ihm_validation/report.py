@@ -8,30 +8,43 @@
 # ganesans@salilab.org
 ###################################
 
-import os
-from pathlib import Path
 import logging
-from mmcif_io import GetInputInformation
-import excludedvolume
-import molprobity
-import get_plots, sas, sas_plots
-import cx
+from mmcif_io import GetInputInformation, ParsedSystem
 import utility
-import pickle
+from resultcache import ResultCache
 import json
-from multiprocessing import Manager
 from collections import Counter
 import numpy as np
 
 class WriteReport(object):
-    def __init__(self, mmcif_file, db, driver, cache, nocache=False):
+    def __init__(self, mmcif_file, db, driver, cache, nocache=False, jobs=None,
+                 timeout=None, cache_max_size=None, cache_max_age=None,
+                 pool=None, shard_molprobity=False, sas_pvalue='cormap'):
         self.mmcif_file = mmcif_file
         self.db = db
-        self.input = GetInputInformation(self.mmcif_file)
-        # Webdriver for figures
+        # Parse the mmCIF file only once and share it with all validators
+        self.parsed = ParsedSystem(self.mmcif_file)
+        self.input = GetInputInformation(self.mmcif_file, parsed=self.parsed)
+        # Webdriver for figures, None draws static figures with matplotlib
         self.driver = driver
         self.cache = cache
         self.nocache = nocache
+        # Results are cached by file content and tool version,
+        # --nocache only skips lookups, new results are still stored
+        self.result_cache = ResultCache(cache, refresh=nocache,
+                                        max_size=cache_max_size,
+                                        max_age=cache_max_age)
+        # Number of worker processes for parallel stages
+        self.jobs = jobs
+        # Optional multiprocessing pool of the run, reused across entries
+        # and for SAS figures (see static_export.init_render_worker)
+        self.pool = pool
+        # Timeout in seconds for every external validation tool
+        self.timeout = timeout
+        # Run molprobity tools on every model separately
+        self.shard_molprobity = shard_molprobity
+        # Backend of SAS p-values, 'cormap' or 'datcmp'
+        self.sas_pvalue = sas_pvalue
 
 
     def run_entry_composition(self, Template_Dict: dict) -> dict:
@@ -138,48 +151,36 @@ class WriteReport(object):
             # if there are no spheres, wed have atoms, so go ahead and set exv to 0/none
             # global clashscore; global rama; global sidechain;
             exv_data = None
+            molprobity_dict = None
+            import molprobity
             I_mp = molprobity.GetMolprobityInformation(self.mmcif_file,
-                                                       cache = self.cache)
-            Template_Dict['molprobity_version'] = I_mp.get_version()
-            key = Path(self.mmcif_file).stem
-            filename = str(Path(
-                self.cache, key + '_temp_mp.pickle'))
+                                                       cache=self.cache,
+                                                       parsed=self.parsed)
+            Template_Dict['molprobity_version'] = I_mp.version
+            # results are keyed by the content of the file and molprobity version
+            # per-model runs store their output in a different layout
+            key = self.result_cache.key('molprobity', self.parsed.digest,
+                                        I_mp.version,
+                                        *(['sharded'] if self.shard_molprobity else []))
+            d_mp = self.result_cache.get(key)
             # check if molprobity for this entry has already been detetmined
-            if os.path.exists(filename) and not self.nocache:
-                d_mp = {}
+            if d_mp is not None:
                 logging.info("Molprobity analysis file already exists...\n...assuming clashscores, \
                         Ramachandran and rotamer outliers have already been calculated")
-                with open(filename, 'rb') as fp:
-                    d_mp['molprobity'] = pickle.load(fp)
-
-                f_rota = str(Path(
-                    self.cache, key + '_temp_rota.pickle'))
-                with open(f_rota, 'rb') as fp:
-                    d_mp['rota'] = pickle.load(fp)
-
-                f_rama = str(Path(
-                    self.cache, key + '_temp_rama.pickle'))
-                with open(f_rama, 'rb') as fp:
-                    d_mp['rama'] = pickle.load(fp)
-
-                f_clash = str(Path(
-                    self.cache, key + '_temp_clash.pickle'))
-                with open(f_clash, 'rb') as fp:
-                    d_mp['clash'] = pickle.load(fp)
 
             else:
                 # if molprobity for these entries have not yet been determined, go ahead and set them up to run
-                # we rewrite all files into a format that is suitable for molprobity
-                I_mp = molprobity.GetMolprobityInformation(self.mmcif_file, cache=self.cache)
+                # the file has already been rewritten into a format that is suitable
+                # for molprobity by the GetMolprobityInformation constructor
                 logging.info("Molprobity analysis is being calculated...")
+                d_mp = {}
                 try:
-                    manager = Manager()
-                    d_mp = manager.dict()
-                    # utility.runInParallel(
-                    I_mp.run_clashscore(d_mp)
-                    I_mp.run_ramalyze(d_mp)
-                    I_mp.run_rotalyze(d_mp)
-                    I_mp.run_molprobity(d_mp)
+                    # all four tools run concurrently
+                    if self.shard_molprobity:
+                        I_mp.run_all_sharded(d_mp, timeouts=self.timeout,
+                                             jobs=self.jobs)
+                    else:
+                        I_mp.run_all(d_mp, timeouts=self.timeout)
                     # Cleanup
                     I_mp.cleanup()
 
@@ -188,6 +189,12 @@ class WriteReport(object):
                 except (TypeError, KeyError, ValueError):
                     logging.error("Molprobity cannot be calculated...")
 
+                if set(d_mp) != {'clash', 'rama', 'rota', 'molprobity'}:
+                    logging.error("Molprobity cannot be calculated...")
+                    d_mp = {}
+                else:
+                    self.result_cache.put(key, d_mp)
+
             # at this stage, we should have all our dictionary terms
             if d_mp:
                 # get total number of bond and angle outliers (this is an approx number)
@@ -277,21 +284,22 @@ class WriteReport(object):
             # set the appropriate flag for assessing atomic segments
             Template_Dict['assess_atomic_segments'] = None
             # check if exv has already been evaluated
-            file = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', '..', '..',
-                                                'Validation', 'results', str(Template_Dict['ID'])+'exv.txt'))
-            if os.path.exists(file) and not self.nocache:
+            import excludedvolume
+            key = self.result_cache.key('exv', self.parsed.digest,
+                                        excludedvolume.ENGINE_VERSION)
+            exv_data = self.result_cache.get(key)
+            if exv_data is not None:
                 logging.info("Excluded volume file already exists...")
-                with open(file, 'r') as inf:
-                    line = [ln.strip().replace('[', '').replace(']', '').replace('"', '').
-                            replace(' ', '').split(',')[1:] for ln in inf.readlines()]
-                exv_data = {
-                    'Models': line[0], 'Excluded Volume Satisfaction (%)':
-                    line[1], 'Number of violations': line[2]}
             else:
                 logging.info("Excluded volume is being calculated...")
-                I_ev = excludedvolume.GetExcludedVolume(self.mmcif_file, cache=self.cache)
+                I_ev = excludedvolume.GetExcludedVolume(self.mmcif_file,
+                                                        cache=self.cache,
+                                                        parsed=self.parsed,
+                                                        jobs=self.jobs,
+                                                        pool=self.pool)
                 model_dict = I_ev.get_all_spheres()
                 exv_data = I_ev.run_exc_vol_parallel(model_dict)
+                self.result_cache.put(key, exv_data)
 
             Template_Dict['NumModels'] = len(exv_data['Models'])
             viol_percent = np.asarray(exv_data['Excluded Volume Satisfaction (%)'], dtype=float)
@@ -322,9 +330,17 @@ class WriteReport(object):
         # we start by checking if sas dataset was used to build model
         if self.input.check_for_sas(self.input.get_dataset_comp()):
             Template_Dict['sas'] = ["True"]
-            I_sas = sas.SasValidation(self.mmcif_file, self.db)
-            Template_Dict['atsas_version'] = I_sas.get_atsas_version()
-            Template_Dict['p_val'] = utility.dict_to_JSlist(I_sas.get_pvals())
+            import sas
+            I_sas = sas.SasValidation(self.mmcif_file, self.db,
+                                      parsed=self.parsed, cache=self.cache,
+                                      pvalue_backend=self.sas_pvalue)
+            Template_Dict['atsas_version'] = I_sas.version
+            # p-values depend on the entry, SASCIF files and implementation
+            key = self.result_cache.key('sas', self.parsed.digest,
+                                        I_sas.get_pvalue_version(),
+                                        *I_sas.get_sascif_digests())
+            pvals = self.result_cache.get_or_compute(key, I_sas.get_pvals)
+            Template_Dict['p_val'] = utility.dict_to_JSlist(pvals)
             Template_Dict['sasdb_code'] = I_sas.get_sas_ids()
             Template_Dict['sasdb_code_html'] = I_sas.get_sasbdb_ids()
             Template_Dict['sasdb_sascif'] = I_sas.check_sascif_dicts()
@@ -366,14 +382,13 @@ class WriteReport(object):
             # I_sas = sas.SasValidation(self.mmcif_file)
             # create all relevant plots
             # try:
+            import sas_plots
             I_sas_plt = sas_plots.SasValidationPlots(
-                self.mmcif_file, imageDirName, self.driver)
-            I_sas_plt.plot_multiple()
+                self.mmcif_file, imageDirName, self.driver,
+                db=self.db, parsed=self.parsed, cache=self.cache)
             # I_sas.get_pofr_errors()
-            I_sas_plt.plot_pf()
-            I_sas_plt.plot_Guinier()
-            if Template_Dict['number_of_fits'] > 0:
-                I_sas_plt.plot_fits()
+            I_sas_plt.plot_all(fits=Template_Dict['number_of_fits'] > 0,
+                               jobs=self.jobs, pool=self.pool)
             # exception occurs if sascif not present
             # except (TypeError, KeyError, ValueError):
             #     pass
@@ -396,7 +411,9 @@ class WriteReport(object):
 
         if self.input.check_for_cx(self.input.get_dataset_comp()):
             Template_Dict['cx'] = True
-            I_cx = cx.CxValidation(self.mmcif_file)
+            import cx
+            I_cx = cx.CxValidation(self.mmcif_file, parsed=self.parsed,
+                                   result_cache=self.result_cache)
             self.I_cx = I_cx
 
             raw_data = None
@@ -449,7 +466,9 @@ class WriteReport(object):
         '''
         get quality at glance image; will be updated as validation report is updated
         '''
-        I_plt = get_plots.Plots(self.mmcif_file, imageDirName, driver=self.driver)
+        import get_plots
+        I_plt = get_plots.Plots(self.mmcif_file, imageDirName,
+                                driver=self.driver, parsed=self.parsed)
         I_plt.plot_quality_at_glance(
             molprobity_dict, exv_data, sas_data, sas_fit, cx_fit)
 
@@ -0,0 +1,164 @@
+###################################
+# Script :
+# 1) Contains content-addressed cache
+# for validation results
+#
+###################################
+import hashlib
+import json
+import logging
+import os
+import pickle
+import tempfile
+import time
+from pathlib import Path
+
+
+def file_sha256(filename, chunk_size: int = 1 << 20) -> str:
+    """SHA-256 of a file, read in chunks"""
+    h = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class ResultCache(object):
+    """
+    Cache of validation results on disk.
+
+    Entries are keyed by the content of the input (e.g. SHA-256 of
+    the mmCIF file) and the version of the tool that produced them,
+    not by the file name. A re-deposited file with the same name
+    therefore misses the cache, while a renamed identical file hits it.
+    Values are pickled and written atomically.
+    """
+
+    def __init__(self, root, refresh: bool = False,
+                 max_size: int = None, max_age: float = None):
+        """
+        root: cache directory
+        refresh: ignore existing entries, but still store new ones
+        max_size: maximum total size of the cache in bytes
+        max_age: maximum age of an entry in seconds
+        """
+        self.root = Path(root, 'results')
+        self.refresh = refresh
+        self.max_size = max_size
+        self.max_age = max_age
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    @staticmethod
+    def key(namespace: str, *parts) -> str:
+        """Build a cache key from a namespace and any JSON-serializable parts,
+        typically a content hash and a tool version"""
+        raw = json.dumps([namespace] + [str(p) for p in parts])
+        digest = hashlib.sha256(raw.encode('utf-8')).hexdigest()
+        return f'{namespace}-{digest}'
+
+    def path(self, key: str) -> Path:
+        namespace, digest = key.rsplit('-', 1)
+        return Path(self.root, namespace, digest[:2], f'{digest}.pickle')
+
+    def get(self, key: str, default=None):
+        """Return cached value or default"""
+        if self.refresh:
+            return default
+
+        fn = self.path(key)
+        try:
+            with open(fn, 'rb') as f:
+                value = pickle.load(f)
+        except FileNotFoundError:
+            return default
+        except (pickle.UnpicklingError, EOFError, AttributeError) as e:
+            logging.warning(f'Ignoring corrupted cache entry {fn}: {e}')
+            return default
+
+        # Mark entry as recently used for the size-based eviction
+        try:
+            os.utime(fn)
+        except OSError:
+            pass
+
+        logging.info(f'Found {key} in the result cache')
+        return value
+
+    def put(self, key: str, value) -> None:
+        """Store value atomically"""
+        fn = self.path(key)
+        fn.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=fn.parent, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, fn)
+        except BaseException:
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+            raise
+
+    def get_or_compute(self, key: str, func, *args, **kwargs):
+        """Return cached value or compute, store and return it"""
+        sentinel = object()
+        value = self.get(key, sentinel)
+        if value is sentinel:
+            value = func(*args, **kwargs)
+            self.put(key, value)
+        return value
+
+    def entries(self) -> list:
+        """All cache entries as (path, size, mtime)"""
+        out = []
+        for fn in self.root.glob('*/*/*.pickle'):
+            try:
+                st = fn.stat()
+            except OSError:
+                continue
+            out.append((fn, st.st_size, st.st_mtime))
+        return out
+
+    def evict(self, max_size: int = None, max_age: float = None) -> int:
+        """
+        Remove entries older than max_age seconds, then remove the least
+        recently used entries until the cache is below max_size bytes.
+        Returns number of removed entries.
+        """
+        max_size = self.max_size if max_size is None else max_size
+        max_age = self.max_age if max_age is None else max_age
+
+        entries = sorted(self.entries(), key=lambda x: x[2])
+        removed = 0
+        keep = []
+        now = time.time()
+
+        for fn, size, mtime in entries:
+            if max_age is not None and now - mtime > max_age:
+                removed += self._remove(fn)
+            else:
+                keep.append((fn, size, mtime))
+
+        if max_size is not None:
+            total = sum(x[1] for x in keep)
+            for fn, size, mtime in keep:
+                if total <= max_size:
+                    break
+                removed += self._remove(fn)
+                total -= size
+
+        if removed > 0:
+            logging.info(f'Evicted {removed} entries from the result cache')
+
+        return removed
+
+    @staticmethod
+    def _remove(fn) -> int:
+        try:
+            os.remove(fn)
+        except OSError:
+            return 0
+        return 1
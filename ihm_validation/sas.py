@@ -6,49 +6,64 @@
 # ganesans - Salilab - UCSF
 # ganesans@salilab.org
 ###################################
-import os
 import re
 import subprocess
+import tempfile
 import numpy as np
 import pandas as pd
-import requests
 import json
-from sklearn.linear_model import LinearRegression
 from decimal import Decimal
-from mmcif_io import GetInputInformation
+from mmcif_io import GetInputInformation, ParsedSystem
+from resultcache import file_sha256
+import sasbdb
+import cormap
+import profiling
 from subprocess import run
 import operator
-import logging
 from io import StringIO
 
-import sys
-import pkgutil
 from pathlib import Path
 
-saspath = pkgutil.get_loader('sasciftools').path
-saspath = str(Path(saspath).parent)
-sys.path.insert(0, saspath)
-from mmCif import mmcifIO
 
 class SasValidation(GetInputInformation):
-    db_name = 'SASBDB'
-
-    def __init__(self, mmcif_file, db='.'):
-        super().__init__(mmcif_file)
-        self.version = self.get_atsas_version()
+    db_name = sasbdb.DB_NAME
+
+    def __init__(self, mmcif_file, db='.', parsed: ParsedSystem = None,
+                 cache=None, pvalue_backend: str = 'cormap'):
+        super().__init__(mmcif_file, parsed=parsed)
+        # CorMap p-values are computed in process ('cormap') or by ATSAS
+        # datcmp ('datcmp'), ATSAS is needed only for the latter
+        if pvalue_backend not in ('cormap', 'datcmp'):
+            raise ValueError(f'Unknown p-value backend {pvalue_backend}')
+        self.pvalue_backend = pvalue_backend
+        self.version = (self.get_atsas_version()
+                        if pvalue_backend == 'datcmp' else None)
         self.ID = str(GetInputInformation.get_id(self))
         self.nos = GetInputInformation.get_number_of_models(self)
         self.dataset = GetInputInformation.get_dataset_comp(self)
         self.imagepath = '../static/images/'
-        self.saslink = 'https://sasbdb.org/media/sascif/sascif_files/'
         self.sasentry = 'https://sasbdb.org/rest-api/entry/summary/'
         self.db = str(Path(db, self.db_name))
+        self.mirror = sasbdb.get_mirror(db)
         self.sasbdb_ids = self.get_sasbdb_ids()
+        # Parsed SASCIF files are stored as arrays in the cache directory
+        self.sascif_cache = None if cache is None else str(Path(cache, 'sascif'))
+        self.sascif_files = {}
+        self.sascif_digests = {}
         self.sascif_dicts = self.get_sascif_dicts()
         self.intensities = self.get_intensities()
         self.intensities = self.modify_intensity()
         # self.data_dic = self.get_data_from_SASBDB()
 
+    def get_pvalue_version(self) -> str:
+        '''
+        version of the p-value implementation, used as a part
+        of the cache key for SAS results
+        '''
+        if self.pvalue_backend == 'datcmp':
+            return f'datcmp {self.version}'
+        return f'cormap {cormap.VERSION}'
+
     def get_atsas_version(self, tool: str = 'datcmp') -> str:
         """ Get ATSAS version """
         line = subprocess.check_output(
@@ -88,44 +103,35 @@ class SasValidation(GetInputInformation):
 
     def get_sascif_dicts(self):
         sascif_dicts = {}
-        sasCIFIn = mmcifIO.CifFileReader()
 
         for code in self.sasbdb_ids:
             sascif_fn = self.get_sascif_file(code)
             if sascif_fn is not None:
-                sascif_dicts[code] = sasCIFIn.read(sascif_fn)
+                self.sascif_files[code] = sascif_fn
+                self.sascif_digests[code] = file_sha256(sascif_fn)
+                sascif_dicts[code] = sasbdb.read_sascif(
+                    sascif_fn, f'{code}-{self.sascif_digests[code]}',
+                    cache_dir=self.sascif_cache)
 
         return sascif_dicts
 
+    def get_sascif_digests(self) -> list:
+        '''
+        get SHA-256 of every used SASCIF file, used as a part
+        of the cache key for SAS results
+        '''
+        return [f'{code}:{digest}'
+                for code, digest in sorted(self.sascif_digests.items())]
+
     def check_sascif_dicts(self):
         return(['True' for x in self.sascif_dicts.keys()])
 
-    def get_sascif_file(self, code, output_dir='.'):
+    def get_sascif_file(self, code):
         '''
-        get data from SASCIF files
+        get SASCIF file from the local mirror, waits for the file
+        if it is prefetched or fetches it from SASBDB
         '''
-
-        url = f'{self.saslink}{code}.sascif'
-        fn = Path(output_dir, f'{code}.sascif')
-        cache_fn = Path(self.db, f'{code}.sascif')
-
-        # Check if we already requested the data
-        if os.path.isfile(cache_fn):
-            logging.info('Found in cache!')
-            fn = cache_fn
-        elif not os.path.isfile(fn):
-            response = requests.get(url)
-            response.encoding = 'ascii'
-            if response.status_code != 200:
-                logging.error(
-                    "Unable to fetch data from SASBDB, "
-                    "please check the entry ID")
-                fn = None
-            else:
-                with open(fn, 'w') as f:
-                    f.write(response.text)
-
-        return fn
+        return self.mirror.get(code)
 
     def get_intensities(self) -> dict:
         '''
@@ -307,67 +313,73 @@ class SasValidation(GetInputInformation):
 
     def get_pvals(self) -> dict:
         '''
-        get p-values from ATSAS
+        get p-values of the CorMap test of every fit, computed in process
+        or with ATSAS datcmp, depending on pvalue_backend
         '''
-        num_of_fits = self.get_number_of_fits()
         pval_table = {'SASDB ID': [], 'Model': [], 'χ²': [], 'p-value': []}
 
         for code in self.sasbdb_ids:
             sascif = self.sascif_dicts[code]
-            main = f'{code}_MAIN'
-            data = sascif[main]
-
-            refX = np.array(data['_sas_scan_intensity']['momentum_transfer'], dtype=float)
-            refY = np.array(data['_sas_scan_intensity']['intensity'], dtype=float)
-            refS = np.array(data['_sas_scan_intensity']['intensity_su_counting'], dtype=float)
 
+            chisqs = []
             fits = []
-
-            c = 0
             for k, v in sascif.items():
-
                 if re.search('FIT', k):
-                    c += 1
-                    chisq = round(float(v['_sas_model_fitting_details']['chi_square']), 2)
-
-                    pval_table['SASDB ID'].append(code)
-                    pval_table['Model'].append(c)
-
-                    fitX = np.array(v['_sas_model_fitting']['momentum_transfer'], dtype=float)
-                    fit_refY = np.array(v['_sas_model_fitting']['intensity'], dtype=float)
-                    fitY = np.array(v['_sas_model_fitting']['fit'], dtype=float)
-
-                    fit_1 = pd.DataFrame({
-                        'Q': fitX,
-                        'Ie': fit_refY
-                    })
-
-                    fit_2 = pd.DataFrame({
-                        'Q': fitX,
-                        'Ib': fitY
-                    })
-
-                    fit_1.to_csv('fit1.csv', header=False, index=False)
-                    fit_2.to_csv('fit2.csv', header=False, index=False)
-                    f1 = open('pval.txt', 'w+')
-                    with f1 as outfile:
-                       run(['datcmp', 'fit1.csv',
-                            'fit2.csv'], stdout=outfile, shell=False)
-                    f2 = open('pval.txt', 'r')
-                    all_lines = [j.strip().split()
-                                 for i, j in enumerate(f2.readlines())]
-                    p_val = [all_lines[i+1][4]
-                             for i, j in enumerate(all_lines) if 'adj' in j][0]
-
-                    pval_table['p-value'].append('%.2E' % Decimal(p_val))
-                    pval_table['χ²'].append('%.2f' % chisq)
+                    chisqs.append(round(float(v['_sas_model_fitting_details']['chi_square']), 2))
+                    fits.append((
+                        np.array(v['_sas_model_fitting']['momentum_transfer'], dtype=float),
+                        np.array(v['_sas_model_fitting']['intensity'], dtype=float),
+                        np.array(v['_sas_model_fitting']['fit'], dtype=float)))
+
+            p_vals = []
+            if self.pvalue_backend == 'datcmp':
+                p_vals = [self.get_datcmp_pval(*fit) for fit in fits]
+            elif len(fits) > 0:
+                # All fits of the dataset are tested at once
+                _, p_vals = cormap.get_pvalues(
+                    cormap.pad_curves([fit[1] for fit in fits]),
+                    cormap.pad_curves([fit[2] for fit in fits]))
+
+            for c, (chisq, p_val) in enumerate(zip(chisqs, p_vals), 1):
+                pval_table['SASDB ID'].append(code)
+                pval_table['Model'].append(c)
+                pval_table['p-value'].append('%.2E' % Decimal(p_val))
+                pval_table['χ²'].append('%.2f' % chisq)
 
-            if c == 0:
+            if len(fits) == 0:
                 pval_table['SASDB ID'].append(code)
                 pval_table['Model'].append('N/A')
                 pval_table['p-value'].append('N/A')
         return pval_table
 
+    def get_datcmp_pval(self, fitX: np.ndarray, fit_refY: np.ndarray,
+                        fitY: np.ndarray) -> str:
+        '''
+        get adjusted p-value of the CorMap test of one fit from ATSAS datcmp
+        '''
+        fit_1 = pd.DataFrame({
+            'Q': fitX,
+            'Ie': fit_refY
+        })
+
+        fit_2 = pd.DataFrame({
+            'Q': fitX,
+            'Ib': fitY
+        })
+
+        # Own directory, so that concurrent runs do not share files
+        with tempfile.TemporaryDirectory() as tmpdir:
+            fit_1.to_csv(Path(tmpdir, 'fit1.csv'), header=False, index=False)
+            fit_2.to_csv(Path(tmpdir, 'fit2.csv'), header=False, index=False)
+            with profiling.timed('datcmp'):
+                out = run(['datcmp', 'fit1.csv', 'fit2.csv'], cwd=tmpdir,
+                          stdout=subprocess.PIPE, text=True, shell=False).stdout
+
+        all_lines = [j.strip().split() for j in out.splitlines()]
+        p_val = [all_lines[i+1][4]
+                 for i, j in enumerate(all_lines) if 'adj' in j][0]
+        return p_val
+
     def get_pofr_ext(self) -> dict:
         '''
         get pair-distance details from SASCIF files
@@ -438,6 +450,7 @@ class SasValidation(GetInputInformation):
         '''
         get Guinier plot data from JSON files
         '''
+        from sklearn.linear_model import LinearRegression
         Int_dict = self.intensities
         Guinier_dict = {}
         Guinier_score = {}
@@ -9,16 +9,25 @@
 ###################################
 import pandas as pd
 import os
-from mmcif_io import GetInputInformation
+from concurrent.futures import ThreadPoolExecutor
+from mmcif_io import GetInputInformation, ParsedSystem
 import sas
-from bokeh.io import output_file, export_svg
+import static_export
+from bokeh.io import output_file
+from static_export import export_svg
 from bokeh.models import Span, ColumnDataSource
 from bokeh.plotting import figure, save
 from bokeh.layouts import column, gridplot
 
+def _plot_worker(task: tuple) -> None:
+    func, args = task
+    func(*args)
+
+
 class SasValidationPlots(sas.SasValidation):
-    def __init__(self, mmcif_file, imageDirName, driver):
-        super().__init__(mmcif_file)
+    def __init__(self, mmcif_file, imageDirName, driver,
+                 db='.', parsed: ParsedSystem = None, cache=None):
+        super().__init__(mmcif_file, db=db, parsed=parsed, cache=cache)
         self.ID = str(GetInputInformation.get_id(self))
         # self.intensities = self.get_intensities()
         # self.intensities = self.modify_intensity()
@@ -35,6 +44,19 @@ class SasValidationPlots(sas.SasValidation):
         self.filename = os.path.join(self.imageDirName)
         self.driver = driver
 
+    def __getstate__(self) -> dict:
+        '''
+        figures only need the entry ID and output directory,
+        tasks are sent to workers without the parsed data
+        '''
+        return {'ID': self.ID, 'imageDirName': self.imageDirName,
+                'filename': self.filename}
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        # Every worker renders with its own browser
+        self.driver = static_export.get_worker_driver()
+
     def plot_intensities(self, sasbdb: str, df: pd.DataFrame):
         '''
         plot intensities with errors
@@ -342,21 +364,26 @@ class SasValidationPlots(sas.SasValidation):
         export_svg(p, filename=self.filename+'/'+self.ID+sasbdb+"guinier.svg", webdriver=self.driver)
 
 
-    def plot_multiple(self):
+    def get_multiple_tasks(self) -> list:
+        tasks = []
         for sasbdb, df in self.df_dict.items():
-            self.plot_intensities(sasbdb, df)
-            self.plot_intensities_log(sasbdb, df)
-            self.plot_kratky(sasbdb, df)
-            self.plot_porod_debye(sasbdb, df)
-            self.plot_pddf_int_rwt(sasbdb, df,
-                                   self.pdf_ext_dict[sasbdb],
-                                   self.pdf_dict_err[sasbdb])
-
-    def plot_Guinier(self):
-        for sasbdb, df in self.gdf.items():
-            self.Guinier_plot_fit_rwt(sasbdb, df, self.score[sasbdb])
-
-    def plot_pf(self):
+            tasks.extend([
+                (self.plot_intensities, (sasbdb, df)),
+                (self.plot_intensities_log, (sasbdb, df)),
+                (self.plot_kratky, (sasbdb, df)),
+                (self.plot_porod_debye, (sasbdb, df)),
+                (self.plot_pddf_int_rwt, (sasbdb, df,
+                                          self.pdf_ext_dict[sasbdb],
+                                          self.pdf_dict_err[sasbdb])),
+            ])
+        return tasks
+
+    def get_Guinier_tasks(self) -> list:
+        return [(self.Guinier_plot_fit_rwt, (sasbdb, df, self.score[sasbdb]))
+                for sasbdb, df in self.gdf.items()]
+
+    def get_pf_tasks(self) -> list:
+        tasks = []
         for sasbdb, df in self.pdf_dict.items():
             sascif = self.sascif_dicts[sasbdb]
             main = f'{sasbdb}_MAIN'
@@ -371,14 +398,72 @@ class SasValidationPlots(sas.SasValidation):
             except ValueError:
                 Rg = None
 
-            self.plot_pddf(sasbdb, df,
-                           Rg=Rg, Dmax=Dmax)
+            tasks.append((self.plot_pddf, (sasbdb, df, Rg, Dmax)))
+        return tasks
 
-    def plot_fits(self):
+    def get_fits_tasks(self) -> list:
+        tasks = []
         for sasbdb, df in self.fdf_dict.items():
             for sasdb_m, df_m in df.items():
                 if not df_m[1].empty:
-                    self.plot_fit_rwt(sasbdb, sasdb_m, df_m[0], df_m[1])
+                    tasks.append((self.plot_fit_rwt,
+                                  (sasbdb, sasdb_m, df_m[0], df_m[1])))
+        return tasks
+
+    def get_plot_tasks(self, fits: bool = True) -> list:
+        '''
+        all SAS figures as a list of (function, arguments);
+        figures are independent of each other
+        '''
+        tasks = self.get_multiple_tasks() + self.get_pf_tasks() + \
+            self.get_Guinier_tasks()
+        if fits:
+            tasks += self.get_fits_tasks()
+        return tasks
+
+    @staticmethod
+    def run_tasks(tasks: list) -> None:
+        for func, args in tasks:
+            func(*args)
+
+    def plot_multiple(self):
+        self.run_tasks(self.get_multiple_tasks())
+
+    def plot_Guinier(self):
+        self.run_tasks(self.get_Guinier_tasks())
+
+    def plot_pf(self):
+        self.run_tasks(self.get_pf_tasks())
+
+    def plot_fits(self):
+        self.run_tasks(self.get_fits_tasks())
+
+    def plot_all(self, fits: bool = True, jobs: int = None, pool=None) -> int:
+        '''
+        render all SAS figures in parallel. With matplotlib, figures are
+        drawn by jobs threads. With a browser, figures are sent to pool,
+        the worker pool of the run where every worker has its own browser
+        (see static_export.init_render_worker); without a pool they are
+        rendered one by one with the browser of the run.
+        Returns number of figures.
+        '''
+        tasks = self.get_plot_tasks(fits)
+        if jobs is None:
+            jobs = os.cpu_count()
+        jobs = max(1, min(jobs, len(tasks)))
+
+        if self.driver is not None and pool is not None:
+            for _ in pool.imap_unordered(_plot_worker, tasks):
+                pass
+        elif self.driver is None and jobs > 1:
+            # matplotlib figures do not share state
+            with ThreadPoolExecutor(max_workers=jobs) as executor:
+                for future in [executor.submit(func, *args)
+                               for func, args in tasks]:
+                    future.result()
+        else:
+            self.run_tasks(tasks)
+        return len(tasks)
 
     def plot_fit_rwt(self, sasbdb: str, fit: int, score: float, df: pd.DataFrame):
         '''
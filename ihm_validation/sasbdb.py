@@ -0,0 +1,347 @@
+###################################
+# Script :
+# 1) Contains local mirror of SASBDB
+# SASCIF files with an on-disk index
+# and concurrent fetching of missing files
+# 2) Contains cache of parsed SASCIF files
+# in a columnar format
+#
+###################################
+import importlib.util
+import json
+import logging
+import os
+import re
+import sys
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from pathlib import Path
+
+import numpy as np
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+DB_NAME = 'SASBDB'
+SASCIF_URL = 'https://sasbdb.org/media/sascif/sascif_files/'
+
+# SASBDB codes in the header of an mmCIF file
+SASBDB_CODE = re.compile(r'\bSASD[A-Z0-9]{3}\b')
+
+# Version of the parsed SASCIF cache format, part of the cache key
+SASCIF_CACHE_VERSION = 2
+# Key of a reference to a numeric column in the cache layout
+COLUMN = '__column__'
+# Numeric data columns of SASCIF loops stored as float arrays.
+# Other items (ids, ordinals, codes) are kept as parsed strings
+NUMERIC_COLUMNS = {
+    '_sas_scan_intensity': ('momentum_transfer', 'intensity',
+                            'intensity_su_counting'),
+    '_sas_model_fitting': ('momentum_transfer', 'intensity', 'fit'),
+    '_sas_p_of_R': ('r', 'P', 'P_error'),
+    '_sas_p_of_R_extrapolated_intensity': ('momentum_transfer', 'intensity_reg'),
+}
+
+
+def get_sasbdb_codes(mmcif_file) -> list:
+    '''
+    SASBDB codes mentioned in an mmCIF file before the coordinates.
+    Used to prefetch data without parsing the file
+    '''
+    codes = set()
+    with open(mmcif_file, encoding='utf-8', errors='replace') as f:
+        for line in f:
+            if line.startswith('_atom_site.'):
+                break
+            codes.update(SASBDB_CODE.findall(line))
+    return sorted(codes)
+
+
+class SasbdbMirror(object):
+    """
+    Local copy of SASBDB SASCIF files.
+
+    Available codes are kept in an index file next to the mirror, which
+    is rebuilt with a single directory scan when the mirror changes.
+    Missing files are fetched concurrently over one pooled HTTP session
+    with bounded retries and stored in the mirror for later runs.
+    """
+
+    def __init__(self, root, url: str = SASCIF_URL, jobs: int = 8,
+                 timeout: float = 30, retries: int = 3,
+                 backoff_factor: float = 0.5):
+        """
+        root: directory with SASCIF files
+        url: base URL of SASCIF files
+        jobs: number of concurrent downloads
+        timeout: timeout of one request in seconds
+        retries: number of retries of failed requests
+        """
+        self.root = Path(root)
+        self.url = url
+        self.timeout = timeout
+        self.index_file = Path(self.root.parent, f'{self.root.name}.index.json')
+        self.download_dir = self.root
+        self._tmpdir = None
+        try:
+            self.root.mkdir(parents=True, exist_ok=True)
+        except OSError:
+            pass
+        if not os.access(self.root, os.W_OK):
+            # Read-only mirror, keep downloads in a private directory
+            # until the mirror is closed
+            logging.warning(f'{self.root} is not writable, '
+                            'SASCIF files will not be stored')
+            self._tmpdir = tempfile.TemporaryDirectory(prefix='sasbdb-')
+            self.download_dir = Path(self._tmpdir.name)
+
+        self.session = requests.Session()
+        retry = Retry(total=retries, backoff_factor=backoff_factor,
+                      status_forcelist=(429, 500, 502, 503, 504))
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=jobs,
+                              max_retries=retry)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        self._executor = ThreadPoolExecutor(max_workers=jobs)
+        self._lock = threading.Lock()
+        self._pending = {}
+        self.codes = self.load_index()
+
+    def scan(self) -> set:
+        return {entry.name[:-len('.sascif')] for entry in os.scandir(self.root)
+                if entry.name.endswith('.sascif')}
+
+    def load_index(self) -> set:
+        """Codes in the mirror, from the index file if it is up to date"""
+        try:
+            mtime = self.root.stat().st_mtime_ns
+        except FileNotFoundError:
+            return set()
+
+        try:
+            with open(self.index_file) as f:
+                index = json.load(f)
+            if index['mtime'] == mtime:
+                return set(index['codes'])
+        except (OSError, ValueError, KeyError):
+            pass
+
+        codes = self.scan()
+        self.save_index(codes, mtime)
+        return codes
+
+    def save_index(self, codes: set, mtime: int) -> None:
+        tmp = f'{self.index_file}.{os.getpid()}.tmp'
+        try:
+            with open(tmp, 'w') as f:
+                json.dump({'mtime': mtime, 'codes': sorted(codes)}, f)
+            os.replace(tmp, self.index_file)
+        except OSError as e:
+            logging.info(f'Unable to write SASBDB index {self.index_file}: {e}')
+
+    def path(self, code: str) -> Path:
+        return Path(self.root, f'{code}.sascif')
+
+    def fetch(self, code: str):
+        """Download one SASCIF file, returns its path or None"""
+        fn = Path(self.download_dir, f'{code}.sascif')
+        tmp = f'{fn}.{threading.get_ident()}.tmp'
+        try:
+            with self.session.get(f'{self.url}{code}.sascif',
+                                  timeout=self.timeout, stream=True) as response:
+                if response.status_code != 200:
+                    logging.error(f'Unable to fetch {code} from SASBDB '
+                                  f'(HTTP {response.status_code}), '
+                                  'please check the entry ID')
+                    return None
+                with open(tmp, 'wb') as f:
+                    for chunk in response.iter_content(chunk_size=1 << 16):
+                        f.write(chunk)
+            os.replace(tmp, fn)
+        except (requests.RequestException, OSError) as e:
+            logging.error(f'Unable to fetch {code} from SASBDB: {e}')
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+            return None
+
+        logging.info(f'Fetched {code} from SASBDB')
+        if self.download_dir == self.root:
+            with self._lock:
+                self.codes.add(code)
+        return fn
+
+    def prefetch(self, codes: list) -> None:
+        """Start downloading codes missing in the mirror"""
+        with self._lock:
+            for code in codes:
+                if code in self.codes or code in self._pending:
+                    continue
+                self._pending[code] = self._executor.submit(self.fetch, code)
+
+    def prefetch_files(self, mmcif_files: list) -> threading.Thread:
+        """
+        Start prefetching SASBDB data of mmCIF files in the background,
+        files are scanned in the order they will be validated
+        """
+        def run():
+            for mmcif_file in mmcif_files:
+                try:
+                    self.prefetch(get_sasbdb_codes(mmcif_file))
+                except OSError as e:
+                    logging.info(f'Skipping prefetch for {mmcif_file}: {e}')
+                except RuntimeError:
+                    # Mirror was closed
+                    break
+
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        return thread
+
+    def get(self, code: str):
+        """
+        Path of the SASCIF file of code, waits for a pending
+        download or fetches the file. Returns None if not available
+        """
+        with self._lock:
+            future = self._pending.get(code)
+            known = code in self.codes
+        if known:
+            return self.path(code)
+        if future is None:
+            # Added since the index was built
+            if self.path(code).is_file():
+                return self.path(code)
+            self.prefetch([code])
+            with self._lock:
+                future = self._pending[code]
+
+        return future.result()
+
+    def close(self) -> None:
+        """Stop downloads, update the index and remove temporary files"""
+        self._executor.shutdown(wait=True, cancel_futures=True)
+        self.session.close()
+        if self._tmpdir is not None:
+            self._tmpdir.cleanup()
+        try:
+            self.save_index(self.codes, self.root.stat().st_mtime_ns)
+        except OSError:
+            pass
+
+
+def get_sascif_reader():
+    '''
+    import the SASCIF reader of sasciftools on first use. Its mmCif
+    package is not importable from the sasciftools package itself
+    '''
+    spec = importlib.util.find_spec('sasciftools')
+    if spec is None:
+        raise ImportError('sasciftools is required for SAS validation')
+    saspath = str(Path(list(spec.submodule_search_locations)[0]))
+    if saspath not in sys.path:
+        sys.path.insert(0, saspath)
+    from mmCif import mmcifIO
+    return mmcifIO.CifFileReader()
+
+
+def to_columns(sascif: dict) -> (dict, np.ndarray):
+    '''
+    split a parsed SASCIF file into a layout, which keeps all strings,
+    and one array with the NUMERIC_COLUMNS of all datasets concatenated.
+    Columns are replaced with {COLUMN: [offset, length]} in the layout
+    '''
+    columns = []
+    offset = 0
+
+    def convert_column(node):
+        nonlocal offset
+        if not isinstance(node, list) or len(node) == 0:
+            return node
+        try:
+            values = np.array(node, dtype=float)
+        except (TypeError, ValueError):
+            # Missing values, keep as is
+            return node
+        columns.append(values)
+        ref = {COLUMN: [offset, len(values)]}
+        offset += len(values)
+        return ref
+
+    def convert(node, numeric=()):
+        if not isinstance(node, dict):
+            return node
+        return {k: convert_column(v) if k in numeric
+                else convert(v, NUMERIC_COLUMNS.get(k, ()))
+                for k, v in node.items()}
+
+    layout = convert(sascif)
+    data = np.concatenate(columns) if columns else np.empty(0)
+    return layout, data
+
+
+def from_columns(layout: dict, data: np.ndarray) -> dict:
+    '''
+    rebuild a parsed SASCIF file from its layout, numeric columns
+    are views of data
+    '''
+    if isinstance(layout, dict):
+        if COLUMN in layout:
+            start, length = layout[COLUMN]
+            return data[start:start + length]
+        return {k: from_columns(v, data) for k, v in layout.items()}
+    return layout
+
+
+def read_sascif(filename, key: str, cache_dir: str = None) -> dict:
+    '''
+    parse a SASCIF file, NUMERIC_COLUMNS are returned as float arrays.
+    If cache_dir is given, the parsed file is stored as a layout (JSON)
+    and numeric columns (NPY) under key, typically SASBDB code and file
+    hash, and later memory mapped instead of parsed again
+    '''
+    if cache_dir is None:
+        return from_columns(*to_columns(get_sascif_reader().read(str(filename))))
+
+    base = Path(cache_dir, key[-2:], f'{key}-v{SASCIF_CACHE_VERSION}')
+    layout_fn = Path(f'{base}.json')
+    data_fn = Path(f'{base}.npy')
+    try:
+        with open(layout_fn) as f:
+            layout = json.load(f)
+        data = np.load(data_fn, mmap_mode='r')
+        logging.info(f'Found parsed {Path(filename).name} in the cache')
+        return from_columns(layout, data)
+    except (OSError, ValueError):
+        pass
+
+    sascif = get_sascif_reader().read(str(filename))
+    layout, data = to_columns(sascif)
+    try:
+        base.parent.mkdir(parents=True, exist_ok=True)
+        # The layout is written last and marks a complete entry
+        tmp = f'{base}.{os.getpid()}.tmp'
+        with open(tmp, 'wb') as f:
+            np.save(f, data)
+        os.replace(tmp, data_fn)
+        with open(tmp, 'w') as f:
+            json.dump(layout, f)
+        os.replace(tmp, layout_fn)
+    except OSError as e:
+        logging.warning(f'Unable to cache parsed {filename}: {e}')
+    # Same types as from the cache
+    return from_columns(layout, data)
+
+
+@lru_cache(maxsize=None)
+def _get_mirror(root: str) -> SasbdbMirror:
+    return SasbdbMirror(root)
+
+
+def get_mirror(db: str = '.') -> SasbdbMirror:
+    """SASBDB mirror in the databases root db, shared by the process"""
+    return _get_mirror(str(Path(db, DB_NAME).resolve()))
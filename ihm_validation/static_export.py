@@ -0,0 +1,525 @@
+###################################
+# Script :
+# 1) Contains functions to export
+# bokeh figures as static SVG/PNG
+# images with or without a browser
+#
+###################################
+import re
+import sys
+import signal
+import dataclasses
+from multiprocessing.util import Finalize
+from pathlib import Path
+import numpy as np
+import profiling
+
+# bokeh sizes are in screen pixels
+DPI = 96.
+PX_TO_PT = 72. / DPI
+
+LEGEND_LOCATIONS = {
+    'top_left': 'upper left', 'top_center': 'upper center',
+    'top_right': 'upper right', 'center_left': 'center left',
+    'center': 'center', 'center_right': 'center right',
+    'bottom_left': 'lower left', 'bottom_center': 'lower center',
+    'bottom_right': 'lower right',
+}
+
+# bokeh markers of Scatter glyphs and their matplotlib equivalents
+MARKERS = {
+    'circle': 'o', 'square': 's', 'triangle': '^', 'inverted_triangle': 'v',
+    'diamond': 'D', 'cross': '+', 'x': 'x', 'asterisk': '*',
+}
+
+
+def get_webdriver():
+    '''
+    start headless Firefox for bokeh's SVG export
+    '''
+    from selenium import webdriver
+    firefox_options = webdriver.FirefoxOptions()
+    firefox_options.add_argument('--headless')
+    return webdriver.Firefox(options=firefox_options)
+
+
+# Renderer of a worker process of the run, see init_render_worker
+_worker_browser = False
+_worker_driver = None
+
+
+def _exit_worker(signum, frame):
+    sys.exit(1)
+
+
+def init_render_worker(browser: bool) -> None:
+    '''
+    initializer of the worker pool of the run. With browser, every worker
+    renders with its own browser, started on first use by get_worker_driver
+    '''
+    global _worker_browser
+    _worker_browser = browser
+    # Pool.terminate() sends SIGTERM, exit normally to run finalizers
+    # and quit the browser
+    signal.signal(signal.SIGTERM, _exit_worker)
+
+
+def get_worker_driver():
+    '''
+    browser of this worker process, None for matplotlib rendering.
+    The browser is quit when the worker exits
+    '''
+    global _worker_driver
+    if _worker_browser and _worker_driver is None:
+        _worker_driver = get_webdriver()
+        Finalize(None, _worker_driver.quit, exitpriority=10)
+    return _worker_driver
+
+
+@profiling.timed('export_svg')
+def export_svg(obj, filename: str, webdriver=None, height: int = None,
+               width: int = None) -> list:
+    '''
+    export a bokeh figure or layout as a static image.
+    If a webdriver is given, the figure is rendered by the browser
+    with bokeh's own export, otherwise it is drawn with matplotlib
+    from the same data sources without a browser. The matplotlib
+    renderer raises NotImplementedError for glyphs and properties
+    it can not draw faithfully.
+    '''
+    if webdriver is not None:
+        from bokeh.io import export_svg as bokeh_export_svg
+        return bokeh_export_svg(obj, filename=filename, webdriver=webdriver,
+                                height=height, width=width)
+
+    fig = render_matplotlib(obj, height=height, width=width)
+    fmt = Path(filename).suffix.lstrip('.') or 'svg'
+    fig.savefig(filename, format=fmt, dpi=DPI, bbox_inches='tight')
+    return [filename]
+
+
+def render_matplotlib(obj, height: int = None, width: int = None):
+    '''
+    draw a bokeh plot or a column-like layout of plots
+    into a matplotlib figure
+    '''
+    # Figure is used directly instead of pyplot, so rendering
+    # does not touch global state and is safe to run in threads
+    from matplotlib.figure import Figure
+
+    items = list(_walk_layout(obj))
+    plots = [x for kind, x in items if kind == 'plot']
+    titles = [x for kind, x in items if kind == 'div']
+
+    if len(plots) == 0:
+        fig = Figure(figsize=((width or 600) / DPI, (height or 100) / DPI))
+        fig.suptitle('\n'.join(titles), fontweight='bold')
+        return fig
+
+    w = width or max(_plot_width(p) for p in plots)
+    plot_heights = [_plot_height(p) for p in plots]
+    h = height or sum(plot_heights) + 40 * len(titles)
+
+    fig = Figure(figsize=(w / DPI, h / DPI), layout='constrained')
+    axes = fig.subplots(len(plots), 1, squeeze=False,
+                        gridspec_kw={'height_ratios': plot_heights})[:, 0]
+
+    ranges = {}
+    for ax, plot in zip(axes, plots):
+        # Plots with the same bokeh range share the axis
+        shared = ranges.get(id(plot.x_range))
+        if shared is not None:
+            ax.sharex(shared)
+        else:
+            ranges[id(plot.x_range)] = ax
+        _draw_plot(ax, plot)
+
+    if titles:
+        fig.suptitle('\n'.join(titles), fontsize='x-large',
+                     fontweight='bold')
+
+    return fig
+
+
+def _walk_layout(obj):
+    '''
+    yield ('plot', Plot) and ('div', text) in reading order
+    '''
+    from bokeh.models import Plot, Div, GridBox
+
+    if isinstance(obj, Plot):
+        yield 'plot', obj
+    elif isinstance(obj, Div):
+        text = re.sub(r'<[^>]+>', '', obj.text).strip()
+        if text:
+            yield 'div', text
+    elif isinstance(obj, GridBox):
+        for child, row, col in sorted(obj.children,
+                                      key=lambda x: (x[1], x[2])):
+            yield from _walk_layout(child)
+    elif hasattr(obj, 'children'):
+        for child in obj.children:
+            yield from _walk_layout(child)
+
+
+def _plot_width(plot) -> int:
+    return plot.width or plot.frame_width or 600
+
+
+def _plot_height(plot) -> int:
+    return plot.height or plot.frame_height or 600
+
+
+def _font_size(size, default: float = 10.) -> float:
+    '''
+    convert bokeh font size (e.g. '12pt', '14px') to points
+    '''
+    if size is None:
+        return default
+    m = re.match(r'^\s*([\d.]+)\s*(pt|px|em)?\s*$', str(size))
+    if m is None:
+        return default
+    value, unit = float(m.group(1)), m.group(2)
+    if unit == 'px':
+        return value * PX_TO_PT
+    if unit == 'em':
+        return value * default
+    return value
+
+
+def _unsupported(what: str):
+    return NotImplementedError(f'{what} is not supported by the matplotlib renderer')
+
+
+def _spec(spec, attr: str):
+    '''
+    normalize a bokeh property spec. bokeh 2 returns dicts and bokeh 3
+    Field/Value objects for {'field': ...} or {'value': ...} specs with
+    an optional transform; plain values and column names are kept
+    '''
+    from bokeh.model import Model
+    from bokeh.models import CategoricalColorMapper
+
+    if dataclasses.is_dataclass(spec) and not isinstance(spec, type):
+        # bokeh 3, unset transform and units are sentinel objects
+        kind = type(spec).__name__.lower()
+        items = {f.name: getattr(spec, f.name) for f in dataclasses.fields(spec)}
+        spec = {kind: items.pop(kind, None)}
+        if isinstance(items.get('transform'), Model):
+            spec['transform'] = items['transform']
+        if isinstance(items.get('units'), str):
+            spec['units'] = items['units']
+
+    if not isinstance(spec, dict):
+        return spec
+    if set(spec) - {'field', 'value', 'transform', 'units'} \
+            or ('field' in spec) == ('value' in spec):
+        raise _unsupported(f'Property spec {spec} of {attr}')
+    if spec.get('units', 'screen') != 'screen':
+        raise _unsupported(f'{spec["units"]} units of {attr}')
+    transform = spec.get('transform')
+    if transform is not None and ('field' not in spec or
+                                  not isinstance(transform, CategoricalColorMapper)):
+        raise _unsupported(f'{type(transform).__name__} transform of {attr}')
+    return spec
+
+
+def _column(glyph, attr: str, source, n: int = None):
+    '''
+    resolve a glyph property to a value or a column of the data source.
+    Values are repeated n times if n is given
+    '''
+    spec = _spec(getattr(glyph, attr, None), attr)
+    if isinstance(spec, dict) and 'field' in spec:
+        if spec['field'] not in source.data:
+            raise ValueError(f'Column {spec["field"]} of {attr} '
+                             'is missing in the data source')
+        values = list(source.data[spec['field']])
+        transform = spec.get('transform')
+        if transform is not None:
+            values = [_map_factor(transform, v) for v in values]
+        return values
+    if isinstance(spec, dict):
+        spec = spec['value']
+    elif isinstance(spec, str) and spec in source.data:
+        return list(source.data[spec])
+    if n is not None:
+        return [spec] * n
+    return spec
+
+
+def _value(glyph, attr: str):
+    '''
+    resolve a glyph property that is the same for all points
+    '''
+    spec = _spec(getattr(glyph, attr, None), attr)
+    if isinstance(spec, dict):
+        if 'field' in spec:
+            raise _unsupported(f'Data column {spec["field"]} of {attr}')
+        return spec['value']
+    return spec
+
+
+def _map_factor(mapper, value):
+    '''
+    apply a bokeh CategoricalColorMapper
+    '''
+    key = value
+    if isinstance(value, (tuple, list)):
+        key = tuple(value)[mapper.start:mapper.end]
+        if len(key) == 1:
+            key = key[0]
+    try:
+        index = list(mapper.factors).index(key)
+        return mapper.palette[index % len(mapper.palette)]
+    except ValueError:
+        return mapper.nan_color
+
+
+def _color(color):
+    '''
+    matplotlib does not know bokeh's 'none' value
+    '''
+    if color is None or color == 'none':
+        return 'none'
+    if isinstance(color, tuple) and len(color) == 4 and color[3] > 1:
+        return tuple(c / 255. for c in color)
+    return color
+
+
+def _factor_label(factor) -> str:
+    if isinstance(factor, (tuple, list)):
+        return str(factor[-1])
+    return str(factor)
+
+
+def _factor_positions(factor_range) -> dict:
+    '''
+    bokeh places categorical factors at 0.5, 1.5, ...
+    '''
+    return {f if not isinstance(f, list) else tuple(f): i + 0.5
+            for i, f in enumerate(factor_range.factors)}
+
+
+def _to_coord(values, positions):
+    if positions is None:
+        return np.asarray(values, dtype=float)
+    return np.asarray([positions[tuple(v) if isinstance(v, list) else v]
+                       for v in values], dtype=float)
+
+
+def _draw_plot(ax, plot) -> None:
+    '''
+    draw a single bokeh Plot onto matplotlib axes
+    '''
+    from bokeh.models import (FactorRange, Range1d, GlyphRenderer, Span,
+                              Legend, FixedTicker, Grid)
+    from bokeh.models.glyphs import (HBar, VBar, Circle, Scatter, Line,
+                                     MultiLine)
+    from matplotlib.ticker import MaxNLocator, FixedLocator
+
+    xpos = _factor_positions(plot.x_range) \
+        if isinstance(plot.x_range, FactorRange) else None
+    ypos = _factor_positions(plot.y_range) \
+        if isinstance(plot.y_range, FactorRange) else None
+
+    # Spans may be added as renderers or as annotations
+    renderers = list(plot.renderers)
+    for annotation in plot.center:
+        if isinstance(annotation, Span):
+            renderers.append(annotation)
+        elif not isinstance(annotation, (Grid, Legend)):
+            raise _unsupported(f'Annotation {type(annotation).__name__}')
+
+    artists = {}
+    for r in renderers:
+        if isinstance(r, Span):
+            kwargs = dict(color=_color(r.line_color),
+                          linewidth=r.line_width * PX_TO_PT,
+                          alpha=r.line_alpha)
+            if r.dimension == 'width':
+                ax.axhline(r.location, **kwargs)
+            else:
+                ax.axvline(r.location, **kwargs)
+            continue
+
+        if not isinstance(r, GlyphRenderer):
+            raise _unsupported(f'Renderer {type(r).__name__}')
+        if not r.visible:
+            continue
+
+        glyph = r.glyph
+        source = r.data_source
+
+        if isinstance(glyph, (HBar, VBar)):
+            if isinstance(glyph, HBar):
+                pos = _to_coord(_column(glyph, 'y', source), ypos)
+                end = np.asarray(_column(glyph, 'right', source, len(pos)),
+                                 dtype=float)
+                start = np.asarray(_column(glyph, 'left', source, len(pos)),
+                                   dtype=float)
+                thickness = _column(glyph, 'height', source, len(pos))
+                draw = ax.barh
+            else:
+                pos = _to_coord(_column(glyph, 'x', source), xpos)
+                end = np.asarray(_column(glyph, 'top', source, len(pos)),
+                                 dtype=float)
+                start = np.asarray(_column(glyph, 'bottom', source, len(pos)),
+                                   dtype=float)
+                thickness = _column(glyph, 'width', source, len(pos))
+                draw = ax.bar
+            fill = [_color(c) for c in
+                    _column(glyph, 'fill_color', source, len(pos))]
+            line = [_color(c) for c in
+                    _column(glyph, 'line_color', source, len(pos))]
+            bars = draw(pos, end - start, thickness, start,
+                        color=fill, edgecolor=line,
+                        alpha=_value(glyph, 'fill_alpha'),
+                        linewidth=_value(glyph, 'line_width') * PX_TO_PT)
+            artists[r.id] = list(bars.patches)
+
+        elif isinstance(glyph, (Circle, Scatter)):
+            x = _to_coord(_column(glyph, 'x', source), xpos)
+            y = _to_coord(_column(glyph, 'y', source), ypos)
+            size = np.asarray(_column(glyph, 'size', source, len(x)),
+                              dtype=float)
+            fill = _color(_column(glyph, 'fill_color', source))
+            edge = _color(_column(glyph, 'line_color', source))
+            if isinstance(glyph, Circle) and glyph.radius is not None:
+                raise _unsupported('Circle radius')
+            marker = 'circle'
+            if isinstance(glyph, Scatter):
+                marker = _value(glyph, 'marker')
+            if marker not in MARKERS:
+                raise _unsupported(f'Marker {marker}')
+            artist = ax.scatter(x, y, s=(size * PX_TO_PT) ** 2,
+                                color=fill, edgecolors=edge,
+                                marker=MARKERS[marker],
+                                alpha=_value(glyph, 'fill_alpha'),
+                                linewidths=_value(glyph, 'line_width') * PX_TO_PT)
+            artists[r.id] = [artist]
+
+        elif isinstance(glyph, Line):
+            x = _to_coord(_column(glyph, 'x', source), xpos)
+            y = _to_coord(_column(glyph, 'y', source), ypos)
+            artist, = ax.plot(x, y, color=_color(_value(glyph, 'line_color')),
+                              alpha=_value(glyph, 'line_alpha'),
+                              linewidth=_value(glyph, 'line_width') * PX_TO_PT)
+            artists[r.id] = [artist]
+
+        elif isinstance(glyph, MultiLine):
+            from matplotlib.collections import LineCollection
+            xs = _column(glyph, 'xs', source)
+            ys = _column(glyph, 'ys', source)
+            segments = [np.column_stack([_to_coord(x, xpos),
+                                         _to_coord(y, ypos)])
+                        for x, y in zip(xs, ys)]
+            artist = LineCollection(segments,
+                                    colors=_color(_value(glyph, 'line_color')),
+                                    alpha=_value(glyph, 'line_alpha'),
+                                    linewidths=_value(glyph, 'line_width') * PX_TO_PT)
+            ax.add_collection(artist)
+            ax.autoscale_view()
+            artists[r.id] = [artist]
+
+        else:
+            raise _unsupported(f'Glyph {type(glyph).__name__}')
+
+    # Ranges
+    for factor_pos, set_lim, set_ticks, set_labels, rng in (
+            (xpos, ax.set_xlim, ax.set_xticks, ax.set_xticklabels, plot.x_range),
+            (ypos, ax.set_ylim, ax.set_yticks, ax.set_yticklabels, plot.y_range)):
+        if factor_pos is not None:
+            set_lim(0, len(factor_pos))
+            set_ticks(list(factor_pos.values()))
+            set_labels([_factor_label(f) for f in factor_pos])
+        elif isinstance(rng, Range1d):
+            set_lim(rng.start, rng.end)
+
+    # Group labels of nested categorical factors
+    if ypos is not None:
+        groups = list(dict.fromkeys(f[0] for f in ypos
+                                    if isinstance(f, tuple) and len(f) > 1))
+        if groups:
+            size = getattr(plot.yaxis[0], 'group_text_font_size', None) \
+                if plot.yaxis else None
+            ax.set_ylabel(', '.join(str(g) for g in groups),
+                          fontsize=_font_size(size),
+                          rotation='horizontal', ha='right', va='center')
+
+    # Axes
+    for axis, bokeh_axes, mpl_axis in ((ax.xaxis, plot.xaxis, 'x'),
+                                       (ax.yaxis, plot.yaxis, 'y')):
+        if len(bokeh_axes) == 0:
+            continue
+        baxis = bokeh_axes[0]
+        if not baxis.visible:
+            if mpl_axis == 'x':
+                ax.tick_params(axis='x', labelbottom=False, length=0)
+            else:
+                ax.tick_params(axis='y', labelleft=False, length=0)
+            continue
+        if baxis.axis_label:
+            kwargs = dict(fontsize=_font_size(baxis.axis_label_text_font_size),
+                          fontstyle='italic'
+                          if baxis.axis_label_text_font_style == 'italic'
+                          else 'normal')
+            if mpl_axis == 'x':
+                ax.set_xlabel(baxis.axis_label, **kwargs)
+            else:
+                ax.set_ylabel(baxis.axis_label, **kwargs)
+        ax.tick_params(axis=mpl_axis,
+                       labelsize=_font_size(baxis.major_label_text_font_size))
+        if (mpl_axis == 'x' and xpos is None) or (mpl_axis == 'y' and ypos is None):
+            if isinstance(baxis.ticker, FixedTicker):
+                axis.set_major_locator(FixedLocator(baxis.ticker.ticks))
+            elif hasattr(baxis.ticker, 'desired_num_ticks'):
+                axis.set_major_locator(
+                    MaxNLocator(nbins=baxis.ticker.desired_num_ticks))
+
+    # Grid
+    for grid in plot.xgrid + plot.ygrid:
+        if grid.grid_line_color is not None and grid.visible:
+            ax.grid(True, axis='x' if grid.dimension == 0 else 'y',
+                    color=_color(grid.grid_line_color),
+                    linewidth=grid.grid_line_width * PX_TO_PT)
+    ax.set_axisbelow(True)
+
+    # Title
+    if plot.title is not None and plot.title.text:
+        ax.set_title(plot.title.text,
+                     fontsize=_font_size(plot.title.text_font_size, 13 * PX_TO_PT),
+                     loc={'left': 'left', 'right': 'right'}.get(
+                         plot.title.align, 'center'))
+
+    # Legends
+    for legend in plot.select(type=Legend):
+        handles, labels = [], []
+        for item in legend.items:
+            label = _spec(item.label, 'legend label')
+            if isinstance(label, dict):
+                if 'field' in label:
+                    raise _unsupported(f'Legend label field {label["field"]}')
+                label = label['value']
+            for r in item.renderers:
+                a = artists.get(r.id)
+                if not a:
+                    continue
+                index = item.index if item.index is not None else 0
+                handles.append(a[min(index, len(a) - 1)])
+                labels.append(str(label))
+                break
+        if not handles:
+            continue
+        kwargs = dict(fontsize=_font_size(legend.label_text_font_size),
+                      ncol=len(handles) if legend.orientation == 'horizontal'
+                      else 1)
+        if legend in plot.right:
+            ax.legend(handles, labels, loc='center left',
+                      bbox_to_anchor=(1.02, 0.5), **kwargs)
+        elif isinstance(legend.location, str):
+            ax.legend(handles, labels,
+                      loc=LEGEND_LOCATIONS.get(legend.location, 'best'),
+                      **kwargs)
+        else:
+            ax.legend(handles, labels, **kwargs)
@@ -408,6 +408,18 @@ def all_same(items: list):
     return all(x == items[0] for x in items)
 
 
+def str_to_bool(value: str) -> bool:
+    '''
+    parse yes/no command line values, same as distutils' strtobool
+    '''
+    value = value.lower()
+    if value in ('y', 'yes', 't', 'true', 'on', '1'):
+        return True
+    if value in ('n', 'no', 'f', 'false', 'off', '0'):
+        return False
+    raise ValueError(f'invalid truth value {value}')
+
+
 def exv_readable_format(exv: dict) -> list:
     '''
     format exv for supplementary/summary table
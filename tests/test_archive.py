@@ -0,0 +1,64 @@
+import os
+import shutil
+import sys
+import tarfile
+import tempfile
+import unittest
+
+path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'ihm_validation'))
+sys.path.insert(0, path)
+import archive
+
+
+class Testing(unittest.TestCase):
+    def write(self, tmpdir, compressor):
+        tree = os.path.join(tmpdir, 'tree')
+        os.makedirs(os.path.join(tree, 'images'), exist_ok=True)
+        with open(os.path.join(tree, 'images', 'plot.svg'), 'w') as f:
+            f.write('<svg/>')
+        with archive.ArchiveWriter(os.path.join(tmpdir, 'entry_html'),
+                                   compressor=compressor, jobs=2) as sink:
+            sink.add_tree('entry', tree)
+            sink.add_text('entry/htmls/main.html', 'main' * 10000)
+            sink.add_file('entry/htmls/static/logo.svg',
+                          os.path.join(tree, 'images', 'plot.svg'))
+        return sink.filename
+
+    def test_compressors(self):
+        for compressor, extension in (('gzip', '.tar.gz'), ('none', '.tar'),
+                                      ('xz', '.tar.xz')):
+            if compressor == 'xz' and shutil.which('xz') is None:
+                continue
+            with self.subTest(compressor=compressor), \
+                    tempfile.TemporaryDirectory() as tmpdir:
+                fn = self.write(tmpdir, compressor)
+                self.assertTrue(fn.endswith(extension))
+                # No temporary files are left
+                self.assertEqual(['entry_html' + extension, 'tree'],
+                                 sorted(os.listdir(tmpdir)))
+                with tarfile.open(fn) as tar:
+                    self.assertEqual(['entry', 'entry/images',
+                                      'entry/images/plot.svg',
+                                      'entry/htmls/main.html',
+                                      'entry/htmls/static/logo.svg'],
+                                     tar.getnames())
+                    self.assertEqual(b'main' * 10000,
+                                     tar.extractfile('entry/htmls/main.html').read())
+
+    def test_abort(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            with self.assertRaises(KeyError):
+                with archive.ArchiveWriter(os.path.join(tmpdir, 'entry_html'),
+                                           compressor='gzip') as sink:
+                    sink.add_text('entry/main.html', 'main')
+                    raise KeyError('failed stage')
+            self.assertEqual([], os.listdir(tmpdir))
+
+    def test_unknown(self):
+        with self.assertRaises(ValueError):
+            archive.get_compressor('rar')
+        self.assertIn(archive.get_compressor('auto'), ('gzip', 'pigz'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,46 @@
+import os
+import sys
+import tempfile
+import unittest
+
+path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'ihm_validation'))
+sys.path.insert(0, path)
+from archive import DirectoryWriter
+from assets import AssetStore, find_assets
+
+STATIC = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'static'))
+
+
+class Testing(unittest.TestCase):
+    def test_find_assets(self):
+        page = ('<link rel="stylesheet" href="static/css/main.css">\n'
+                '<link rel="stylesheet" href="/css/layout.css">\n'
+                '<img src="static/images/logon.png">\n'
+                '<img src="static/images/missing.png">\n'
+                '<script src="https://example.org/static/js/main.js"></script>\n')
+        self.assertEqual(['css/main.css', 'images/logon.png'],
+                         find_assets([page, page], STATIC))
+
+    def test_store(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            store = AssetStore(os.path.join(tmpdir, 'cache'), STATIC)
+            refs = ['css/main.css', 'images/logon.png']
+            for report in ('a', 'b'):
+                sink = DirectoryWriter(os.path.join(tmpdir, report))
+                for ref in refs:
+                    sink.add_file(os.path.join('static', ref), store.get(ref))
+            for ref in refs:
+                first = os.path.join(tmpdir, 'a', 'static', ref)
+                second = os.path.join(tmpdir, 'b', 'static', ref)
+                with open(first, 'rb') as f, open(os.path.join(STATIC, ref), 'rb') as g:
+                    self.assertEqual(g.read(), f.read())
+                # Hard linked from the store
+                self.assertTrue(os.path.samefile(first, store.get(ref)))
+                self.assertTrue(os.path.samefile(first, second))
+            # A new store finds resources stored earlier
+            other = AssetStore(os.path.join(tmpdir, 'cache'), STATIC)
+            self.assertEqual(store.get(refs[0]), other.get(refs[0]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,54 @@
+import os
+import sys
+import unittest
+
+path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'ihm_validation'))
+sys.path.insert(0, path)
+from mmcif_io import iter_atom_site_rows
+
+CIF = """data_test
+loop_
+_atom_site.group_PDB
+_atom_site.id
+_atom_site.label_seq_id
+_atom_site.occupancy
+ATOM 1 1 .
+HETATM 2 . 0.5
+
+ATOM 3 2
+#
+_struct.title test
+"""
+
+
+class Testing(unittest.TestCase):
+    def test_fill_defaults(self):
+        columns, before, after = {}, [], []
+        rows = list(iter_atom_site_rows(CIF.splitlines(), columns,
+                                        before, after))
+        self.assertEqual([['data_test'], ['loop_'], ['_atom_site.group_PDB']],
+                         before)
+        self.assertEqual({2: '_atom_site.group_PDB', 3: '_atom_site.id',
+                          4: '_atom_site.label_seq_id',
+                          5: '_atom_site.occupancy',
+                          6: '_atom_site.B_iso_or_equiv'}, columns)
+        self.assertEqual([(6, ['ATOM', '1', '1', '0.67', '1']),
+                          (7, ['HETATM', '2', '7', '0.5', '1']),
+                          (9, ['ATOM', '3', '2', '1', '1'])], rows)
+        self.assertEqual([['#'], ['_struct.title', 'test']], after)
+
+    def test_lazy(self):
+        columns = {}
+        rows = iter_atom_site_rows(iter(CIF.splitlines()), columns)
+        self.assertEqual({}, columns)
+        next(rows)
+        self.assertEqual(5, len(columns))
+
+    def test_no_atom_site(self):
+        columns = {}
+        self.assertEqual([], list(iter_atom_site_rows(['data_test'], columns)))
+        self.assertEqual({}, columns)
+
+
+if __name__ == '__main__':
+    unittest.main(warnings='ignore')
@@ -0,0 +1,53 @@
+import os
+import sys
+import unittest
+
+path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'ihm_validation'))
+sys.path.insert(0, path)
+from mmcif_io import GetInputInformation, ParsedSystem
+
+EXAMPLE = os.path.abspath(os.path.join(os.path.dirname(__file__), '..',
+                                       'example', 'PDBDEV_00000001.cif'))
+
+
+class Testing(unittest.TestCase):
+    def test_shared_between_validators(self):
+        parsed = ParsedSystem(EXAMPLE)
+        first = GetInputInformation(EXAMPLE, parsed=parsed)
+        second = GetInputInformation(EXAMPLE, parsed=parsed)
+        comp = first.get_composition()
+        self.assertIs(comp, second.get_composition())
+        self.assertIs(first.get_dataset_comp(), second.get_dataset_comp())
+        self.assertEqual(first.get_number_of_models(),
+                         len(set(comp['Model ID'])))
+
+    def test_software_references(self):
+        parsed = ParsedSystem(EXAMPLE)
+        first = GetInputInformation(EXAMPLE, parsed=parsed)
+        second = GetInputInformation(EXAMPLE, parsed=parsed)
+        self.assertIs(first.get_software_comp(), second.get_software_comp())
+        # References are available on every validator
+        self.assertIs(first.ref_cit, second.ref_cit)
+
+    def test_invalidate(self):
+        parsed = ParsedSystem(EXAMPLE)
+        inf = GetInputInformation(EXAMPLE, parsed=parsed)
+        nos = inf.get_number_of_models()
+        parsed.system.state_groups.clear()
+        # Stale until the change is reported
+        self.assertEqual(nos, inf.get_number_of_models())
+        parsed.invalidate()
+        self.assertEqual(0, inf.get_number_of_models())
+
+    def test_replaced_system(self):
+        parsed = ParsedSystem(EXAMPLE)
+        inf = GetInputInformation(EXAMPLE, parsed=parsed)
+        self.assertGreater(inf.get_number_of_models(), 0)
+        other = ParsedSystem(EXAMPLE).system
+        other.state_groups.clear()
+        inf.system = other
+        self.assertEqual(0, inf.get_number_of_models())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+import itertools
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+
+path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'ihm_validation'))
+sys.path.insert(0, path)
+import cormap
+
+
+def longest_run(signs) -> int:
+    best = 0
+    for sign, group in itertools.groupby(signs):
+        if sign != 0:
+            best = max(best, len(list(group)))
+    return best
+
+
+class Testing(unittest.TestCase):
+    def test_run_pvalue(self):
+        # Exact probabilities by enumeration of all sequences
+        for n in range(1, 13):
+            counts = np.zeros(n + 2)
+            for seq in itertools.product((-1, 1), repeat=n):
+                counts[longest_run(seq)] += 1
+            for c in range(1, n + 2):
+                expected = counts[c:].sum() / 2 ** n
+                self.assertAlmostEqual(expected, cormap.run_pvalue(n, c), places=12)
+
+    def test_small_pvalue(self):
+        # A single run over all points
+        self.assertAlmostEqual(2.0 ** -199, cormap.run_pvalue(200, 200),
+                               delta=1e-12 * 2.0 ** -199)
+        self.assertGreater(cormap.run_pvalue(1000, 100), 0)
+
+    def test_longest_runs(self):
+        rng = np.random.default_rng(0)
+        first = cormap.pad_curves([rng.normal(size=n) for n in (50, 10, 73, 1)])
+        second = cormap.pad_curves([rng.normal(size=n) for n in (50, 10, 73, 1)])
+        first[0, 5] = second[0, 5]
+        expected = [longest_run(np.nan_to_num(np.sign(a - b)))
+                    for a, b in zip(first, second)]
+        np.testing.assert_array_equal(expected, cormap.longest_runs(first, second))
+
+        runs, pvals = cormap.get_pvalues(first, second)
+        self.assertEqual([cormap.run_pvalue(n, c) for n, c in
+                          zip((50, 10, 73, 1), runs)], list(pvals))
+
+    @unittest.skipUnless(shutil.which('datcmp'), 'ATSAS datcmp is not installed')
+    def test_datcmp(self):
+        rng = np.random.default_rng(1)
+        q = np.linspace(0.01, 3, 300)
+        fit = np.exp(-q ** 2)
+        for shift in (0, 0.002, 0.01):
+            data = fit * (1 + shift) + rng.normal(scale=0.003, size=len(q))
+            with tempfile.TemporaryDirectory() as tmpdir:
+                np.savetxt(os.path.join(tmpdir, 'fit1.csv'),
+                           np.column_stack([q, data]), delimiter=',')
+                np.savetxt(os.path.join(tmpdir, 'fit2.csv'),
+                           np.column_stack([q, fit]), delimiter=',')
+                out = subprocess.run(['datcmp', 'fit1.csv', 'fit2.csv'], cwd=tmpdir,
+                                     stdout=subprocess.PIPE, text=True).stdout
+            lines = [line.split() for line in out.splitlines()]
+            row = [lines[i + 1] for i, line in enumerate(lines) if 'adj' in line][0]
+            # Same column as in SasValidation.get_datcmp_pval
+            _, pvals = cormap.get_pvalues(data, fit)
+            self.assertAlmostEqual(float(row[4]), pvals[0], delta=1e-3)
+
+
+if __name__ == '__main__':
+    unittest.main()
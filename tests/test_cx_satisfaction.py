@@ -0,0 +1,66 @@
+import os
+import sys
+import unittest
+from types import SimpleNamespace
+import pandas as pd
+
+path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'ihm_validation'))
+sys.path.insert(0, path)
+from futures import (get_restraint_satisfaction, get_restraint_group_table,
+                     get_restraint_group_types)
+from cx import CxValidation
+
+
+def make_restraints(rows):
+    columns = ['model_number', 'group_id', 'restraint_type', 'distance_limit',
+               'distance_euclidean', 'group_restraint_all', 'intra_chain',
+               'intra_entity', 'psi', 'sigma1', 'sigma2']
+    return pd.DataFrame(rows, columns=columns)
+
+
+class Testing(unittest.TestCase):
+    def test_restraint_satisfaction(self):
+        data = make_restraints([
+            (1, 1, 'upper bound', 30., 25., False, True, True, None, None, None),
+            (1, 1, 'upper bound', 30., 35., False, True, True, None, None, None),
+            (1, 2, 'lower bound', 30., 35., False, True, True, None, None, None),
+            (1, 3, 'harmonic', 30., 30.5, False, True, True, 0.01, 0.01, 0.01),
+            (1, 3, 'harmonic', 30., 40., False, True, True, 0.01, 0.01, 0.01),
+        ])
+        self.assertEqual([True, False, True, True, False],
+                         list(get_restraint_satisfaction(data)))
+
+    def test_restraint_groups(self):
+        data = make_restraints([
+            # group 1 is satisfied in model 2 only
+            (1, 1, 'upper bound', 30., 35., False, True, True, None, None, None),
+            (2, 1, 'upper bound', 30., 25., False, True, True, None, None, None),
+            # group 2 requires all restraints and is never satisfied
+            (1, 2, 'upper bound', 30., 25., True, False, False, None, None, None),
+            (1, 2, 'upper bound', 30., 35., True, True, False, None, None, None),
+            (2, 2, 'upper bound', 30., 35., True, False, False, None, None, None),
+        ])
+        table = get_restraint_group_table(data)
+        self.assertEqual(4, len(table))
+        self.assertEqual(
+            [(1, 'Self-links/Intramolecular', 1),
+             (2, 'Heteromeric links/Ambiguous', 0)],
+            sorted(get_restraint_group_types(table)))
+
+    def test_model_without_restraints(self):
+        cx = CxValidation.__new__(CxValidation)
+        # Restraints of model 1 only, model 2 has no crosslinks
+        cx.measured_restraints = make_restraints([
+            (1, 1, 'upper bound', 30., 25., False, True, True, None, None, None),
+        ])
+        cx.system = SimpleNamespace(state_groups=[[[['model 1', 'model 2']]]])
+        stats = cx.get_stats_per_model()
+        self.assertEqual({'All': {'satisfied': 1, 'total': 1},
+                          'Self-links/Intramolecular': {'satisfied': 1, 'total': 1}},
+                         stats[1])
+        self.assertEqual({'All': {'satisfied': 0, 'total': 0}}, stats[2])
+        self.assertEqual([100.0], cx.get_per_model_satifaction_rates())
+
+
+if __name__ == '__main__':
+    unittest.main(warnings='ignore')
@@ -0,0 +1,43 @@
+import os
+import sys
+import tempfile
+import unittest
+
+path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'ihm_validation'))
+sys.path.insert(0, path)
+from mmcif_io import GetInputInformation
+
+EXAMPLES = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'example'))
+
+
+class Testing(unittest.TestCase):
+    def test_from_system(self):
+        for name in ('PDBDEV_00000001', 'PDBDEV_00000004'):
+            fn = os.path.join(EXAMPLES, f'{name}.cif')
+            inf = GetInputInformation(fn)
+            self.assertEqual(name.replace('_', ''), inf.get_id())
+            self.assertEqual(inf.get_id(), inf.get_id_from_entry())
+
+    def test_format(self):
+        self.assertEqual('PDBDEV00000001',
+                         GetInputInformation.format_entry_id('PDBDEV_00000001'))
+        self.assertEqual('PDBDEV00000001',
+                         GetInputInformation.format_entry_id('PDBDEV_00000001_x'))
+        self.assertEqual('8ABC', GetInputInformation.format_entry_id('8ABC '))
+
+    def test_header_scan(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            fn = os.path.join(tmpdir, 'test.cif')
+            with open(fn, 'w') as f:
+                f.write("data_model\n_entry.id model\n"
+                        "_struct.title 'Structure irrelevant'\n")
+            self.assertEqual('model', GetInputInformation(fn).get_id())
+
+            with open(fn, 'w') as f:
+                f.write("data_model\n_struct.title 'Structure irrelevant'\n")
+            with self.assertRaises(ValueError):
+                GetInputInformation(fn).get_id()
+
+
+if __name__ == '__main__':
+    unittest.main()
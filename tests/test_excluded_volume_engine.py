@@ -0,0 +1,42 @@
+import os
+import sys
+import unittest
+import numpy as np
+
+path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'ihm_validation'))
+sys.path.insert(0, path)
+from excludedvolume import GetExcludedVolume, count_overlaps
+
+
+def count_overlaps_brute(xyzr):
+    """Reference all-pairs implementation"""
+    violations = 0
+    for i in range(len(xyzr)):
+        d = np.sqrt(np.square(xyzr[i+1:, :3] - xyzr[i, :3]).sum(axis=1))
+        violations += int(((d - (xyzr[i+1:, 3] + xyzr[i, 3])) < 0).sum())
+    return violations
+
+
+class Testing(unittest.TestCase):
+    def test_count_overlaps_matches_all_pairs(self):
+        rng = np.random.default_rng(42)
+        for n in (2, 10, 250):
+            xyzr = np.hstack([rng.uniform(0, 40, (n, 3)),
+                              rng.uniform(0.5, 5, (n, 1))])
+            self.assertEqual(count_overlaps_brute(xyzr), count_overlaps(xyzr))
+
+    def test_count_overlaps_touching(self):
+        # Touching spheres are not a violation
+        xyzr = np.array([[0., 0., 0., 1.], [2., 0., 0., 1.], [0., 1., 0., 1.]])
+        self.assertEqual(1, count_overlaps(xyzr))
+
+    def test_get_exc_vol_given_xyzr(self):
+        ev = GetExcludedVolume.__new__(GetExcludedVolume)
+        xyzr = np.array([[0., 0., 0., 1.], [1., 0., 0., 1.],
+                         [10., 0., 0., 1.], [20., 0., 0., 1.]])
+        self.assertEqual((83.33, 1), ev.get_exc_vol_given_xyzr(xyzr))
+        self.assertEqual((100.0, 0), ev.get_exc_vol_given_xyzr(xyzr[:1]))
+
+
+if __name__ == '__main__':
+    unittest.main(warnings='ignore')
@@ -0,0 +1,36 @@
+import os
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'ihm_validation'))
+sys.path.insert(0, path)
+import ihm_validator
+
+
+class Testing(unittest.TestCase):
+    def test_physics(self):
+        self.assertEqual(['Sequence connectivity', 'Excluded volume'],
+                         ihm_validator.get_physics('yes'))
+        self.assertEqual(1, len(ihm_validator.get_physics('No')))
+
+    def test_validate_entry(self):
+        cwd = os.getcwd()
+        with tempfile.TemporaryDirectory() as tmpdir:
+            Path(tmpdir, 'entry').mkdir()
+            args = ihm_validator.parser.parse_args(
+                ['--output-root', tmpdir, '--cache-root', tmpdir])
+            # Generated files are removed from the working directory
+            os.chdir(tmpdir)
+            try:
+                # Works without globals of the command line script
+                self.assertFalse(
+                    ihm_validator.validate_entry('entry.cif', 'entry', args))
+            finally:
+                os.chdir(cwd)
+            self.assertTrue(Path(tmpdir, 'entry').is_dir())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,49 @@
+import os
+import sys
+import unittest
+
+path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'ihm_validation'))
+sys.path.insert(0, path)
+from molprobity import iter_without_flr_loops
+
+CIF = b"""data_test
+_entry.id test
+loop_
+_flr_dye.id
+_flr_dye.name
+1 Alexa
+;2
+;
+Cy3
+_struct.title 'kept'
+loop_
+_atom_site.id
+_atom_site.type_symbol
+1 C
+2 N
+"""
+
+
+class Testing(unittest.TestCase):
+    def test_drop_flr_loops(self):
+        out = b''.join(iter_without_flr_loops(CIF.splitlines(keepends=True)))
+        self.assertEqual(b"""data_test
+_entry.id test
+_struct.title 'kept'
+loop_
+_atom_site.id
+_atom_site.type_symbol
+1 C
+2 N
+""", out)
+
+    def test_keep_file_without_flr(self):
+        with open(os.path.join(os.path.dirname(__file__), '..', 'example',
+                               'PDBDEV_00000004.cif'), 'rb') as f:
+            raw = f.read()
+        out = b''.join(iter_without_flr_loops(raw.splitlines(keepends=True)))
+        self.assertEqual(raw, out)
+
+
+if __name__ == '__main__':
+    unittest.main(warnings='ignore')
@@ -0,0 +1,109 @@
+import os
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'ihm_validation'))
+sys.path.insert(0, path)
+from molprobity import GetMolprobityInformation
+
+CIF = """data_test
+loop_
+_atom_site.group_PDB
+_atom_site.id
+_atom_site.ihm_model_id
+ATOM 1 2
+ATOM 2 10
+ATOM 3 2
+ATOM 4 1
+#
+_struct.title test
+"""
+
+RAMA = ['residue:score%:phi:psi:evaluation:type',
+        'A   2  SER:99.43:-64.52:145.23:Favored:General',
+        'SUMMARY: 0.00% outliers (Goal: < 0.2%)',
+        'SUMMARY: 100.00% favored (Goal: > 98%)',
+        'SUMMARY: 1 residues']
+
+CLASH = ['Bad Clashes >= 0.4 Angstrom:',
+         ' A   3  LEU HD11  A   7  ILE HD12 :0.512',
+         'clashscore = 12.50']
+
+
+def get_mp(cache, nos=3):
+    mp = GetMolprobityInformation.__new__(GetMolprobityInformation)
+    mp.ID = 'test'
+    mp.cache = cache
+    mp.nos = nos
+    mp._tempfiles = []
+    mp._tempcif = str(Path(cache, 'temp.cif'))
+    with open(mp._tempcif, 'w') as f:
+        f.write(CIF)
+    return mp
+
+
+class Testing(unittest.TestCase):
+    def test_read_models(self):
+        mp = GetMolprobityInformation.__new__(GetMolprobityInformation)
+        prefix, header, rows, suffix = mp.read_models(CIF.splitlines(True))
+        self.assertEqual(['data_test\n', 'loop_\n'], prefix)
+        self.assertEqual(3, len(header))
+        self.assertEqual(['ATOM 1 2\n', 'ATOM 3 2\n'], rows['2'])
+        self.assertEqual(['#\n', '_struct.title test\n'], suffix)
+
+    def test_read_models_no_model_id(self):
+        mp = GetMolprobityInformation.__new__(GetMolprobityInformation)
+        lines = CIF.replace('_atom_site.ihm_model_id',
+                            '_atom_site.type_symbol').splitlines(True)
+        self.assertIsNone(mp.read_models(lines)[2])
+
+    def test_split_models(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            mp = get_mp(tmpdir, nos=2)
+            shards = mp.split_models()
+            # Numeric order, capped to the number of models
+            self.assertEqual([1, 2], list(shards))
+            with open(shards[2]) as f:
+                self.assertEqual(CIF.replace('ATOM 2 10\n', '')
+                                 .replace('ATOM 4 1\n', ''), f.read())
+            mp.cleanup()
+            self.assertFalse(shards[1].parent.exists())
+
+    def test_run_all_sharded(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            mp = get_mp(tmpdir, nos=5)
+            outputs = {'clash': CLASH, 'rama': RAMA, 'rota': RAMA[:3],
+                       'molprobity': ['Molprobity validation']}
+
+            def get_tools():
+                def tool(name):
+                    def run(d, timeout=None, cif=None, cwd=None):
+                        self.assertEqual(Path(cif).parent, Path(cwd))
+                        d[name] = outputs[name]
+                    return run
+                return {name: tool(name) for name in outputs}
+
+            mp.get_tools = get_tools
+            d = {}
+            mp.run_all_sharded(d, jobs=2)
+            self.assertEqual(set(outputs), set(d))
+            # Number of models of the entry is kept
+            self.assertEqual(5, mp.nos)
+            self.assertEqual([1, 2, 10], list(d['rama']))
+            self.assertEqual({1: RAMA[1:2], 2: RAMA[1:2], 10: RAMA[1:2]},
+                             mp.process_rama(d['rama']))
+            clashes = mp.process_clash(d['clash'])
+            self.assertEqual([CLASH[1:2]], clashes['Model 10'])
+            self.assertEqual(([], []), mp.process_molprobity(d['molprobity']))
+
+            summary, total = mp.clash_summary_table(d['clash'])
+            self.assertEqual(['Model 1', 'Model 2', 'Model 10'], summary['Model ID'])
+            self.assertEqual(['12.50'] * 3, summary['Clash score'])
+            self.assertEqual(3, total)
+            mp.cleanup()
+
+
+if __name__ == '__main__':
+    unittest.main(warnings='ignore')
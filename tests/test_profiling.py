@@ -0,0 +1,59 @@
+import json
+import os
+import sys
+import tempfile
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'ihm_validation'))
+sys.path.insert(0, path)
+import profiling
+
+
+@profiling.timed('tool')
+def tool(fn):
+    with open(fn, 'w') as f:
+        f.write('x' * 1000)
+
+
+class Testing(unittest.TestCase):
+    def test_inactive(self):
+        with profiling.timed('stage'):
+            pass
+        self.assertIsNone(profiling._active)
+
+    def test_stages(self):
+        profiler = profiling.Profiler('test.cif')
+        with tempfile.TemporaryDirectory() as tmpdir:
+            with profiler.activate():
+                with profiling.timed('stage'):
+                    tool(Path(tmpdir, 'a'))
+                    with ThreadPoolExecutor(2) as executor:
+                        list(executor.map(tool, [Path(tmpdir, 'b'),
+                                                 Path(tmpdir, 'c')]))
+                with self.assertRaises(ValueError):
+                    with profiling.timed('broken'):
+                        raise ValueError
+
+            self.assertIsNone(profiling._active)
+            fn = Path(tmpdir, 'profile.json')
+            profiler.write(fn)
+            with open(fn) as f:
+                profile = json.load(f)
+
+        self.assertEqual('test.cif', profile['entry'])
+        stages = [(r['name'], r['parent']) for r in profile['stages']]
+        self.assertEqual(('stage', None), stages[0])
+        self.assertEqual([('tool', 'stage')] * 3, stages[1:4])
+        self.assertEqual(('broken', None), stages[4])
+        self.assertTrue(profile['stages'][4]['failed'])
+        self.assertGreaterEqual(profile['total']['wall_time_s'],
+                                profile['stages'][0]['wall_time_s'])
+        if profile['stages'][0]['bytes_written'] is not None:
+            self.assertGreaterEqual(profile['stages'][0]['bytes_written'], 3000)
+        self.assertIn('slowest: stage', profiler.summary())
+
+
+if __name__ == '__main__':
+    unittest.main(warnings='ignore')
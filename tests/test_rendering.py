@@ -0,0 +1,39 @@
+import os
+import sys
+import tempfile
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'ihm_validation'))
+sys.path.insert(0, path)
+import rendering
+
+
+class Testing(unittest.TestCase):
+    def test_environment(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            cache_dir = os.path.join(tmpdir, 'templates')
+            env = rendering.get_environment(cache_dir)
+            self.assertIs(env, rendering.get_environment(cache_dir))
+            self.assertTrue(os.path.isdir(cache_dir))
+            env.get_template('macro.html')
+            # Compiled template is stored for later runs
+            self.assertEqual(1, len(os.listdir(cache_dir)))
+        rendering.get_environment.cache_clear()
+
+    def test_iter_pages(self):
+        names = ['macro.html'] * 3
+        expected = [(name, rendering.render(name, {})) for name in names]
+        self.assertEqual(expected, list(rendering.iter_pages({}, names, jobs=2)))
+
+        # Any pool with imap can render the pages
+        class Pool(ThreadPoolExecutor):
+            def imap(self, func, tasks):
+                return self.map(func, tasks)
+        with Pool() as pool:
+            self.assertEqual(expected,
+                             list(rendering.iter_pages({}, names, pool=pool)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,48 @@
+import os
+import sys
+import tempfile
+import time
+import unittest
+
+path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'ihm_validation'))
+sys.path.insert(0, path)
+from resultcache import ResultCache
+
+
+class Testing(unittest.TestCase):
+    def test_put_get(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            cache = ResultCache(tmpdir)
+            key = cache.key('exv', 'abc', '1')
+            self.assertIsNone(cache.get(key))
+            cache.put(key, {'a': [1, 2]})
+            self.assertEqual({'a': [1, 2]}, cache.get(key))
+            # Different version is a different entry
+            self.assertIsNone(cache.get(cache.key('exv', 'abc', '2')))
+
+    def test_refresh(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            key = ResultCache.key('exv', 'abc')
+            ResultCache(tmpdir).put(key, 1)
+            cache = ResultCache(tmpdir, refresh=True)
+            self.assertEqual(2, cache.get_or_compute(key, lambda: 2))
+            self.assertEqual(2, ResultCache(tmpdir).get(key))
+
+    def test_evict(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            cache = ResultCache(tmpdir)
+            keys = [cache.key('exv', i) for i in range(3)]
+            for i, key in enumerate(keys):
+                cache.put(key, b'x' * 1000)
+                t = time.time() - 100 * (3 - i)
+                os.utime(cache.path(key), (t, t))
+            self.assertEqual(1, cache.evict(max_age=250))
+            self.assertIsNone(cache.get(keys[0]))
+            size = sum(x[1] for x in cache.entries())
+            self.assertEqual(1, cache.evict(max_size=size - 1))
+            self.assertIsNone(cache.get(keys[1]))
+            self.assertIsNotNone(cache.get(keys[2]))
+
+
+if __name__ == '__main__':
+    unittest.main(warnings='ignore')
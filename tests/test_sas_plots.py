@@ -0,0 +1,118 @@
+import os
+import sys
+import pickle
+import tempfile
+import threading
+import unittest
+import multiprocessing as mp
+from unittest import mock
+
+path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'ihm_validation'))
+sys.path.insert(0, path)
+
+try:
+    import pandas as pd
+    import bokeh
+    import matplotlib
+except ImportError:
+    pd = bokeh = matplotlib = None
+
+if bokeh is not None:
+    import static_export
+    from sas_plots import SasValidationPlots
+
+
+def wait(barrier):
+    '''Returns only when all figures are drawn at the same time'''
+    barrier.wait()
+
+
+class FakeDriver(object):
+    def __init__(self, marker):
+        self.marker = marker
+
+    def quit(self):
+        with open(self.marker, 'w'):
+            pass
+
+
+def start_driver(tmpdir):
+    static_export.get_webdriver = lambda: FakeDriver(
+        os.path.join(tmpdir, str(os.getpid())))
+    static_export.get_worker_driver()
+    return os.getpid()
+
+
+def get_plotter(tmpdir, driver=None):
+    plotter = SasValidationPlots.__new__(SasValidationPlots)
+    plotter.ID = 'entry'
+    plotter.imageDirName = tmpdir
+    plotter.filename = tmpdir
+    plotter.driver = driver
+    plotter.df_dict = {'SASDA1': None}
+    return plotter
+
+
+@unittest.skipIf(pd is None or bokeh is None, 'pandas and bokeh are required')
+class Testing(unittest.TestCase):
+    def test_threads(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            plotter = get_plotter(tmpdir)
+            barrier = threading.Barrier(3, timeout=5)
+            with mock.patch.object(plotter, 'get_plot_tasks',
+                                   return_value=[(wait, (barrier,))] * 3):
+                self.assertEqual(3, plotter.plot_all(jobs=3))
+
+            # One by one
+            barrier = threading.Barrier(3, timeout=0.1)
+            with mock.patch.object(plotter, 'get_plot_tasks',
+                                   return_value=[(wait, (barrier,))] * 3):
+                with self.assertRaises(threading.BrokenBarrierError):
+                    plotter.plot_all(jobs=1)
+
+    def test_pool(self):
+        ctx = mp.get_context('fork')
+        df = pd.DataFrame({'Q': [0.1, 0.2], 'logI': [-1.0, -1.5],
+                           'err_x': [[0.1, 0.1], [0.2, 0.2]],
+                           'err_y': [[-1.1, -0.9], [-1.6, -1.4]]})
+        with tempfile.TemporaryDirectory() as tmpdir, ctx.Manager() as manager:
+            # Browser of the run is not used by the workers
+            plotter = get_plotter(tmpdir, driver=object())
+            barrier = manager.Barrier(2, timeout=5)
+            tasks = [(wait, (barrier,))] * 2 + \
+                [(plotter.plot_intensities, ('SASDA1', df))]
+            pool = ctx.Pool(2, initializer=static_export.init_render_worker,
+                            initargs=(False,))
+            try:
+                with mock.patch.object(plotter, 'get_plot_tasks',
+                                       return_value=tasks):
+                    self.assertEqual(3, plotter.plot_all(jobs=2, pool=pool))
+            finally:
+                pool.close()
+                pool.join()
+            with open(os.path.join(tmpdir, 'entrySASDA1intensities.svg')) as f:
+                self.assertIn('<svg', f.read())
+
+    def test_worker_driver(self):
+        ctx = mp.get_context('fork')
+        with tempfile.TemporaryDirectory() as tmpdir:
+            pool = ctx.Pool(2, initializer=static_export.init_render_worker,
+                            initargs=(True,))
+            try:
+                pids = set(pool.map(start_driver, [tmpdir] * 4, chunksize=1))
+            finally:
+                # Browsers are quit also when the pool is terminated
+                pool.terminate()
+                pool.join()
+            self.assertEqual(pids, {int(fn) for fn in os.listdir(tmpdir)})
+
+    def test_pickle(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            plotter = pickle.loads(pickle.dumps(get_plotter(tmpdir, object())))
+            self.assertEqual({'ID': 'entry', 'imageDirName': tmpdir,
+                              'filename': tmpdir, 'driver': None},
+                             plotter.__dict__)
+
+
+if __name__ == '__main__':
+    unittest.main()
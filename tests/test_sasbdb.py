@@ -0,0 +1,175 @@
+import os
+import sys
+import tempfile
+import threading
+import unittest
+from unittest import mock
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'ihm_validation'))
+sys.path.insert(0, path)
+import numpy as np
+import sasbdb
+from sasbdb import SasbdbMirror, get_sasbdb_codes
+
+SASCIF = {
+    'SASDA11_MAIN': {
+        '_sas_scan': {'id': '1', 'unit': '1/nm'},
+        '_sas_scan_intensity': {
+            'id': ['1', '2', '3'],
+            'momentum_transfer': ['0.1', '0.2', '0.3'],
+            'intensity': ['10.5', '8.25', '1e-3'],
+            'flag': ['.', '?', 'x'],
+        },
+    },
+    'SASDA11_FIT1': {
+        '_sas_model_fitting_details': {'chi_square': '1.1'},
+        '_sas_model_fitting': {'fit': ['1', '2']},
+    },
+}
+
+
+class SasbdbHandler(BaseHTTPRequestHandler):
+    '''Stand-in for SASBDB serving server.files, fails once for server.flaky'''
+
+    def do_GET(self):
+        code = self.path.rsplit('/', 1)[-1].replace('.sascif', '')
+        with self.server.lock:
+            self.server.requests.append(code)
+            fail = code in self.server.flaky
+            self.server.flaky.discard(code)
+        if fail:
+            self.send_error(503)
+        elif code in self.server.files:
+            data = self.server.files[code].encode()
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+        else:
+            self.send_error(404)
+
+    def log_message(self, *args):
+        pass
+
+
+class Testing(unittest.TestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), SasbdbHandler)
+        self.server.files = {'SASDA11': 'data_SASDA11\n', 'SASDB22': 'data_SASDB22\n'}
+        self.server.flaky = {'SASDB22'}
+        self.server.requests = []
+        self.server.lock = threading.Lock()
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f'http://127.0.0.1:{self.server.server_port}/sascif/'
+        self.tmpdir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.tmpdir.cleanup()
+
+    def get_mirror(self):
+        return SasbdbMirror(os.path.join(self.tmpdir.name, 'SASBDB'),
+                            url=self.url, jobs=4, timeout=5, backoff_factor=0)
+
+    def test_prefetch(self):
+        mirror = self.get_mirror()
+        mirror.prefetch(['SASDA11', 'SASDB22', 'SASDC33'])
+        fn = mirror.get('SASDB22')
+        with open(fn) as f:
+            self.assertEqual('data_SASDB22\n', f.read())
+        self.assertIsNotNone(mirror.get('SASDA11'))
+        self.assertIsNone(mirror.get('SASDC33'))
+        mirror.close()
+        # Failed request was retried, nothing is fetched twice
+        self.assertEqual(['SASDA11', 'SASDB22', 'SASDB22', 'SASDC33'],
+                         sorted(self.server.requests))
+
+        # Files are stored in the mirror and found in its index
+        mirror = self.get_mirror()
+        self.assertEqual({'SASDA11', 'SASDB22'}, mirror.codes)
+        self.assertEqual(fn, mirror.get('SASDB22'))
+        mirror.close()
+        self.assertEqual(4, len(self.server.requests))
+
+    def test_read_only(self):
+        with mock.patch('sasbdb.os.access', return_value=False):
+            mirror = self.get_mirror()
+        mirror.prefetch(['SASDA11'])
+        fn = mirror.get('SASDA11')
+        # Kept out of the mirror and the working directory until closed
+        self.assertEqual(mirror.download_dir, fn.parent)
+        self.assertNotEqual(mirror.root, fn.parent)
+        self.assertNotEqual(os.getcwd(), str(fn.parent))
+        self.assertEqual(fn, mirror.get('SASDA11'))
+        self.assertEqual(['SASDA11'], self.server.requests)
+        mirror.close()
+        self.assertFalse(fn.parent.exists())
+        self.assertEqual(set(), self.get_mirror().codes)
+
+    def test_index(self):
+        mirror = self.get_mirror()
+        mirror.close()
+        # A file added to the mirror invalidates the index
+        with open(os.path.join(self.tmpdir.name, 'SASBDB', 'SASDA11.sascif'), 'w') as f:
+            f.write('data_SASDA11\n')
+        self.assertEqual({'SASDA11'}, self.get_mirror().codes)
+        self.assertEqual([], self.server.requests)
+
+    def test_codes(self):
+        fn = os.path.join(self.tmpdir.name, 'entry.cif')
+        with open(fn, 'w') as f:
+            f.write('data_model\n'
+                    '_ihm_dataset_related_db_reference.accession_code\n'
+                    '1 1 SASBDB SASDC29 . .\n'
+                    '2 2 SASBDB SASDA11 . .\n'
+                    '_atom_site.id\n'
+                    'SASDZ99\n')
+        self.assertEqual(['SASDA11', 'SASDC29'], get_sasbdb_codes(fn))
+
+    def test_columns(self):
+        layout, data = sasbdb.to_columns(SASCIF)
+        self.assertEqual(8, len(data))
+        sascif = sasbdb.from_columns(layout, data)
+        self.assertEqual(list(SASCIF), list(sascif))
+        scan = sascif['SASDA11_MAIN']['_sas_scan_intensity']
+        np.testing.assert_array_equal([10.5, 8.25, 1e-3], scan['intensity'])
+        # Only known data columns are converted
+        self.assertEqual(['1', '2', '3'], scan['id'])
+        self.assertEqual(['.', '?', 'x'], scan['flag'])
+        self.assertEqual('1.1', sascif['SASDA11_FIT1']['_sas_model_fitting_details']['chi_square'])
+
+    def assertSameSascif(self, first, second):
+        if isinstance(first, dict):
+            self.assertIsInstance(second, dict)
+            self.assertEqual(list(first), list(second))
+            for k in first:
+                self.assertSameSascif(first[k], second[k])
+        elif isinstance(first, np.ndarray):
+            self.assertIsInstance(second, np.ndarray)
+            self.assertEqual(first.dtype, second.dtype)
+            np.testing.assert_array_equal(first, second)
+        else:
+            self.assertEqual(type(first), type(second))
+            self.assertEqual(first, second)
+
+    def test_read_cached(self):
+        reader = mock.Mock()
+        reader.read.return_value = SASCIF
+        cache_dir = os.path.join(self.tmpdir.name, 'sascif')
+        with mock.patch('sasbdb.get_sascif_reader', return_value=reader):
+            uncached = sasbdb.read_sascif('SASDA11.sascif', 'SASDA11-abcd')
+            first = sasbdb.read_sascif('SASDA11.sascif', 'SASDA11-abcd', cache_dir)
+            second = sasbdb.read_sascif('SASDA11.sascif', 'SASDA11-abcd', cache_dir)
+        # Parsed only once with the cache, then memory mapped
+        self.assertEqual(2, reader.read.call_count)
+        intensity = second['SASDA11_MAIN']['_sas_scan_intensity']['intensity']
+        self.assertIsInstance(intensity.base, np.memmap)
+        # Cache hit and miss give the same values of the same types
+        self.assertSameSascif(uncached, first)
+        self.assertSameSascif(first, second)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,143 @@
+import os
+import sys
+import tempfile
+import unittest
+from dataclasses import dataclass
+
+import numpy as np
+
+path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'ihm_validation'))
+sys.path.insert(0, path)
+
+try:
+    import bokeh
+    import matplotlib
+except ImportError:
+    bokeh = matplotlib = None
+
+if bokeh is not None:
+    from bokeh.layouts import column
+    from bokeh.models import (ColumnDataSource, FactorRange, Legend,
+                              LegendItem, LinearColorMapper, Span)
+    from bokeh.palettes import viridis
+    from bokeh.plotting import figure
+    from bokeh.transform import factor_cmap
+    import static_export
+
+
+@dataclass
+class Field:
+    '''Same fields as bokeh 3 property specs'''
+    field: str
+    transform: object = None
+    units: object = None
+
+
+@unittest.skipIf(bokeh is None, 'bokeh and matplotlib are required')
+class Testing(unittest.TestCase):
+    def sas_fit(self):
+        '''Same glyphs and layout as SasValidationPlots.plot_fit_rwt'''
+        q = np.linspace(0.01, 0.3, 50)
+        source = ColumnDataSource({'Q': q, 'logIe': -q, 'logIb': -q * 1.01,
+                                   'rsigma': np.sin(q * 50)})
+        p1 = figure(plot_height=350, plot_width=350, title='Model fit')
+        p1.circle(x='Q', y='logIe', source=source, color='blue',
+                  fill_alpha=0.3, size=3, legend_label='Experimental data')
+        p1.line(x='Q', y='logIb', source=source, color='red',
+                line_width=3, legend_label='Model fit')
+        p1.multi_line([[0.1, 0.1]], [[-0.2, 0]], color='gray', line_width=0.5)
+        p1.xaxis.visible = False
+        p2 = figure(plot_height=150, plot_width=350, x_range=p1.x_range)
+        p2.circle(x='Q', y='rsigma', source=source, color='blue', size=3)
+        p2.renderers.append(Span(location=0, dimension='width',
+                                 line_color='red', line_width=3))
+        p2.yaxis.ticker = [-3, 0, 3]
+        return column(p1, p2)
+
+    def quality_bars(self):
+        '''Same glyphs as the bar charts of GetPlots.plot_quality_at_glance'''
+        scores = ['Clashscore', 'Ramachandran outliers', 'Sidechain outliers']
+        y = [('Model 1', score) for score in scores]
+        p = figure(y_range=FactorRange(*y), x_range=(0, 10),
+                   plot_height=120, plot_width=700)
+        p.hbar(y=y, right=[1, 2, 3], width=0.9, line_color='white',
+               fill_color=factor_cmap('y', palette=viridis(3), factors=scores,
+                                      start=1, end=2))
+
+        labels = ['Fit 1', 'Fit 2']
+        source = ColumnDataSource({'Scores': labels, 'counts': [1.5, 2.5],
+                                   'color': viridis(2)})
+        pf = figure(y_range=labels, x_range=(0, 3.5), plot_height=450,
+                    plot_width=800, title='Fit to SAS Data')
+        rf = pf.hbar(y='Scores', right='counts', color='color', height=0.5,
+                     source=source, alpha=0.8, line_color='black')
+        pf.add_layout(Legend(items=[LegendItem(label=label, renderers=[rf], index=i)
+                                    for i, label in enumerate(labels)]), 'right')
+        return p, pf
+
+    def test_sas(self):
+        fig = static_export.render_matplotlib(self.sas_fit())
+        top, bottom = fig.axes
+        self.assertEqual(3, len(top.collections) + len(top.lines))
+        self.assertEqual(['Experimental data', 'Model fit'],
+                         [t.get_text() for t in top.get_legend().get_texts()])
+        # Residuals share the q axis, the zero line is drawn
+        self.assertIn(top, bottom.get_shared_x_axes().get_siblings(bottom))
+        self.assertEqual(1, len(bottom.lines))
+        self.assertEqual([-3, 0, 3], list(bottom.get_yticks()))
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            fn = os.path.join(tmpdir, 'fit.svg')
+            self.assertEqual([fn], static_export.export_svg(self.sas_fit(), fn))
+            with open(fn) as f:
+                self.assertIn('<svg', f.read())
+
+    def test_bars(self):
+        p, pf = self.quality_bars()
+        ax, = static_export.render_matplotlib(p).axes
+        self.assertEqual([1, 2, 3], [bar.get_width() for bar in ax.patches])
+        # Colors of the nested factors from the color mapper
+        colors = [matplotlib.colors.to_hex(bar.get_facecolor()) for bar in ax.patches]
+        self.assertEqual([c.lower() for c in viridis(3)], colors)
+        self.assertEqual(['Clashscore', 'Ramachandran outliers', 'Sidechain outliers'],
+                         [t.get_text() for t in ax.get_yticklabels()])
+
+        ax, = static_export.render_matplotlib(pf).axes
+        self.assertEqual([1.5, 2.5], [bar.get_width() for bar in ax.patches])
+        self.assertEqual(['Fit 1', 'Fit 2'],
+                         [t.get_text() for t in ax.get_legend().get_texts()])
+
+    def test_spec(self):
+        # bokeh 3 returns objects instead of dicts
+        mapper = factor_cmap('y', palette=['red'], factors=['a'])['transform']
+        spec = static_export._spec(Field('y', transform=mapper), 'fill_color')
+        self.assertEqual({'field': 'y', 'transform': mapper}, spec)
+        self.assertEqual({'field': 'y'}, static_export._spec(Field('y'), 'x'))
+
+    def test_unsupported(self):
+        # Rays of the CX distograms
+        p = figure()
+        p.ray(x=1, y=0, angle=np.pi / 2)
+        with self.assertRaises(NotImplementedError):
+            static_export.render_matplotlib(p)
+
+        p = figure()
+        p.scatter(x=[1, 2], y=[1, 2], marker='hex')
+        with self.assertRaises(NotImplementedError):
+            static_export.render_matplotlib(p)
+
+        p = figure()
+        p.circle(x='x', y='y', fill_color={'field': 'y', 'transform':
+                                           LinearColorMapper(palette=['red'])},
+                 source=ColumnDataSource({'x': [1], 'y': [1]}))
+        with self.assertRaises(NotImplementedError):
+            static_export.render_matplotlib(p)
+
+        p = figure()
+        p.circle(x=[1], y=[1], radius=0.5)
+        with self.assertRaises(NotImplementedError):
+            static_export.render_matplotlib(p)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,52 @@
+import os
+import sys
+import tempfile
+import unittest
+
+path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'ihm_validation'))
+sys.path.insert(0, path)
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'benchmarks')))
+import synthetic
+from mmcif_io import GetInputInformation, ParsedSystem
+from excludedvolume import GetExcludedVolume
+from cx import CxValidation
+
+
+class Testing(unittest.TestCase):
+    def test_entry(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            fn = synthetic.write_entry(
+                os.path.join(tmpdir, 'entry.cif'), beads=60, models=4,
+                crosslinks=20, chains=2, model_groups=2, atomic=5,
+                rigid_bodies=2)
+            parsed = ParsedSystem(fn)
+
+            info = GetInputInformation(fn, parsed=parsed)
+            self.assertEqual(4, info.get_number_of_models())
+
+            exv = GetExcludedVolume(fn, tmpdir, parsed=parsed, jobs=1)
+            spheres = exv.get_all_spheres()
+            self.assertEqual([1, 2, 3, 4], sorted(spheres))
+            # Atomic residues have no beads
+            self.assertEqual(50, len(spheres[1]))
+            result = exv.run_exc_vol_parallel(spheres)
+            self.assertEqual(4, len(result['Models']))
+
+            cx = CxValidation(fn, parsed=parsed)
+            self.assertEqual(20, cx.get_number_of_restraints())
+            self.assertEqual(4, len(cx.get_stats_per_model()))
+
+    def test_atomic_chain(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            fn = synthetic.write_entry(os.path.join(tmpdir, 'atomic.cif'),
+                                       beads=10, models=1, crosslinks=0,
+                                       chains=1, atomic=10)
+            info = GetInputInformation(fn)
+            self.assertEqual(1, info.get_number_of_models())
+
+        with self.assertRaises(ValueError):
+            synthetic.make_system(beads=10, chains=1, atomic=10, rigid_bodies=1)
+
+
+if __name__ == '__main__':
+    unittest.main()